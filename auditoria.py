@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Auditoría de cambios hechos por las operadoras (WhatsApp o consola).
+
+Cada cambio es una línea JSON en el auditoria.jsonl del salón:
+    {"ts": "2025-01-15T10:32:05", "salon": "+14155238886", "origen": "whatsapp",
+     "actor": "+573001112233", "accion": "actualizar", "clienta_id": 7,
+     "campo": "telefono", "antes": "+57300...", "despues": "+57311..."}
+
+- auditar() sólo encola el registro (O(1)); un hilo en segundo plano escribe
+  en lotes cada AUDITORIA_FLUSH_SEG segundos, así el webhook no espera disco.
+- Cuando el archivo supera AUDITORIA_MAX_BYTES se rota a
+  auditoria.jsonl.AAAAMMDD-HHMMSS-ffffff.gz (comprimido) y se conservan los últimos
+  AUDITORIA_SEGMENTOS segmentos.
+- Al terminar el proceso se escribe lo que quede pendiente.
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from bloqueos import bloqueo_archivo
+
+AUDITORIA_MAX_BYTES = int(os.getenv("AUDITORIA_MAX_BYTES", str(5 * 1024 * 1024)))
+AUDITORIA_SEGMENTOS = int(os.getenv("AUDITORIA_SEGMENTOS", "10"))
+AUDITORIA_FLUSH_SEG = float(os.getenv("AUDITORIA_FLUSH_SEG", "1"))
+AUDITORIA_LOTE = int(os.getenv("AUDITORIA_LOTE", "500"))
+
+ORIGEN_WHATSAPP = "whatsapp"
+ORIGEN_CONSOLA = "consola"
+
+
+class EscritorAuditoria:
+    """Escritor en segundo plano: agrupa registros por archivo, escribe en lotes y rota por tamaño."""
+
+    def __init__(self, max_bytes=AUDITORIA_MAX_BYTES, segmentos=AUDITORIA_SEGMENTOS,
+                 flush_seg=AUDITORIA_FLUSH_SEG, lote=AUDITORIA_LOTE):
+        self.max_bytes = max_bytes
+        self.segmentos = segmentos
+        self.flush_seg = flush_seg
+        self.lote = lote
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._hilo_lock = threading.Lock()
+
+    def registrar(self, ruta, registro):
+        self._cola.put((ruta, registro))
+        self._iniciar()
+
+    def vaciar(self, timeout=5):
+        """Espera a que todo lo encolado hasta ahora quede escrito."""
+        if self._hilo is None or not self._hilo.is_alive():
+            return
+        listo = threading.Event()
+        self._cola.put((None, listo))
+        listo.wait(timeout)
+
+    def _iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._hilo_lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._procesar, daemon=True)
+                self._hilo.start()
+
+    def _procesar(self):
+        pendientes = {}  # ruta -> [líneas]
+        cantidad = 0
+        limite = None
+        while True:
+            espera = self.flush_seg if limite is None else max(0.0, limite - time.monotonic())
+            try:
+                ruta, registro = self._cola.get(timeout=espera)
+            except queue.Empty:
+                ruta, registro = None, None
+
+            avisos = []
+            if ruta is None and isinstance(registro, threading.Event):
+                avisos.append(registro)
+            elif ruta is not None:
+                try:
+                    linea = json.dumps(registro, ensure_ascii=False)
+                except Exception as e:
+                    print(f"⚠️ Registro de auditoría no serializable descartado ({ruta}): {e}")
+                else:
+                    pendientes.setdefault(ruta, []).append(linea)
+                    cantidad += 1
+                    if limite is None:
+                        limite = time.monotonic() + self.flush_seg
+
+            vencido = limite is not None and time.monotonic() >= limite
+            if pendientes and (avisos or vencido or cantidad >= self.lote):
+                # Un archivo que falla (disco, permisos, rotación) no frena a los demás ni al hilo
+                for r, lineas in pendientes.items():
+                    try:
+                        self._escribir(r, lineas)
+                    except Exception as e:
+                        print(f"⚠️ Error al escribir auditoría en {r}: {e}")
+                pendientes = {}
+                cantidad = 0
+                limite = None
+            for aviso in avisos:
+                aviso.set()
+
+    def _escribir(self, ruta, lineas):
+        with bloqueo_archivo(ruta):
+            with open(ruta, "a", encoding="utf-8") as f:
+                f.write("\n".join(lineas) + "\n")
+                tam = f.tell()
+            if tam >= self.max_bytes:
+                self._rotar(ruta)
+
+    def _rotar(self, ruta):
+        # Con microsegundos: dos rotaciones en el mismo segundo no se pisan
+        segmento = f"{ruta}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        os.replace(ruta, segmento)
+        with open(segmento, "rb") as origen, gzip.open(segmento + ".gz", "wb") as destino:
+            shutil.copyfileobj(origen, destino)
+        os.remove(segmento)
+        viejos = sorted(glob.glob(glob.escape(ruta) + ".*.gz"))
+        for viejo in viejos[:-self.segmentos] if self.segmentos > 0 else viejos:
+            os.remove(viejo)
+        print(f"🗜️ Auditoría rotada: {os.path.basename(segmento)}.gz")
+
+
+escritor = EscritorAuditoria()
+atexit.register(escritor.vaciar)
+
+
+def auditar(salon, origen, actor, accion, clienta_id=None, campo=None, antes=None, despues=None):
+    """Encola un registro de auditoría para el salón (no bloquea)."""
+    # Copia de los dicts (p. ej. la clienta completa): se serializan después, en el hilo escritor
+    if isinstance(antes, dict):
+        antes = dict(antes)
+    if isinstance(despues, dict):
+        despues = dict(despues)
+    escritor.registrar(salon.ruta_auditoria, {
+        "ts": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        "salon": salon.clave,
+        "origen": origen,
+        "actor": actor,
+        "accion": accion,
+        "clienta_id": clienta_id,
+        "campo": campo,
+        "antes": antes,
+        "despues": despues,
+    })
+
+
+def auditar_diferencias(salon, origen, actor, clienta_id, antes, despues):
+    """Un registro 'actualizar' por cada campo que cambió entre dos versiones de la clienta."""
+    cambios = 0
+    for campo in despues:
+        if antes.get(campo) != despues.get(campo):
+            auditar(salon, origen, actor, "actualizar", clienta_id, campo, antes.get(campo), despues.get(campo))
+            cambios += 1
+    return cambios
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bloqueo de archivos entre procesos (varios workers de gunicorn, el worker
+del scheduler) sobre un archivo '<ruta>.lock' al lado de los datos.
+"""
+
+from contextlib import contextmanager
+
+try:
+    import fcntl  # Sólo POSIX (Render / Linux). En Windows se usa sólo el lock de hilos.
+except ImportError:
+    fcntl = None
+
+
+@contextmanager
+def bloqueo_archivo(ruta, esperar=True):
+    """
+    Mantiene flock exclusivo sobre ruta + '.lock' mientras dura el bloque.
+    Con esperar=False no se bloquea: el 'as' recibe False si otro ya lo tiene.
+    """
+    with open(ruta + ".lock", "a") as fh:
+        tomado = True
+        if fcntl is not None:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                tomado = False
+        try:
+            yield tomado
+        finally:
+            if tomado and fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
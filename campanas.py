@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Campañas: envío de una promoción puntual a un segmento de clientas.
+
+- Segmentación con índices en memoria por salón:
+    tipo_cabello      -> {ids}
+    tipo_tratamiento  -> {ids} (tratamiento actual + todo el historial)
+    última visita     -> {id: ordinal}
+  Se reconstruyen sólo cuando cambian las clientas o el historial.
+- Las destinatarias se recorren con un generador (ordenadas por id), así una
+  campaña de 50k clientas no arma listas de mensajes en memoria.
+- El envío va a un ritmo fijo (CAMPANA_MENSAJES_POR_SEG) en un hilo aparte y
+  guarda su progreso en <directorio del salón>/campanas/<id>.json cada
+  CAMPANA_CHECKPOINT_CADA clientas. Si el proceso se reinicia, la campaña
+  continúa desde el último id procesado; el ledger de envíos (clave por
+  clienta + campaña) evita repetir a quien ya se le envió.
+
+Filtros (texto de la operadora): "cabello=rizado tratamiento=keratina sin_visita=90"
+  cabello=<tipo>        tipo_cabello de la clienta
+  tratamiento=<clave>   se ha hecho ese tratamiento (actual o en el historial)
+  sin_visita=<días>     su última visita fue hace al menos N días
+  con_visita=<días>     vino en los últimos N días
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
+from datetime import date, datetime
+
+from bloqueos import bloqueo_archivo
+from estilista import enviar_whatsapp, salon_defecto
+from historial import fecha_a_ordinal
+from registro_envios import RegistroEnvios, ESTADO_ENVIADO
+
+CAMPANA_MENSAJES_POR_SEG = float(os.getenv("CAMPANA_MENSAJES_POR_SEG", "5"))
+CAMPANA_CHECKPOINT_CADA = int(os.getenv("CAMPANA_CHECKPOINT_CADA", "50"))
+
+# Estados de una campaña
+CAMPANA_EN_CURSO = "en_curso"
+CAMPANA_PAUSADA = "pausada"
+CAMPANA_CANCELADA = "cancelada"
+CAMPANA_TERMINADA = "terminada"
+
+# Formato de los ids que genera lanzar_campana (AAAAMMDDHHMM-xxxx)
+RE_ID_CAMPANA = re.compile(r"^\d{12}-[0-9a-f]{4}$")
+
+FILTROS = {
+    "cabello": "tipo_cabello",
+    "tratamiento": "tipo_tratamiento",
+    "sin_visita": "sin_visita_dias",
+    "con_visita": "con_visita_dias",
+}
+
+_indices = weakref.WeakKeyDictionary()  # salon -> IndiceSegmentos
+_indices_lock = threading.Lock()
+_hilos = {}  # (clave del salón, id de campaña) -> Thread
+_hilos_lock = threading.Lock()
+
+# ==============================================
+# SEGMENTACIÓN
+# ==============================================
+
+class IndiceSegmentos:
+    """Índices de filtrado de un salón para una versión de sus datos."""
+
+    def __init__(self, salon):
+        self.version = (salon.version_datos, salon.historial.version)
+        self.por_id = {}
+        self.por_cabello = {}
+        self.por_tratamiento = {t: set(ids) for t, ids in salon.historial.tratamientos_por_clienta().items()}
+        self.ultima_visita = salon.historial.ultimas_visitas_todas()
+        for c in salon.clientas:
+            cid = c.get("id")
+            if cid is None:
+                continue
+            self.por_id[cid] = c
+            cabello = (c.get("tipo_cabello") or "").strip().lower()
+            if cabello:
+                self.por_cabello.setdefault(cabello, set()).add(cid)
+            tipo = c.get("tipo_tratamiento")
+            if tipo:
+                self.por_tratamiento.setdefault(tipo, set()).add(cid)
+            ordinal = fecha_a_ordinal(c.get("ultimo_tratamiento"))
+            if ordinal and ordinal > self.ultima_visita.get(cid, 0):
+                self.ultima_visita[cid] = ordinal
+
+    def ids(self, tipo_cabello=None, tipo_tratamiento=None, sin_visita_dias=None, con_visita_dias=None):
+        """Ids que cumplen todos los filtros, ordenados."""
+        conjuntos = []
+        if tipo_cabello:
+            conjuntos.append(self.por_cabello.get(tipo_cabello.strip().lower(), set()))
+        if tipo_tratamiento:
+            conjuntos.append(self.por_tratamiento.get(tipo_tratamiento, set()))
+        # Intersección empezando por el conjunto más chico
+        conjuntos.sort(key=len)
+        candidatas = set(conjuntos[0]) if conjuntos else set(self.por_id)
+        for otro in conjuntos[1:]:
+            candidatas &= otro
+        candidatas &= self.por_id.keys()
+
+        hoy_ord = date.today().toordinal()
+        if sin_visita_dias is not None:
+            limite = hoy_ord - int(sin_visita_dias)
+            candidatas = {cid for cid in candidatas if self.ultima_visita.get(cid, 0) <= limite}
+        if con_visita_dias is not None:
+            limite = hoy_ord - int(con_visita_dias)
+            candidatas = {cid for cid in candidatas if self.ultima_visita.get(cid, 0) >= limite}
+        return sorted(candidatas)
+
+
+def indice(salon=None):
+    """Índice de segmentos del salón (se reconstruye si cambiaron clientas o historial)."""
+    salon = salon or salon_defecto
+    version = (salon.version_datos, salon.historial.version)
+    with _indices_lock:
+        actual = _indices.get(salon)
+        if actual is None or actual.version != version:
+            actual = IndiceSegmentos(salon)
+            _indices[salon] = actual
+        return actual
+
+
+def seleccionar(salon=None, desde_id=None, **filtros):
+    """Genera las clientas del segmento (por id ascendente, a partir de 'desde_id' exclusive)."""
+    idx = indice(salon)
+    for cid in idx.ids(**filtros):
+        if desde_id is not None and cid <= desde_id:
+            continue
+        clienta = idx.por_id.get(cid)
+        if clienta is not None:
+            yield clienta
+
+
+def contar(salon=None, **filtros):
+    return len(indice(salon).ids(**filtros))
+
+
+def interpretar_filtros(texto):
+    """
+    'cabello=rizado tratamiento=keratina sin_visita=90' -> dict de filtros.
+    'TODAS' -> {}. Lanza ValueError con un mensaje para la operadora si hay errores.
+    """
+    texto = (texto or "").strip()
+    if texto.upper() in ("TODAS", "TODOS", "*"):
+        return {}
+    filtros = {}
+    for parte in texto.split():
+        nombre, _, valor = parte.partition("=")
+        nombre = nombre.strip().lower()
+        valor = valor.strip()
+        if nombre not in FILTROS or not valor:
+            raise ValueError(f"Filtro no reconocido: '{parte}'")
+        if nombre in ("sin_visita", "con_visita"):
+            if not valor.isdigit():
+                raise ValueError(f"'{nombre}' debe ser un número de días")
+            valor = int(valor)
+        elif nombre == "cabello":
+            valor = valor.lower()
+        filtros[FILTROS[nombre]] = valor
+    if not filtros:
+        raise ValueError("No se indicó ningún filtro")
+    return filtros
+
+
+def describir_filtros(filtros):
+    if not filtros:
+        return "todas las clientas"
+    inverso = {v: k for k, v in FILTROS.items()}
+    return " ".join(f"{inverso.get(k, k)}={v}" for k, v in filtros.items())
+
+# ==============================================
+# ESTADO EN DISCO
+# ==============================================
+
+def _directorio(salon):
+    ruta = os.path.join(salon.directorio, "campanas")
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+def hay_campanas_en_curso(directorio):
+    """True si el directorio de un salón tiene campañas en curso (sin cargar el salón)."""
+    carpeta = os.path.join(directorio, "campanas")
+    try:
+        nombres = [n for n in os.listdir(carpeta) if n.endswith(".json")]
+    except FileNotFoundError:
+        return False
+    for nombre in nombres:
+        try:
+            with open(os.path.join(carpeta, nombre), "r", encoding="utf-8") as f:
+                if json.load(f).get("estado") == CAMPANA_EN_CURSO:
+                    return True
+        except Exception:
+            continue
+    return False
+
+
+def id_valido(campana_id):
+    return bool(RE_ID_CAMPANA.match(campana_id or ""))
+
+
+def _ruta(salon, campana_id):
+    # El id puede venir escrito por la operadora: nunca armar rutas con otra cosa
+    if not id_valido(campana_id):
+        raise ValueError(f"ID de campaña inválido: {campana_id!r}")
+    return os.path.join(_directorio(salon), f"{campana_id}.json")
+
+
+def guardar_campana(salon, campana):
+    """Checkpoint atómico: se escribe a un temporal y se reemplaza."""
+    campana["actualizada"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ruta = _ruta(salon, campana["id"])
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(campana, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, ruta)
+
+
+def cargar_campana(salon, campana_id):
+    try:
+        with open(_ruta(salon, campana_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def listar_campanas(salon=None):
+    """Campañas del salón, de la más reciente a la más antigua."""
+    salon = salon or salon_defecto
+    campanas = []
+    for nombre in os.listdir(_directorio(salon)):
+        if not nombre.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(_directorio(salon), nombre), "r", encoding="utf-8") as f:
+                campanas.append(json.load(f))
+        except Exception as e:
+            print(f"⚠️ Error al leer campaña {nombre}: {e}")
+    campanas.sort(key=lambda c: c.get("creada", ""), reverse=True)
+    return campanas
+
+
+def cambiar_estado(campana_id, estado, salon=None):
+    """Pausa o cancela una campaña (el hilo lo detecta en el siguiente envío)."""
+    salon = salon or salon_defecto
+    if not id_valido(campana_id):
+        return None
+    campana = cargar_campana(salon, campana_id)
+    if campana is None or campana["estado"] == CAMPANA_TERMINADA:
+        return None
+    campana["estado"] = estado
+    guardar_campana(salon, campana)
+    if estado == CAMPANA_EN_CURSO:
+        _iniciar_hilo(salon, campana_id)
+    return campana
+
+# ==============================================
+# ENVÍO
+# ==============================================
+
+def personalizar(mensaje, clienta):
+    nombre = (clienta.get("nombre") or "").split(" ")[0]
+    return mensaje.replace("{nombre}", nombre)
+
+
+def _ejecutar(salon, campana_id):
+    campana = cargar_campana(salon, campana_id)
+    if campana is None or campana["estado"] != CAMPANA_EN_CURSO:
+        return
+    print(f"📣 Campaña {campana_id} ({salon.nombre}): enviando a {describir_filtros(campana['filtros'])}"
+          f" desde id {campana['cursor']}.")
+    intervalo = 1.0 / CAMPANA_MENSAJES_POR_SEG if CAMPANA_MENSAJES_POR_SEG > 0 else 0
+    siguiente = time.monotonic()
+    pendientes_checkpoint = 0
+
+    for clienta in seleccionar(salon, desde_id=campana["cursor"], **campana["filtros"]):
+        if pendientes_checkpoint >= CAMPANA_CHECKPOINT_CADA:
+            # Releer el estado por si la operadora la pausó/canceló
+            en_disco = cargar_campana(salon, campana_id) or campana
+            campana["estado"] = en_disco["estado"]
+            guardar_campana(salon, campana)
+            pendientes_checkpoint = 0
+            if campana["estado"] != CAMPANA_EN_CURSO:
+                print(f"⏸️ Campaña {campana_id} {campana['estado']} en id {campana['cursor']}.")
+                return
+
+        telefono = clienta.get("telefono")
+        clave = RegistroEnvios.clave(clienta.get("id"), campana_id, "campana")
+        previo = salon.registro_envios.obtener(clave)
+        if not telefono or (previo and previo.get("e") == ESTADO_ENVIADO):
+            campana["omitidos"] += 1
+        else:
+            espera = siguiente - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            siguiente = max(siguiente, time.monotonic()) + intervalo
+            if enviar_whatsapp(telefono, personalizar(campana["mensaje"], clienta), clave=clave, salon=salon,
+                               plantilla="campana", tratamiento=campana["filtros"].get("tipo_tratamiento")):
+                campana["enviados"] += 1
+            else:
+                campana["fallidos"] += 1
+        campana["cursor"] = clienta.get("id")
+        pendientes_checkpoint += 1
+
+    en_disco = cargar_campana(salon, campana_id) or campana
+    if en_disco["estado"] == CAMPANA_EN_CURSO:
+        campana["estado"] = CAMPANA_TERMINADA
+    else:
+        campana["estado"] = en_disco["estado"]
+    guardar_campana(salon, campana)
+    print(f"✅ Campaña {campana_id} {campana['estado']}: {campana['enviados']} enviados, "
+          f"{campana['fallidos']} fallidos, {campana['omitidos']} omitidos.")
+
+
+def _ejecutar_seguro(salon, campana_id):
+    try:
+        # Cada worker reanuda las campañas al arrancar: sólo la envía quien la reclama
+        with bloqueo_archivo(_ruta(salon, campana_id), esperar=False) as reclamada:
+            if not reclamada:
+                print(f"⏭️ Campaña {campana_id} ({salon.nombre}) ya la está enviando otro proceso.")
+                return
+            with salon.en_uso():
+                _ejecutar(salon, campana_id)
+    except Exception as e:
+        print(f"❌ Error en campaña {campana_id}: {e}")
+    finally:
+        with _hilos_lock:
+            _hilos.pop((salon.clave, campana_id), None)
+
+
+def _iniciar_hilo(salon, campana_id):
+    with _hilos_lock:
+        hilo = _hilos.get((salon.clave, campana_id))
+        if hilo is not None and hilo.is_alive():
+            return False
+        hilo = threading.Thread(target=_ejecutar_seguro, args=(salon, campana_id), daemon=True)
+        _hilos[(salon.clave, campana_id)] = hilo
+        hilo.start()
+        return True
+
+
+def lanzar_campana(mensaje, filtros=None, salon=None):
+    """Crea la campaña, guarda su estado inicial y empieza a enviarla en segundo plano."""
+    salon = salon or salon_defecto
+    filtros = filtros or {}
+    campana = {
+        "id": datetime.now().strftime("%Y%m%d%H%M") + "-" + uuid.uuid4().hex[:4],
+        "creada": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "mensaje": mensaje,
+        "filtros": filtros,
+        "total": contar(salon, **filtros),
+        "estado": CAMPANA_EN_CURSO,
+        "cursor": None,
+        "enviados": 0,
+        "fallidos": 0,
+        "omitidos": 0,
+    }
+    guardar_campana(salon, campana)
+    _iniciar_hilo(salon, campana["id"])
+    return campana
+
+
+def reanudar_campanas(salon=None):
+    """Retoma las campañas que quedaron en curso (p. ej. tras un reinicio)."""
+    salon = salon or salon_defecto
+    reanudadas = 0
+    for campana in listar_campanas(salon):
+        if campana.get("estado") == CAMPANA_EN_CURSO and _iniciar_hilo(salon, campana["id"]):
+            reanudadas += 1
+    if reanudadas:
+        print(f"🔁 {reanudadas} campañas reanudadas en {salon.nombre}.")
+    return reanudadas
+
+
+def texto_progreso(campana):
+    procesadas = campana["enviados"] + campana["fallidos"] + campana["omitidos"]
+    return (f"• {campana['id']} [{campana['estado']}] {procesadas}/{campana.get('total', '?')} "
+            f"(✅{campana['enviados']} ❌{campana['fallidos']}) — {describir_filtros(campana['filtros'])}")
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga local del webhook /whatsapp, sin tráfico real de WhatsApp.
+
+Levanta:
+  - el stub de la API de Twilio (stub_twilio.py), al que apunta enviar_whatsapp,
+  - webhook:app bajo gunicorn con varios workers, en un directorio temporal,
+y simula muchas remitentes a la vez, cada una con una conversación completa
+(menú, agregar clienta, actualizar, entradas inválidas, respuestas de clientas,
+campañas). Las peticiones van firmadas como las de Twilio (X-Twilio-Signature).
+Las remitentes simuladas son operadoras (TELEFONOS_OPERADORAS), así las
+campañas salen de verdad hacia el stub, y el stub devuelve los status
+callbacks a POST /status del webhook.
+
+Reporta latencia p50/p95/p99, tasa de error (HTTP != 200 o sin respuesta) y
+las respuestas fuera de flujo: con más de un worker las sesiones viven en la
+memoria de cada proceso, así que un paso de la conversación puede caer en un
+worker que no conoce la sesión. Al final espera a que terminen los envíos y
+reporta cuántos mensajes aceptó el stub y la latencia/errores de los callbacks.
+
+Uso:
+    python carga.py --usuarios 200 --concurrencia 20 --workers 4
+    python carga.py --workers 1 --threads 8          # comparar con un solo proceso
+    python carga.py --url http://127.0.0.1:8000      # contra un servidor ya levantado
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from twilio.request_validator import RequestValidator
+
+from stub_twilio import ManejadorStub, iniciar_stub
+
+NUMERO_SALON = "whatsapp:+14155238886"
+ACCOUNT_SID_CARGA = "AC" + "0" * 32
+AUTH_TOKEN_CARGA = "token-de-carga"
+# Teléfono de una clienta de ejemplo (estilista.py las crea si no hay datos)
+TELEFONO_CLIENTA_EJEMPLO = "+573001234567"
+
+# ==============================================
+# ESCENARIOS: lista de (mensaje, texto esperado en la respuesta)
+# ==============================================
+
+def escenario_menu(n):
+    return [("hola", "MENÚ PRINCIPAL"), ("2", "TUS CLIENTAS"), ("6", "AYUDA"),
+            ("3", "VER DETALLES"), ("MENU", "MENÚ PRINCIPAL")]
+
+def escenario_agregar(n):
+    return [
+        ("1", "AGREGAR CLIENTA NUEVA"),
+        (f"Clienta Carga {n}", "Perfecto"),
+        (f"+57320{n:07d}", "TRATAMIENTOS DISPONIBLES"),
+        (str(random.randint(1, 2)), "último tratamiento"),
+        ("SALTAR", "enviar el recordatorio"),
+        ("SALTAR", "Clienta agregada"),
+    ]
+
+def escenario_actualizar(n):
+    return [
+        ("4", "ACTUALIZAR INFORMACIÓN"),
+        ("1", "Actualizando"),
+        ("5", "Nuevo valor"),
+        ("2031-02-03", "actualizado"),
+    ]
+
+def escenario_invalido(n):
+    basura = random.choice(["asdf", "🙂🙂🙂", "x" * 1600, "'; DROP TABLE clientas;--", "<Response/>"])
+    return [
+        (basura, "MENÚ PRINCIPAL"),
+        ("1", "AGREGAR CLIENTA NUEVA"),
+        ("Nombre", "Perfecto"),
+        ("12345", "Número inválido"),
+        ("MENU", "MENÚ PRINCIPAL"),
+        ("4", "ACTUALIZAR"),
+        ("no-es-id", "Debes escribir el ID"),
+        ("MENU", "MENÚ PRINCIPAL"),
+    ]
+
+def escenario_campana(n):
+    # Una operadora lanza una promoción a todas las clientas (envíos + status callbacks)
+    return [
+        ("8", "NUEVA CAMPAÑA"),
+        ("TODAS", "clientas"),
+        (f"Hola {{nombre}}, promo de carga {n}", "VISTA PREVIA"),
+        ("ENVIAR", "en marcha"),
+    ]
+
+def escenario_respuesta_clienta(n):
+    # Una clienta registrada contesta un recordatorio (camino de respuestas.py)
+    return [(random.choice(["SI", "No gracias", "15/12", "¿tienen cupo el sábado?"]), None)]
+
+ESCENARIOS = [
+    (escenario_menu, 30),
+    (escenario_agregar, 25),
+    (escenario_actualizar, 15),
+    (escenario_invalido, 15),
+    (escenario_respuesta_clienta, 10),
+    (escenario_campana, 5),
+]
+
+def telefono_remitente(n):
+    return f"+57310{n:07d}"
+
+# ==============================================
+# SERVIDOR BAJO PRUEBA
+# ==============================================
+
+def levantar_gunicorn(puerto, workers, threads, puerto_stub, directorio, usuarios):
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": raiz + os.pathsep + env.get("PYTHONPATH", ""),
+        "TWILIO_ACCOUNT_SID": ACCOUNT_SID_CARGA,
+        "TWILIO_AUTH_TOKEN": AUTH_TOKEN_CARGA,
+        "TWILIO_API_BASE_URL": f"http://127.0.0.1:{puerto_stub}",
+        "TWILIO_WHATSAPP_NUMBER": NUMERO_SALON,
+        "STATUS_CALLBACK_URL": f"http://127.0.0.1:{puerto}/status",
+        "RUN_BACKGROUND_LOGIC": "0",
+        # Todas las remitentes simuladas pueden usar las opciones de gestión (incluida la 8)
+        "TELEFONOS_OPERADORAS": ",".join(telefono_remitente(n) for n in range(usuarios)),
+        "CAMPANA_MENSAJES_POR_SEG": env.get("CAMPANA_MENSAJES_POR_SEG", "200"),
+        # Se mide la aplicación, no el limitador por remitente
+        "TASA_MENSAJES_POR_MINUTO": env.get("TASA_MENSAJES_POR_MINUTO", "100000"),
+        "RAFAGA_MENSAJES": env.get("RAFAGA_MENSAJES", "100000"),
+    })
+    comando = [sys.executable, "-m", "gunicorn", "webhook:app", "-b", f"127.0.0.1:{puerto}",
+               "-w", str(workers), "--threads", str(threads), "--log-level", "warning"]
+    log = open(os.path.join(directorio, "gunicorn.log"), "w")
+    proceso = subprocess.Popen(comando, cwd=directorio, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó al arrancar; revisa {log.name}")
+        try:
+            if requests.get(url + "/health", timeout=1).status_code == 200:
+                return proceso, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError(f"gunicorn no respondió a tiempo; revisa {log.name}")
+
+# ==============================================
+# GENERADOR DE TRÁFICO
+# ==============================================
+
+class Resultados:
+    def __init__(self):
+        self.latencias = []
+        self.errores = 0
+        self.fuera_de_flujo = 0
+        self.codigos = {}
+        self._lock = threading.Lock()
+
+    def agregar(self, latencia, codigo, coincide):
+        with self._lock:
+            self.latencias.append(latencia)
+            self.codigos[codigo] = self.codigos.get(codigo, 0) + 1
+            if codigo != 200:
+                self.errores += 1
+            elif not coincide:
+                self.fuera_de_flujo += 1
+
+
+def conversar(url, n, resultados, firmar, pausa_ms):
+    """Una remitente virtual: elige un escenario y lo recorre paso a paso."""
+    generar = random.choices([e for e, _ in ESCENARIOS], weights=[p for _, p in ESCENARIOS])[0]
+    telefono = TELEFONO_CLIENTA_EJEMPLO if generar is escenario_respuesta_clienta else telefono_remitente(n)
+    validador = RequestValidator(AUTH_TOKEN_CARGA) if firmar else None
+    destino = url + "/whatsapp"
+    with requests.Session() as sesion:
+        for mensaje, espera in generar(n):
+            form = {"From": f"whatsapp:{telefono}", "To": NUMERO_SALON, "Body": mensaje,
+                    "MessageSid": f"SMCARGA{n:08d}{random.randint(0, 10**8):08d}"}
+            headers = {"X-Twilio-Signature": validador.compute_signature(destino, form)} if validador else {}
+            t0 = time.perf_counter()
+            try:
+                r = sesion.post(destino, data=form, headers=headers, timeout=30)
+                codigo, texto = r.status_code, r.text
+            except requests.RequestException:
+                codigo, texto = "sin respuesta", ""
+            resultados.agregar(time.perf_counter() - t0, codigo, espera is None or espera in texto)
+            if pausa_ms:
+                time.sleep(random.uniform(0, pausa_ms) / 1000.0)
+
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p))] * 1000 if valores else 0.0
+
+
+def esperar_envios(limite_seg=60, quieto_seg=2.0):
+    """Espera a que las campañas y los callbacks dejen de moverse (o se agote el límite)."""
+    fin = time.monotonic() + limite_seg
+    previo, desde = None, time.monotonic()
+    while time.monotonic() < fin:
+        actual = (ManejadorStub.aceptados, len(ManejadorStub.callbacks_latencias))
+        if actual != previo:
+            previo, desde = actual, time.monotonic()
+        elif time.monotonic() - desde >= quieto_seg:
+            return
+        time.sleep(0.2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga local del webhook /whatsapp")
+    parser.add_argument("--usuarios", type=int, default=200, help="Conversaciones a simular")
+    parser.add_argument("--concurrencia", type=int, default=20, help="Conversaciones simultáneas")
+    parser.add_argument("--workers", type=int, default=4, help="Workers de gunicorn")
+    parser.add_argument("--threads", type=int, default=1, help="Hilos por worker de gunicorn")
+    parser.add_argument("--puerto", type=int, default=8100)
+    parser.add_argument("--puerto-stub", type=int, default=8099)
+    parser.add_argument("--latencia-ms", type=int, default=50, help="Latencia simulada de la API de Twilio")
+    parser.add_argument("--pausa-ms", type=int, default=0, help="Pausa máxima entre mensajes de una remitente")
+    parser.add_argument("--url", default=None, help="Usar un servidor ya levantado (no arranca gunicorn)")
+    parser.add_argument("--sin-firma", action="store_true", help="No firmar las peticiones")
+    parser.add_argument("--semilla", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.semilla is not None:
+        random.seed(args.semilla)
+
+    directorio = tempfile.mkdtemp(prefix="carga_estilista_")
+    stub = iniciar_stub(args.puerto_stub, args.latencia_ms, auth_token=AUTH_TOKEN_CARGA)
+    proceso = None
+    url = args.url
+    if not url:
+        proceso, url = levantar_gunicorn(args.puerto, args.workers, args.threads, args.puerto_stub, directorio,
+                                         args.usuarios)
+        print(f"🚀 gunicorn con {args.workers} workers x {args.threads} hilos en {url} (datos en {directorio})")
+
+    resultados = Resultados()
+    t0 = time.perf_counter()
+    duracion = None
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrencia) as ex:
+            for futuro in [ex.submit(conversar, url, n, resultados, not args.sin_firma, args.pausa_ms)
+                           for n in range(args.usuarios)]:
+                futuro.result()
+        duracion = time.perf_counter() - t0
+        esperar_envios()
+    finally:
+        if duracion is None:
+            duracion = time.perf_counter() - t0
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait(timeout=10)
+        stub.shutdown()
+
+    latencias = sorted(resultados.latencias)
+    total = len(latencias)
+    print(f"📊 {total} peticiones ({args.usuarios} conversaciones, {args.concurrencia} simultáneas) "
+          f"en {duracion:.2f}s -> {total / duracion:.1f} req/s")
+    print(f"   Latencia p50={percentil(latencias, 0.50):.1f}ms  p95={percentil(latencias, 0.95):.1f}ms  "
+          f"p99={percentil(latencias, 0.99):.1f}ms")
+    print(f"   Errores: {resultados.errores} ({resultados.errores / max(total, 1):.1%})  "
+          f"Códigos: {resultados.codigos}")
+    print(f"   Respuestas fuera de flujo: {resultados.fuera_de_flujo} ({resultados.fuera_de_flujo / max(total, 1):.1%})")
+    print(f"   Mensajes aceptados por el stub de Twilio: {ManejadorStub.aceptados}")
+    callbacks = sorted(ManejadorStub.callbacks_latencias)
+    errores_cb = sum(v for k, v in ManejadorStub.callbacks_codigos.items() if k != 204)
+    print(f"   Status callbacks: {len(callbacks)}  p50={percentil(callbacks, 0.50):.1f}ms  "
+          f"p95={percentil(callbacks, 0.95):.1f}ms  p99={percentil(callbacks, 0.99):.1f}ms  "
+          f"Errores: {errores_cb}  Códigos: {ManejadorStub.callbacks_codigos}")
+    sys.exit(1 if resultados.errores or errores_cb else 0)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catálogo de tratamientos cargado desde archivo (tratamientos.json) con
+recarga en caliente por mtime.
+
+- Agregar o editar un servicio no requiere redeploy: basta con guardar el
+  archivo; en la siguiente consulta (como mucho cada REVISAR_CADA_SEG) se
+  detecta el cambio de mtime y se recarga.
+- El archivo se valida antes de activarlo; si tiene errores se sigue usando
+  la versión anterior y se reporta el problema.
+- Los datos derivados (lista numerada de claves, duración en días, textos de
+  menú) se calculan una sola vez por versión del catálogo.
+
+Formato (igual que el antiguo diccionario TRATAMIENTOS):
+{
+    "keratina": {"nombre": "Keratina / Alisado", "duracion_meses": 3,
+                 "duracion_cita_min": 180, "precio": "$150.000 - $250.000",
+                 "beneficios": ["Brillo intenso"]}
+}
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections.abc import Mapping
+
+REVISAR_CADA_SEG = float(os.getenv("CATALOGO_REVISAR_CADA_SEG", "2"))
+
+_RE_CLAVE = re.compile(r"^[a-z0-9_]+$")
+
+
+def validar_catalogo(datos):
+    """Retorna la lista de errores del catálogo (vacía si es válido)."""
+    if not isinstance(datos, dict) or not datos:
+        return ["El catálogo debe ser un objeto JSON con al menos un tratamiento."]
+    errores = []
+    for clave, t in datos.items():
+        if not _RE_CLAVE.match(clave):
+            errores.append(f"{clave}: la clave sólo puede tener minúsculas, números y '_'.")
+        if not isinstance(t, dict):
+            errores.append(f"{clave}: debe ser un objeto.")
+            continue
+        if not isinstance(t.get("nombre"), str) or not t["nombre"].strip():
+            errores.append(f"{clave}: 'nombre' es obligatorio.")
+        dur = t.get("duracion_meses")
+        if isinstance(dur, bool) or not isinstance(dur, (int, float)) or dur <= 0:
+            errores.append(f"{clave}: 'duracion_meses' debe ser un número mayor que 0.")
+        if not isinstance(t.get("precio"), str):
+            errores.append(f"{clave}: 'precio' es obligatorio (texto).")
+        cita = t.get("duracion_cita_min")
+        if cita is not None and (isinstance(cita, bool) or not isinstance(cita, int) or cita <= 0):
+            errores.append(f"{clave}: 'duracion_cita_min' debe ser un entero mayor que 0.")
+        beneficios = t.get("beneficios", [])
+        if not isinstance(beneficios, list) or not all(isinstance(b, str) for b in beneficios):
+            errores.append(f"{clave}: 'beneficios' debe ser una lista de textos.")
+    return errores
+
+
+class _Version:
+    """Una versión inmutable del catálogo con sus datos derivados."""
+
+    def __init__(self, datos, mtime=None):
+        self.datos = datos
+        self.mtime = mtime
+        # Lista numerada: la opción N del menú es claves[N - 1]
+        self.claves = tuple(datos.keys())
+        # Duración aproximada en días (30 días por mes), usada para los vencimientos
+        self.duracion_dias = {k: int(30 * t.get("duracion_meses", 0)) for k, t in datos.items()}
+        self.derivados = {}
+
+
+class CatalogoTratamientos(Mapping):
+    """
+    Se comporta como el diccionario TRATAMIENTOS (get, [], in, keys, items...)
+    pero se recarga solo cuando cambia el archivo.
+
+    Si el archivo no existe se usa 'respaldo': un dict fijo o bien otro
+    CatalogoTratamientos (así un salón sin catálogo propio hereda el general).
+    """
+
+    def __init__(self, ruta, respaldo=None):
+        self.ruta = ruta
+        self.respaldo = respaldo
+        self._propia = None
+        self._mtime_rechazado = None
+        self._fija = _Version(respaldo) if isinstance(respaldo, dict) else None
+        self._ultima_revision = 0.0
+        self._lock = threading.Lock()
+        self.revisar(forzar=True)
+
+    # ---------- Recarga ----------
+
+    def revisar(self, forzar=False):
+        """Recarga el archivo si cambió su mtime. Retorna True si hubo recarga."""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultima_revision < REVISAR_CADA_SEG:
+            return False
+        with self._lock:
+            self._ultima_revision = ahora
+            try:
+                mtime = os.stat(self.ruta).st_mtime_ns
+            except FileNotFoundError:
+                if self._propia is not None:
+                    print(f"ℹ️ {self.ruta} ya no existe; se usa el catálogo de respaldo.")
+                self._propia = None
+                return False
+            if self._propia is not None and self._propia.mtime == mtime:
+                return False
+            if mtime == self._mtime_rechazado:
+                return False  # Ya se reportó; esperar a que el archivo cambie
+            try:
+                with open(self.ruta, "r", encoding="utf-8") as f:
+                    datos = json.load(f)
+            except Exception as e:
+                print(f"⚠️ No se pudo leer {self.ruta}: {e}. Se mantiene el catálogo anterior.")
+                self._mtime_rechazado = mtime
+                return False
+            errores = validar_catalogo(datos)
+            if errores:
+                print(f"⚠️ {self.ruta} inválido, se mantiene el catálogo anterior:")
+                for err in errores:
+                    print(f"   - {err}")
+                self._mtime_rechazado = mtime
+                return False
+            self._propia = _Version(datos, mtime)
+            print(f"📚 Catálogo cargado desde {self.ruta}: {len(datos)} tratamientos.")
+            return True
+
+    def _version(self):
+        self.revisar()
+        if self._propia is not None:
+            return self._propia
+        if isinstance(self.respaldo, CatalogoTratamientos):
+            return self.respaldo._version()
+        return self._fija or _Version({})
+
+    # ---------- Datos derivados ----------
+
+    @property
+    def claves(self):
+        """Claves en orden del archivo (opción N del menú = claves[N - 1])."""
+        return self._version().claves
+
+    @property
+    def duracion_dias(self):
+        return self._version().duracion_dias
+
+    def por_numero(self, numero):
+        """Clave de la opción 'numero' (1..N) o None."""
+        claves = self.claves
+        if 1 <= numero <= len(claves):
+            return claves[numero - 1]
+        return None
+
+    def derivado(self, nombre, construir):
+        """
+        Valor calculado a partir del catálogo (p. ej. el texto del menú),
+        memorizado hasta la próxima recarga. 'construir' recibe el dict de datos.
+        """
+        version = self._version()
+        valor = version.derivados.get(nombre)
+        if valor is None:
+            valor = construir(version.datos)
+            version.derivados[nombre] = valor
+        return valor
+
+    # ---------- Interfaz de diccionario ----------
+
+    def __getitem__(self, clave):
+        return self._version().datos[clave]
+
+    def __iter__(self):
+        return iter(self._version().claves)
+
+    def __len__(self):
+        return len(self._version().claves)
+
+    def __contains__(self, clave):
+        return clave in self._version().datos
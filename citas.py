@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Agenda de citas con índice de intervalos por día.
+
+Para cada fecha se mantienen dos listas ordenadas por hora de inicio
+(inicios en minutos y las citas), sin solapamientos. Así:
+  - detectar un conflicto es O(log n) (bisect + comparar con las vecinas),
+  - buscar el primer espacio libre desde una hora es O(log n + k), donde k
+    son las citas que hay que saltar ese día.
+
+Las citas se guardan en citas.json. Varios procesos (workers de gunicorn)
+comparten el archivo: reservar y cancelar toman un lock de archivo, recargan
+si otro proceso lo cambió y lo reemplazan de forma atómica.
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date, timedelta
+
+from bloqueos import bloqueo_archivo
+
+RUTA_CITAS = os.getenv("RUTA_CITAS", "citas.json")
+HORARIO_APERTURA = os.getenv("HORARIO_APERTURA", "09:00")
+HORARIO_CIERRE = os.getenv("HORARIO_CIERRE", "18:00")
+PASO_MINUTOS = int(os.getenv("PASO_MINUTOS", "30"))
+# Días sin atención (0=lunes ... 6=domingo), separados por coma
+DIAS_CERRADOS = {int(d) for d in os.getenv("DIAS_CERRADOS", "6").split(",") if d.strip()}
+DURACION_CITA_DEFECTO = 120
+
+
+def hhmm_a_minutos(texto):
+    """'14:30' -> 870. Lanza ValueError si el formato es inválido."""
+    h, m = texto.strip().split(":")
+    h, m = int(h), int(m)
+    if not (0 <= h < 24 and 0 <= m < 60):
+        raise ValueError(texto)
+    return h * 60 + m
+
+
+def minutos_a_hhmm(minutos):
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+class AgendaCitas:
+    """Citas por día con detección de conflictos y búsqueda de espacios libres."""
+
+    def __init__(self, ruta=RUTA_CITAS, apertura=HORARIO_APERTURA, cierre=HORARIO_CIERRE,
+                 paso=PASO_MINUTOS, dias_cerrados=DIAS_CERRADOS):
+        self.ruta = ruta
+        self.apertura = hhmm_a_minutos(apertura)
+        self.cierre = hhmm_a_minutos(cierre)
+        self.paso = paso
+        self.dias_cerrados = set(dias_cerrados)
+        self._dias = {}  # fecha -> (inicios[], citas[])
+        self._lock = threading.RLock()
+        self._siguiente_id = 1
+        self._firma = None  # (inodo, mtime, tamaño) de citas.json al cargar/guardar
+
+    # ---------- Persistencia ----------
+
+    def _firma_archivo(self):
+        try:
+            st = os.stat(self.ruta)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refrescar(self):
+        """Recarga si otro proceso cambió citas.json desde la última lectura/escritura."""
+        if self._firma_archivo() != self._firma:
+            self.cargar()
+
+    def cargar(self):
+        """Carga citas.json (si existe) y reconstruye el índice."""
+        with self._lock:
+            self._dias = {}
+            citas = []
+            self._firma = self._firma_archivo()
+            if self._firma is not None:
+                try:
+                    with open(self.ruta, "r", encoding="utf-8") as f:
+                        citas = json.load(f)
+                except Exception as e:
+                    print(f"⚠️ Error al cargar citas: {e}")
+            for c in citas:
+                self._indexar(c)
+            self._siguiente_id = max((c.get("id", 0) for c in citas), default=0) + 1
+
+    def guardar(self):
+        """Escritura atómica (temporal + os.replace). Reservar/cancelar la llaman con el lock de archivo."""
+        with self._lock:
+            citas = [c for _, lista in sorted(self._dias.items()) for c in lista[1]]
+            tmp = f"{self.ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(citas, f, ensure_ascii=False, indent=4)
+                os.replace(tmp, self.ruta)
+                self._firma = self._firma_archivo()
+            except Exception as e:
+                print(f"❌ Error al guardar citas: {e}")
+
+    def _indexar(self, cita):
+        inicios, lista = self._dias.setdefault(cita["fecha"], ([], []))
+        ini = hhmm_a_minutos(cita["inicio"])
+        pos = bisect_right(inicios, ini)
+        inicios.insert(pos, ini)
+        lista.insert(pos, cita)
+
+    # ---------- Consultas ----------
+
+    def citas_del_dia(self, fecha):
+        with self._lock:
+            self._refrescar()
+            return list(self._dias.get(fecha, ([], []))[1])
+
+    def citas_de_clienta(self, clienta_id, desde=None):
+        """Citas futuras (o desde 'desde') de una clienta."""
+        desde = desde or date.today().strftime("%Y-%m-%d")
+        with self._lock:
+            self._refrescar()
+            return [c for f, (_, lista) in sorted(self._dias.items()) if f >= desde
+                    for c in lista if c.get("clienta_id") == clienta_id]
+
+    def hay_conflicto(self, fecha, inicio, fin):
+        """True si [inicio, fin) (minutos) se cruza con otra cita del día. O(log n)."""
+        with self._lock:
+            inicios, lista = self._dias.get(fecha, ([], []))
+            pos = bisect_left(inicios, fin)
+            # Sólo la cita que empieza justo antes de 'fin' puede solaparse
+            # (no hay solapamientos entre citas guardadas)
+            if pos > 0 and hhmm_a_minutos(lista[pos - 1]["fin"]) > inicio:
+                return True
+            return False
+
+    def _alinear(self, minutos):
+        desfase = (minutos - self.apertura) % self.paso
+        return minutos if desfase == 0 else minutos + self.paso - desfase
+
+    def _hueco_en_dia(self, fecha, desde_min, duracion):
+        if datetime.strptime(fecha, "%Y-%m-%d").weekday() in self.dias_cerrados:
+            return None
+        inicios, lista = self._dias.get(fecha, ([], []))
+        t = self._alinear(max(self.apertura, desde_min))
+        # Si t cae dentro de la cita anterior, empezar después de ella
+        pos = bisect_right(inicios, t)
+        if pos > 0:
+            fin_prev = hhmm_a_minutos(lista[pos - 1]["fin"])
+            if fin_prev > t:
+                t = self._alinear(fin_prev)
+        for j in range(pos, len(inicios)):
+            if t + duracion <= inicios[j]:
+                break
+            t = max(t, self._alinear(hhmm_a_minutos(lista[j]["fin"])))
+        if t + duracion <= self.cierre:
+            return t
+        return None
+
+    def buscar_hueco(self, desde_fecha, duracion=DURACION_CITA_DEFECTO, desde_hora=None, dias_max=30):
+        """
+        Primer espacio libre a partir de 'desde_fecha' (y 'desde_hora' ese día).
+        Retorna (fecha, 'HH:MM') o None si no hay en 'dias_max' días.
+        """
+        with self._lock:
+            self._refrescar()
+            dia = datetime.strptime(desde_fecha, "%Y-%m-%d").date()
+            hoy = date.today()
+            if dia < hoy:
+                dia = hoy
+            for n in range(dias_max):
+                fecha = (dia + timedelta(days=n)).strftime("%Y-%m-%d")
+                desde = 0
+                if n == 0 and desde_hora:
+                    desde = hhmm_a_minutos(desde_hora)
+                if n == 0 and dia == hoy:
+                    ahora = datetime.now()
+                    desde = max(desde, ahora.hour * 60 + ahora.minute)
+                t = self._hueco_en_dia(fecha, desde, duracion)
+                if t is not None:
+                    return fecha, minutos_a_hhmm(t)
+            return None
+
+    # ---------- Reservas ----------
+
+    def reservar(self, clienta_id, fecha, hora, duracion=DURACION_CITA_DEFECTO, tratamiento=None):
+        """
+        Crea la cita si el horario está libre, no ya pasó y está dentro del horario
+        de atención. Retorna la cita (dict) o None si no se puede.
+        """
+        ini = hhmm_a_minutos(hora)
+        fin = ini + duracion
+        dia = datetime.strptime(fecha, "%Y-%m-%d")
+        if dia + timedelta(minutes=ini) < datetime.now():
+            return None
+        if dia.weekday() in self.dias_cerrados:
+            return None
+        if ini < self.apertura or fin > self.cierre:
+            return None
+        with self._lock, bloqueo_archivo(self.ruta):
+            # Otro worker pudo reservar ese horario: decidir con el archivo al día
+            self._refrescar()
+            if self.hay_conflicto(fecha, ini, fin):
+                return None
+            cita = self._insertar(clienta_id, fecha, ini, fin, tratamiento)
+            self.guardar()
+            return cita
+
+    def _insertar(self, clienta_id, fecha, ini, fin, tratamiento):
+        cita = {
+            "id": self._siguiente_id,
+            "clienta_id": clienta_id,
+            "fecha": fecha,
+            "inicio": minutos_a_hhmm(ini),
+            "fin": minutos_a_hhmm(fin),
+            "tratamiento": tratamiento,
+        }
+        self._siguiente_id += 1
+        self._indexar(cita)
+        return cita
+
+    def cancelar(self, cita_id):
+        """Elimina una cita por ID. Retorna True si existía."""
+        with self._lock, bloqueo_archivo(self.ruta):
+            self._refrescar()
+            for fecha, (inicios, lista) in self._dias.items():
+                for i, c in enumerate(lista):
+                    if c.get("id") == cita_id:
+                        del inicios[i]
+                        del lista[i]
+                        self.guardar()
+                        return True
+            return False
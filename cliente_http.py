@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cliente HTTP administrado para las llamadas salientes a la API de Twilio.
+
+- Pool de conexiones con tamaño fijo (urllib3 vía HTTPAdapter), seguro entre
+  los hilos de Flask y el hilo del scheduler, con keep-alive.
+- Timeout por solicitud (conexión, lectura).
+- Circuit breaker: si los errores de Twilio se disparan en la ventana
+  reciente, se corta el envío durante unos segundos en lugar de acumular
+  hilos bloqueados.
+- TWILIO_API_BASE_URL permite apuntar a un servidor stub local
+  (ver stub_twilio.py) para medir el rendimiento sin salir a internet.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from requests import Request
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from twilio.http import HttpClient
+from twilio.http.response import Response
+
+URL_TWILIO = "https://api.twilio.com"
+
+
+class CircuitoAbierto(Exception):
+    """Se lanza cuando el circuito está abierto y no se intenta la llamada."""
+
+
+class Circuito:
+    """
+    Circuit breaker por ventana deslizante.
+
+    Se abre cuando en los últimos 'ventana_seg' hubo al menos 'minimo'
+    solicitudes y la proporción de fallos supera 'umbral'. Tras 'espera_seg'
+    deja pasar una solicitud de prueba (semiabierto): si sale bien se cierra.
+    """
+
+    def __init__(self, umbral=0.5, minimo=10, ventana_seg=60, espera_seg=30):
+        self.umbral = umbral
+        self.minimo = minimo
+        self.ventana_seg = ventana_seg
+        self.espera_seg = espera_seg
+        self._resultados = deque()
+        self._fallos = 0
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def _purgar(self, ahora):
+        while self._resultados and ahora - self._resultados[0][0] > self.ventana_seg:
+            _, ok = self._resultados.popleft()
+            if not ok:
+                self._fallos -= 1
+
+    @property
+    def estado(self):
+        with self._lock:
+            if self._abierto_desde is None:
+                return "cerrado"
+            if time.monotonic() - self._abierto_desde >= self.espera_seg:
+                return "semiabierto"
+            return "abierto"
+
+    def permitir(self):
+        """Retorna True si se puede intentar la llamada."""
+        with self._lock:
+            if self._abierto_desde is None:
+                return True
+            if time.monotonic() - self._abierto_desde < self.espera_seg:
+                return False
+            if self._prueba_en_curso:
+                return False
+            self._prueba_en_curso = True
+            return True
+
+    def cancelar_prueba(self):
+        """Libera la prueba semiabierta sin resultado (la llamada falló antes de llegar a Twilio)."""
+        with self._lock:
+            self._prueba_en_curso = False
+
+    def registrar(self, ok):
+        with self._lock:
+            ahora = time.monotonic()
+            if self._abierto_desde is not None:
+                self._prueba_en_curso = False
+                if ok:
+                    self._abierto_desde = None
+                    self._resultados.clear()
+                    self._fallos = 0
+                else:
+                    self._abierto_desde = ahora
+                return
+            self._resultados.append((ahora, ok))
+            if not ok:
+                self._fallos += 1
+            self._purgar(ahora)
+            total = len(self._resultados)
+            if total >= self.minimo and self._fallos / total >= self.umbral:
+                self._abierto_desde = ahora
+                print(f"⚠️ Circuito Twilio ABIERTO ({self._fallos}/{total} fallos). Pausa de {self.espera_seg}s.")
+
+
+class ClienteHttpTwilio(HttpClient):
+    """HttpClient para twilio.rest.Client con pool compartido, timeouts y circuit breaker."""
+
+    def __init__(self, tamano_pool=10, timeout=10.0, timeout_conexion=3.05,
+                 base_url=None, circuito=None, logger=None):
+        super().__init__(logger or logging.getLogger("twilio.http_client"), False, timeout)
+        self.timeout_conexion = timeout_conexion
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.circuito = circuito or Circuito()
+        # El PoolManager de urllib3 es thread-safe; pool_block limita las conexiones abiertas
+        self.adaptador = HTTPAdapter(pool_connections=2, pool_maxsize=tamano_pool,
+                                     pool_block=True, max_retries=0)
+
+    def _reescribir_url(self, url):
+        if self.base_url and url.startswith(URL_TWILIO):
+            return self.base_url + url[len(URL_TWILIO):]
+        return url
+
+    def request(self, method, url, params=None, data=None, headers=None, auth=None,
+                timeout=None, allow_redirects=False):
+        if not self.circuito.permitir():
+            raise CircuitoAbierto("Circuito Twilio abierto: demasiados errores recientes.")
+
+        registrado = False
+        try:
+            preparado = Request(
+                method=method.upper(), url=self._reescribir_url(url), params=params,
+                data=data, headers=headers, auth=auth,
+            ).prepare()
+            headers_log = dict(preparado.headers)
+            headers_log.pop("Authorization", None)
+            self._test_only_last_request = {"method": method, "url": url, "headers": headers_log}
+
+            lectura = timeout if timeout is not None else self.timeout
+            try:
+                resp = self.adaptador.send(preparado, timeout=(self.timeout_conexion, lectura))
+            except RequestException:
+                registrado = True
+                self.circuito.registrar(False)
+                raise
+
+            # 5xx y 429 cuentan como fallo de Twilio; los 4xx son errores del mensaje
+            registrado = True
+            self.circuito.registrar(resp.status_code < 500 and resp.status_code != 429)
+        finally:
+            # Cualquier otra excepción no debe dejar el circuito semiabierto para siempre
+            if not registrado:
+                self.circuito.cancelar_prueba()
+        respuesta = Response(int(resp.status_code), resp.text, resp.headers)
+        self._test_only_last_response = respuesta
+        return respuesta
+
+    def cerrar(self):
+        self.adaptador.close()
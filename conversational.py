@@ -2,14 +2,38 @@
 # -*- coding: utf-8 -*-
 """
 Sistema conversacional para el bot de estilista.
-Maneja sesiones en memoria y flujos paso a paso.
+Maneja sesiones en memoria y flujos paso a paso sobre la máquina de
+estados de flujos.py (un manejador por estado).
 """
 
+import json
+import os
+import threading
 from datetime import datetime
-from estilista import clientas, guardar_clientas, TRATAMIENTOS
+from estilista import (duracion_cita, sugerir_cita, salon_defecto, salones,
+                       TELEFONOS_OPERADORAS, STATUS_CALLBACK_URL, es_operadora)
+from auditoria import auditar, ORIGEN_WHATSAPP
+from estados_entrega import texto_tasas
+from flujos import Contexto, EntradaInvalida, MaquinaEstados, Paso
 
-# Almacén de sesiones en memoria: {numero_telefono: {"estado": ..., "data": {...}}}
-sesiones = {}
+# Las sesiones viven en cada salón: {numero_telefono: {"estado": ..., "data": {...}}}
+# Es un LRU acotado: al superar MAX_SESIONES se descarta la sesión menos usada.
+# 'sesiones' queda como alias de las del salón por defecto.
+sesiones = salon_defecto.sesiones
+
+# Opciones del menú que muestran o modifican datos de clientas o disparan envíos
+# (sólo operadoras; sin operadoras configuradas no las puede usar nadie)
+OPCIONES_ADMIN = {"1", "2", "3", "4", "5", "7", "8", "9"}
+# Opciones abiertas a cualquier número
+OPCIONES_PUBLICAS = {"6"}
+
+# Si se define, cada intercambio se agrega a este JSONL (para reproducirlo con reproducir.py)
+RUTA_GRABACION = os.getenv("GRABAR_CONVERSACIONES")
+_grabacion_lock = threading.Lock()
+
+if not TELEFONOS_OPERADORAS and not salones.configurados():
+    print("⚠️ TELEFONOS_OPERADORAS no está definido: las opciones de gestión del menú de WhatsApp "
+          "quedan desactivadas para todos los números.")
 
 # Estados posibles del flujo
 ESTADO_MENU = "menu"
@@ -23,6 +47,13 @@ ESTADO_ACTUALIZAR_ID = "actualizar_id"
 ESTADO_ACTUALIZAR_CAMPO = "actualizar_campo"
 ESTADO_ACTUALIZAR_VALOR = "actualizar_valor"
 
+ESTADO_AGENDAR_ID = "agendar_id"
+ESTADO_AGENDAR_FECHA = "agendar_fecha"
+
+ESTADO_CAMPANA_FILTROS = "campana_filtros"
+ESTADO_CAMPANA_MENSAJE = "campana_mensaje"
+ESTADO_CAMPANA_CONFIRMAR = "campana_confirmar"
+
 # ==============================================
 # UTILIDADES
 # ==============================================
@@ -35,6 +66,14 @@ def validar_fecha(texto):
     except:
         return False
 
+def validar_fecha_hora(texto):
+    """Valida 'AAAA-MM-DD HH:MM'. Retorna (fecha, hora) o None."""
+    try:
+        dt = datetime.strptime(texto.strip(), "%Y-%m-%d %H:%M")
+        return dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M")
+    except:
+        return None
+
 def validar_telefono(texto):
     """Valida formato +57... (mínimo 10 dígitos después del +)"""
     texto = texto.strip()
@@ -42,22 +81,36 @@ def validar_telefono(texto):
         return True
     return False
 
-def obtener_sesion(telefono):
+def obtener_sesion(telefono, salon=None):
     """Obtiene o crea una sesión para un número."""
-    if telefono not in sesiones:
-        sesiones[telefono] = {
-            "estado": ESTADO_MENU,
-            "data": {}
-        }
-    return sesiones[telefono]
-
-def limpiar_sesion(telefono):
+    salon = salon or salon_defecto
+    sesiones = salon.sesiones
+    with salon.sesiones_lock:
+        if telefono not in sesiones:
+            sesiones[telefono] = {
+                "estado": ESTADO_MENU,
+                "data": {}
+            }
+            if len(sesiones) > salon.max_sesiones:
+                sesiones.popitem(last=False)
+        else:
+            sesiones.move_to_end(telefono)
+        return sesiones[telefono]
+
+def puede_administrar(telefono, salon=None):
+    """Sólo las operadoras pueden usar las opciones de gestión (sin lista configurada, nadie)."""
+    salon = salon or salon_defecto
+    return es_operadora(telefono, salon)
+
+def limpiar_sesion(telefono, salon=None):
     """Limpia la sesión (volver al menú principal)."""
-    if telefono in sesiones:
-        sesiones[telefono] = {
-            "estado": ESTADO_MENU,
-            "data": {}
-        }
+    salon = salon or salon_defecto
+    with salon.sesiones_lock:
+        if telefono in salon.sesiones:
+            salon.sesiones[telefono] = {
+                "estado": ESTADO_MENU,
+                "data": {}
+            }
 
 # ==============================================
 # MENSAJES
@@ -75,6 +128,9 @@ Escribe el número de la opción:
 4️⃣ Actualizar información
 5️⃣ Ejecutar recordatorios ahora
 6️⃣ Ayuda
+7️⃣ Agendar cita
+8️⃣ Enviar campaña / promoción
+9️⃣ Entrega de mensajes
 
 💡 _Escribe el número para continuar_"""
 
@@ -96,228 +152,427 @@ Este bot te ayuda a gestionar tus clientas y enviar recordatorios automáticos.
 
 5️⃣ *Recordatorios:* Envía los recordatorios programados ahora mismo
 
+7️⃣ *Agendar cita:* Reserva un horario libre para una clienta (detecta cruces)
+
+8️⃣ *Campaña:* Envía una promoción a un grupo de clientas filtrado por tipo de cabello, tratamiento o tiempo sin venir
+
+9️⃣ *Entrega:* Cuántos mensajes llegaron y se leyeron, por plantilla y por tratamiento
+
 _Escribe MENU en cualquier momento para volver al inicio_ ✨"""
 
 # ==============================================
-# MANEJADOR PRINCIPAL
+# MÁQUINA DE ESTADOS
 # ==============================================
 
-def procesar_mensaje(telefono, mensaje):
-    """
-    Procesa el mensaje según el estado de la sesión.
-    Retorna el texto de respuesta.
-    """
-    sesion = obtener_sesion(telefono)
-    estado = sesion["estado"]
-    data = sesion["data"]
+# Despacho O(1) {estado: manejador}; los flujos de agregar y actualizar son declarativos (Paso)
+maquina = MaquinaEstados(ESTADO_MENU)
+
+@maquina.estado(ESTADO_MENU)
+def _menu(ctx):
+    salon = ctx.salon
+    mensaje = ctx.mensaje
+    # El ID directo (cualquier número que no sea una opción del menú) muestra una clienta
+    es_id = mensaje.isdigit() and mensaje not in OPCIONES_PUBLICAS
+    if (mensaje in OPCIONES_ADMIN or es_id) and not puede_administrar(ctx.telefono, salon):
+        return "🔒 Esta opción está reservada para la estilista."
     
-    mensaje = mensaje.strip()
-    mensaje_upper = mensaje.upper()
+    if mensaje == "1":
+        return maquina.entrar(ctx, ESTADO_AGREGAR_NOMBRE)
     
-    # Comandos globales
-    if mensaje_upper in ["MENU", "MENÚ", "INICIO"]:
-        limpiar_sesion(telefono)
-        return mensaje_menu()
+    elif mensaje == "2":
+        return listar_clientas(salon)
     
-    if mensaje_upper in ["AYUDA", "HELP"]:
-        return mensaje_ayuda()
+    elif mensaje == "3":
+        return "🔍 *VER DETALLES*\n\nEscribe el ID de la clienta que quieres consultar.\n\n_Primero usa opción 2 para ver los IDs_"
     
-    # === MENÚ PRINCIPAL ===
-    if estado == ESTADO_MENU:
-        if mensaje == "1":
-            sesion["estado"] = ESTADO_AGREGAR_NOMBRE
-            sesion["data"] = {}
-            return "✨ *AGREGAR CLIENTA NUEVA*\n\n¿Cuál es el nombre completo de la clienta?\n\n_Escribe MENU para cancelar_"
-        
-        elif mensaje == "2":
-            return listar_clientas()
-        
-        elif mensaje == "3":
-            return "🔍 *VER DETALLES*\n\nEscribe el ID de la clienta que quieres consultar.\n\n_Primero usa opción 2 para ver los IDs_"
-        
-        elif mensaje == "4":
-            sesion["estado"] = ESTADO_ACTUALIZAR_ID
-            sesion["data"] = {}
-            return "✏️ *ACTUALIZAR INFORMACIÓN*\n\nEscribe el ID de la clienta que quieres actualizar.\n\n_Usa opción 2 para ver los IDs_"
-        
-        elif mensaje == "5":
-            from estilista import verificar_tratamientos
-            verificar_tratamientos()
-            return "✅ Recordatorios ejecutados. Revisa los logs del sistema para ver los envíos."
-        
-        elif mensaje == "6":
-            return mensaje_ayuda()
-        
-        else:
-            # Si es un número directo (ID), mostrar detalles
-            try:
-                cid = int(mensaje)
-                return ver_clienta(cid)
-            except:
-                return mensaje_menu()
+    elif mensaje == "4":
+        return maquina.entrar(ctx, ESTADO_ACTUALIZAR_ID)
     
-    # === FLUJO AGREGAR CLIENTA ===
-    elif estado == ESTADO_AGREGAR_NOMBRE:
-        data["nombre"] = mensaje
-        sesion["estado"] = ESTADO_AGREGAR_TELEFONO
-        return f"Perfecto, *{mensaje}* ✨\n\n¿Cuál es su número de teléfono?\n\n_Formato: +573001234567_"
+    elif mensaje == "5":
+        from estilista import verificar_tratamientos
+        verificar_tratamientos(salon, forzar=True)
+        return "✅ Recordatorios ejecutados. Revisa los logs del sistema para ver los envíos."
     
-    elif estado == ESTADO_AGREGAR_TELEFONO:
-        if not validar_telefono(mensaje):
-            return "⚠️ Número inválido. Debe iniciar con *+* seguido del código de país.\n\nEjemplo: +573001234567\n\nInténtalo de nuevo:"
-        data["telefono"] = mensaje
-        sesion["estado"] = ESTADO_AGREGAR_TRATAMIENTO
-        return mostrar_tratamientos()
+    elif mensaje == "6":
+        return mensaje_ayuda()
     
-    elif estado == ESTADO_AGREGAR_TRATAMIENTO:
-        try:
-            opcion = int(mensaje)
-            keys = list(TRATAMIENTOS.keys())
-            if 1 <= opcion <= len(keys):
-                data["tipo_tratamiento"] = keys[opcion - 1]
-                sesion["estado"] = ESTADO_AGREGAR_ULTIMO
-                return "¿Cuándo fue su último tratamiento?\n\nFormato: *AAAA-MM-DD*\nEjemplo: 2024-10-15\n\n_O escribe SALTAR para usar la fecha de hoy_"
-            else:
-                return "⚠️ Opción inválida. " + mostrar_tratamientos()
-        except:
-            return "⚠️ Debes escribir el número de la opción.\n\n" + mostrar_tratamientos()
+    elif mensaje == "7":
+        ctx.ir_a(ESTADO_AGENDAR_ID, {})
+        return "🗓️ *AGENDAR CITA*\n\nEscribe el ID de la clienta.\n\n_Usa opción 2 para ver los IDs_"
     
-    elif estado == ESTADO_AGREGAR_ULTIMO:
-        if mensaje_upper == "SALTAR":
-            data["ultimo_tratamiento"] = datetime.now().strftime("%Y-%m-%d")
-        elif validar_fecha(mensaje):
-            data["ultimo_tratamiento"] = mensaje
-        else:
-            return "⚠️ Fecha inválida. Usa formato *AAAA-MM-DD*\n\nEjemplo: 2024-10-15\n\nInténtalo de nuevo:"
-        
-        sesion["estado"] = ESTADO_AGREGAR_PROXIMO
-        return "¿Cuándo quieres enviar el recordatorio?\n\nFormato: *AAAA-MM-DD*\nEjemplo: 2025-01-15\n\n_O escribe SALTAR para dejarlo automático_"
+    elif mensaje == "8":
+        ctx.ir_a(ESTADO_CAMPANA_FILTROS, {})
+        return texto_pedir_filtros(salon)
     
-    elif estado == ESTADO_AGREGAR_PROXIMO:
-        if mensaje_upper == "SALTAR":
-            data["proximo_recordatorio"] = None
-        elif validar_fecha(mensaje):
-            data["proximo_recordatorio"] = mensaje
-        else:
-            return "⚠️ Fecha inválida. Usa formato *AAAA-MM-DD*\n\nEjemplo: 2025-01-15\n\nInténtalo de nuevo:"
-        
-        # Guardar clienta
-        resultado = guardar_clienta(data)
-        limpiar_sesion(telefono)
-        return resultado + "\n\n" + mensaje_menu()
+    elif mensaje == "9":
+        if not STATUS_CALLBACK_URL:
+            return ("📬 El seguimiento de entregas está desactivado: define STATUS_CALLBACK_URL "
+                    "(la URL pública de /status) para que Twilio informe el estado de cada mensaje.\n\n" + mensaje_menu())
+        return texto_tasas(salon.estados)
     
-    # === FLUJO ACTUALIZAR ===
-    elif estado == ESTADO_ACTUALIZAR_ID:
+    else:
+        # Si es un número directo (ID), mostrar detalles
         try:
             cid = int(mensaje)
-            clienta = next((c for c in clientas if c.get("id") == cid), None)
-            if clienta:
-                data["id"] = cid
-                data["clienta"] = clienta
-                sesion["estado"] = ESTADO_ACTUALIZAR_CAMPO
-                return f"Actualizando: *{clienta.get('nombre')}*\n\n¿Qué campo quieres actualizar?\n\n1️⃣ Nombre\n2️⃣ Teléfono\n3️⃣ Tipo de tratamiento\n4️⃣ Último tratamiento\n5️⃣ Próximo recordatorio\n\n_Escribe el número_"
-            else:
-                return f"⚠️ No existe clienta con ID {cid}.\n\nInténtalo de nuevo o escribe MENU:"
+            return ver_clienta(cid, salon)
         except:
-            return "⚠️ Debes escribir el ID (número).\n\nInténtalo de nuevo:"
+            return mensaje_menu()
+
+# === VALIDADORES COMUNES ===
+
+def _elegir_tratamiento(ctx, error_no_numero):
+    """Número de opción del menú de tratamientos -> clave del tratamiento."""
+    try:
+        tipo = ctx.salon.tratamientos.por_numero(int(ctx.mensaje))
+    except ValueError:
+        raise EntradaInvalida(error_no_numero + mostrar_tratamientos(ctx.salon))
+    if not tipo:
+        raise EntradaInvalida("⚠️ Opción inválida. " + mostrar_tratamientos(ctx.salon))
+    return tipo
+
+def _buscar_clienta_por_id(ctx):
+    try:
+        cid = int(ctx.mensaje)
+    except ValueError:
+        raise EntradaInvalida("⚠️ Debes escribir el ID (número).\n\nInténtalo de nuevo:")
+    clienta = next((c for c in ctx.salon.clientas if c.get("id") == cid), None)
+    if not clienta:
+        raise EntradaInvalida(f"⚠️ No existe clienta con ID {cid}.\n\nInténtalo de nuevo o escribe MENU:")
+    return clienta
+
+# === FLUJO AGREGAR CLIENTA ===
+
+def _validar_telefono_nuevo(ctx):
+    if not validar_telefono(ctx.mensaje):
+        raise EntradaInvalida("⚠️ Número inválido. Debe iniciar con *+* seguido del código de país.\n\nEjemplo: +573001234567\n\nInténtalo de nuevo:")
+    return ctx.mensaje
+
+def _validar_ultimo(ctx):
+    if ctx.mensaje_upper == "SALTAR":
+        return datetime.now().strftime("%Y-%m-%d")
+    if not validar_fecha(ctx.mensaje):
+        raise EntradaInvalida("⚠️ Fecha inválida. Usa formato *AAAA-MM-DD*\n\nEjemplo: 2024-10-15\n\nInténtalo de nuevo:")
+    return ctx.mensaje
+
+def _validar_proximo(ctx):
+    if ctx.mensaje_upper == "SALTAR":
+        return None
+    if not validar_fecha(ctx.mensaje):
+        raise EntradaInvalida("⚠️ Fecha inválida. Usa formato *AAAA-MM-DD*\n\nEjemplo: 2025-01-15\n\nInténtalo de nuevo:")
+    return ctx.mensaje
+
+def _completar_agregar(ctx):
+    resultado = guardar_clienta(ctx.data, ctx.salon, actor=ctx.telefono)
+    limpiar_sesion(ctx.telefono, ctx.salon)
+    return resultado + "\n\n" + mensaje_menu()
+
+maquina.paso(ESTADO_AGREGAR_NOMBRE, Paso(
+    pregunta="✨ *AGREGAR CLIENTA NUEVA*\n\n¿Cuál es el nombre completo de la clienta?\n\n_Escribe MENU para cancelar_",
+    campo="nombre",
+    siguiente=ESTADO_AGREGAR_TELEFONO,
+))
+maquina.paso(ESTADO_AGREGAR_TELEFONO, Paso(
+    pregunta=lambda ctx: f"Perfecto, *{ctx.data['nombre']}* ✨\n\n¿Cuál es su número de teléfono?\n\n_Formato: +573001234567_",
+    validar=_validar_telefono_nuevo,
+    campo="telefono",
+    siguiente=ESTADO_AGREGAR_TRATAMIENTO,
+))
+maquina.paso(ESTADO_AGREGAR_TRATAMIENTO, Paso(
+    pregunta=lambda ctx: mostrar_tratamientos(ctx.salon),
+    validar=lambda ctx: _elegir_tratamiento(ctx, "⚠️ Debes escribir el número de la opción.\n\n"),
+    campo="tipo_tratamiento",
+    siguiente=ESTADO_AGREGAR_ULTIMO,
+))
+maquina.paso(ESTADO_AGREGAR_ULTIMO, Paso(
+    pregunta="¿Cuándo fue su último tratamiento?\n\nFormato: *AAAA-MM-DD*\nEjemplo: 2024-10-15\n\n_O escribe SALTAR para usar la fecha de hoy_",
+    validar=_validar_ultimo,
+    campo="ultimo_tratamiento",
+    siguiente=ESTADO_AGREGAR_PROXIMO,
+))
+maquina.paso(ESTADO_AGREGAR_PROXIMO, Paso(
+    pregunta="¿Cuándo quieres enviar el recordatorio?\n\nFormato: *AAAA-MM-DD*\nEjemplo: 2025-01-15\n\n_O escribe SALTAR para dejarlo automático_",
+    validar=_validar_proximo,
+    campo="proximo_recordatorio",
+    al_completar=_completar_agregar,
+))
+
+# === FLUJO ACTUALIZAR ===
+
+CAMPOS_ACTUALIZABLES = {
+    "1": "nombre",
+    "2": "telefono",
+    "3": "tipo_tratamiento",
+    "4": "ultimo_tratamiento",
+    "5": "proximo_recordatorio",
+    "6": "nueva_visita",
+}
+
+def _validar_campo(ctx):
+    campo = CAMPOS_ACTUALIZABLES.get(ctx.mensaje)
+    if not campo:
+        raise EntradaInvalida("⚠️ Opción inválida. Escribe un número del 1 al 6:")
+    return campo
+
+def _pregunta_valor(ctx):
+    campo = ctx.data["campo"]
+    if campo == "tipo_tratamiento":
+        return mostrar_tratamientos(ctx.salon)
+    elif campo in ["ultimo_tratamiento", "proximo_recordatorio"]:
+        return f"Nuevo valor para *{campo}*:\n\nFormato: *AAAA-MM-DD*\nEjemplo: 2024-10-15\n\n_O escribe NINGUNO para borrar_"
+    elif campo == "nueva_visita":
+        return "📅 ¿Qué día vino?\n\nFormato: *AAAA-MM-DD*\n\n_O escribe HOY_"
+    return f"Nuevo valor para *{campo}*:"
+
+def _validar_valor(ctx):
+    campo = ctx.data["campo"]
+    if campo == "tipo_tratamiento":
+        return _elegir_tratamiento(ctx, "⚠️ Debes escribir el número. ")
+    if campo == "nueva_visita":
+        hoy = datetime.now().strftime("%Y-%m-%d")
+        if ctx.mensaje_upper == "HOY":
+            return hoy
+        if not validar_fecha(ctx.mensaje):
+            raise EntradaInvalida("⚠️ Fecha inválida. Formato: AAAA-MM-DD\n\nInténtalo de nuevo:")
+        if datetime.strptime(ctx.mensaje, "%Y-%m-%d").date() > datetime.now().date():
+            raise EntradaInvalida("⚠️ La visita no puede ser en el futuro.\n\nInténtalo de nuevo:")
+        return ctx.mensaje
+    if ctx.mensaje_upper == "NINGUNO":
+        return None
+    if campo == "telefono" and not validar_telefono(ctx.mensaje):
+        raise EntradaInvalida("⚠️ Teléfono inválido. Formato: +573001234567\n\nInténtalo de nuevo:")
+    if campo in ["ultimo_tratamiento", "proximo_recordatorio"] and not validar_fecha(ctx.mensaje):
+        raise EntradaInvalida("⚠️ Fecha inválida. Formato: AAAA-MM-DD\n\nInténtalo de nuevo:")
+    return ctx.mensaje
+
+def _completar_actualizar(ctx):
+    campo = ctx.data["campo"]
+    clienta = ctx.data["clienta"]
+    if campo == "nueva_visita":
+        return _completar_visita(ctx, clienta)
+    previa = dict(clienta)
+    clienta[campo] = ctx.data["valor"]
+    ctx.salon.guardar_clientas()
+    auditar(ctx.salon, ORIGEN_WHATSAPP, ctx.telefono, "actualizar", clienta.get("id"), campo, previa.get(campo), clienta[campo])
+    if campo in ["ultimo_tratamiento", "tipo_tratamiento"]:
+        # Editar es corregir la visita actual; una visita nueva se registra con la opción 6
+        ctx.salon.registrar_tratamiento(clienta, antes=previa)
+    limpiar_sesion(ctx.telefono, ctx.salon)
+    return f"✅ Campo *{campo}* actualizado para {clienta.get('nombre')}\n\n" + mensaje_menu()
+
+def _completar_visita(ctx, clienta):
+    fecha_previa = clienta.get("ultimo_tratamiento")
+    clienta["ultimo_tratamiento"] = ctx.data["valor"]
+    ctx.salon.guardar_clientas()
+    auditar(ctx.salon, ORIGEN_WHATSAPP, ctx.telefono, "registrar_visita", clienta.get("id"),
+            "ultimo_tratamiento", fecha_previa, clienta["ultimo_tratamiento"])
+    ctx.salon.registrar_tratamiento(clienta)
+    limpiar_sesion(ctx.telefono, ctx.salon)
+    return f"✅ Visita del {clienta['ultimo_tratamiento']} registrada para {clienta.get('nombre')}\n\n" + mensaje_menu()
+
+maquina.paso(ESTADO_ACTUALIZAR_ID, Paso(
+    pregunta="✏️ *ACTUALIZAR INFORMACIÓN*\n\nEscribe el ID de la clienta que quieres actualizar.\n\n_Usa opción 2 para ver los IDs_",
+    validar=_buscar_clienta_por_id,
+    campo="clienta",
+    siguiente=ESTADO_ACTUALIZAR_CAMPO,
+))
+maquina.paso(ESTADO_ACTUALIZAR_CAMPO, Paso(
+    pregunta=lambda ctx: f"Actualizando: *{ctx.data['clienta'].get('nombre')}*\n\n¿Qué campo quieres actualizar?\n\n1️⃣ Nombre\n2️⃣ Teléfono\n3️⃣ Tipo de tratamiento\n4️⃣ Último tratamiento (corregir)\n5️⃣ Próximo recordatorio\n6️⃣ Registrar visita nueva\n\n_Escribe el número_",
+    validar=_validar_campo,
+    campo="campo",
+    siguiente=ESTADO_ACTUALIZAR_VALOR,
+))
+maquina.paso(ESTADO_ACTUALIZAR_VALOR, Paso(
+    pregunta=_pregunta_valor,
+    validar=_validar_valor,
+    campo="valor",
+    al_completar=_completar_actualizar,
+))
+
+# === FLUJO AGENDAR CITA ===
+
+@maquina.estado(ESTADO_AGENDAR_ID)
+def _agendar_id(ctx):
+    try:
+        clienta = _buscar_clienta_por_id(ctx)
+    except EntradaInvalida as e:
+        return e.respuesta
+    ctx.data["clienta"] = clienta
+    ctx.data["sugerida"] = sugerir_cita(clienta, ctx.salon)
+    ctx.ir_a(ESTADO_AGENDAR_FECHA)
+    return f"Agendando a *{clienta.get('nombre')}*\n\n" + texto_pedir_horario(ctx.data["sugerida"])
+
+@maquina.estado(ESTADO_AGENDAR_FECHA)
+def _agendar_fecha(ctx):
+    salon = ctx.salon
+    data = ctx.data
+    clienta = data["clienta"]
+    if ctx.mensaje_upper == "SUGERIDA" and data.get("sugerida"):
+        fecha, hora = data["sugerida"]
+    else:
+        fh = validar_fecha_hora(ctx.mensaje)
+        if not fh:
+            return "⚠️ Formato inválido. Usa *AAAA-MM-DD HH:MM*\n\nEjemplo: 2025-01-15 10:00\n\nInténtalo de nuevo:"
+        fecha, hora = fh
     
-    elif estado == ESTADO_ACTUALIZAR_CAMPO:
-        campos = {
-            "1": "nombre",
-            "2": "telefono",
-            "3": "tipo_tratamiento",
-            "4": "ultimo_tratamiento",
-            "5": "proximo_recordatorio"
-        }
-        if mensaje in campos:
-            data["campo"] = campos[mensaje]
-            sesion["estado"] = ESTADO_ACTUALIZAR_VALOR
-            
-            if mensaje == "3":
-                return mostrar_tratamientos()
-            elif mensaje in ["4", "5"]:
-                return f"Nuevo valor para *{campos[mensaje]}*:\n\nFormato: *AAAA-MM-DD*\nEjemplo: 2024-10-15\n\n_O escribe NINGUNO para borrar_"
-            else:
-                return f"Nuevo valor para *{campos[mensaje]}*:"
-        else:
-            return "⚠️ Opción inválida. Escribe un número del 1 al 5:"
+    tipo = clienta.get("tipo_tratamiento")
+    cita = salon.agenda.reservar(clienta.get("id"), fecha, hora, duracion_cita(tipo, salon), tipo)
+    if not cita:
+        data["sugerida"] = salon.agenda.buscar_hueco(fecha, duracion_cita(tipo, salon), desde_hora=hora)
+        return f"⚠️ El {fecha} a las {hora} no está disponible (cruce con otra cita, fuera de horario o ya pasó).\n\n" + texto_pedir_horario(data["sugerida"])
     
-    elif estado == ESTADO_ACTUALIZAR_VALOR:
-        campo = data["campo"]
-        clienta = data["clienta"]
-        
-        # Validaciones específicas
-        if campo == "telefono" and mensaje_upper != "NINGUNO":
-            if not validar_telefono(mensaje):
-                return "⚠️ Teléfono inválido. Formato: +573001234567\n\nInténtalo de nuevo:"
-        
-        if campo in ["ultimo_tratamiento", "proximo_recordatorio"] and mensaje_upper != "NINGUNO":
-            if not validar_fecha(mensaje):
-                return "⚠️ Fecha inválida. Formato: AAAA-MM-DD\n\nInténtalo de nuevo:"
-        
-        if campo == "tipo_tratamiento":
-            try:
-                opcion = int(mensaje)
-                keys = list(TRATAMIENTOS.keys())
-                if 1 <= opcion <= len(keys):
-                    mensaje = keys[opcion - 1]
-                else:
-                    return "⚠️ Opción inválida. " + mostrar_tratamientos()
-            except:
-                return "⚠️ Debes escribir el número. " + mostrar_tratamientos()
-        
-        # Guardar cambio
-        if mensaje_upper == "NINGUNO":
-            clienta[campo] = None
-        else:
-            clienta[campo] = mensaje
-        
-        guardar_clientas()
-        limpiar_sesion(telefono)
-        return f"✅ Campo *{campo}* actualizado para {clienta.get('nombre')}\n\n" + mensaje_menu()
+    auditar(salon, ORIGEN_WHATSAPP, ctx.telefono, "agendar_cita", clienta.get("id"), despues=cita)
+    limpiar_sesion(ctx.telefono, salon)
+    return f"✅ Cita agendada para *{clienta.get('nombre')}*\n📅 {cita['fecha']} de {cita['inicio']} a {cita['fin']}\n\n" + mensaje_menu()
+
+# === FLUJO CAMPAÑA ===
+
+@maquina.estado(ESTADO_CAMPANA_FILTROS)
+def _campana_filtros(ctx):
+    import campanas
+    salon = ctx.salon
+    accion, _, campana_id = ctx.mensaje.partition(" ")
+    acciones = {"PAUSAR": campanas.CAMPANA_PAUSADA, "CANCELAR": campanas.CAMPANA_CANCELADA,
+                "REANUDAR": campanas.CAMPANA_EN_CURSO}
+    campana_id = campana_id.strip().lower()
+    if accion.upper() in acciones and campana_id:
+        if not campanas.id_valido(campana_id):
+            return "⚠️ ID de campaña inválido (ejemplo: 202501151030-a1b2). Inténtalo de nuevo:"
+        campana = campanas.cambiar_estado(campana_id, acciones[accion.upper()], salon)
+        limpiar_sesion(ctx.telefono, salon)
+        if not campana:
+            return f"⚠️ No hay una campaña activa con ID {campana_id}.\n\n" + mensaje_menu()
+        auditar(salon, ORIGEN_WHATSAPP, ctx.telefono, "campana", campo="campana",
+                despues={"id": campana["id"], "estado": campana["estado"]})
+        return f"✅ Campaña {campana['id']} ahora está *{campana['estado']}*.\n\n" + mensaje_menu()
+    try:
+        filtros = campanas.interpretar_filtros(ctx.mensaje)
+    except ValueError as e:
+        return f"⚠️ {e}.\n\n" + texto_pedir_filtros(salon)
+    total = campanas.contar(salon, **filtros)
+    if not total:
+        return "⚠️ Ninguna clienta cumple esos filtros. Prueba con otros:"
+    ctx.data["filtros"] = filtros
+    ctx.data["total"] = total
+    ctx.ir_a(ESTADO_CAMPANA_MENSAJE)
+    return f"👥 *{total}* clientas ({campanas.describir_filtros(filtros)}).\n\nEscribe el mensaje de la promoción.\n\n_Usa {{nombre}} para saludar a cada una por su nombre_"
+
+@maquina.estado(ESTADO_CAMPANA_MENSAJE)
+def _campana_mensaje(ctx):
+    ctx.data["mensaje"] = ctx.mensaje
+    ctx.ir_a(ESTADO_CAMPANA_CONFIRMAR)
+    return f"📣 *VISTA PREVIA*\n\n{ctx.mensaje}\n\nSe enviará a *{ctx.data['total']}* clientas. Escribe *ENVIAR* para confirmar o MENU para cancelar."
+
+@maquina.estado(ESTADO_CAMPANA_CONFIRMAR)
+def _campana_confirmar(ctx):
+    if ctx.mensaje_upper != "ENVIAR":
+        return "Escribe *ENVIAR* para confirmar o MENU para cancelar."
+    import campanas
+    campana = campanas.lanzar_campana(ctx.data["mensaje"], ctx.data["filtros"], ctx.salon)
+    auditar(ctx.salon, ORIGEN_WHATSAPP, ctx.telefono, "campana", campo="campana",
+            despues={"id": campana["id"], "estado": campana["estado"], "mensaje": campana["mensaje"],
+                     "filtros": campana["filtros"], "total": campana["total"]})
+    limpiar_sesion(ctx.telefono, ctx.salon)
+    return f"🚀 Campaña *{campana['id']}* en marcha ({campana['total']} clientas).\n\nPara pausarla escribe 8 y luego PAUSAR {campana['id']}.\n\n" + mensaje_menu()
+
+# ==============================================
+# MANEJADOR PRINCIPAL
+# ==============================================
+
+def _grabar(telefono, mensaje, respuesta, salon):
+    """Agrega el intercambio a GRABAR_CONVERSACIONES (para reproducirlo con reproducir.py)."""
+    registro = {"telefono": telefono, "to": salon.numero, "mensaje": mensaje, "respuesta": respuesta}
+    try:
+        with _grabacion_lock, open(RUTA_GRABACION, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"⚠️ No se pudo grabar la conversación: {e}")
+
+def procesar_mensaje(telefono, mensaje, salon=None):
+    """
+    Procesa el mensaje según el estado de la sesión.
+    'salon' es el salón al que escribieron (por defecto, el principal).
+    Retorna el texto de respuesta.
+    """
+    salon = salon or salon_defecto
+    ctx = Contexto(telefono, mensaje, salon, obtener_sesion(telefono, salon))
     
-    # Fallback
-    return mensaje_menu()
+    # Comandos globales
+    if ctx.mensaje_upper in ["MENU", "MENÚ", "INICIO"]:
+        limpiar_sesion(telefono, salon)
+        respuesta = mensaje_menu()
+    elif ctx.mensaje_upper in ["AYUDA", "HELP"]:
+        respuesta = mensaje_ayuda()
+    else:
+        respuesta = maquina.procesar(ctx)
+    
+    if RUTA_GRABACION:
+        _grabar(telefono, mensaje, respuesta, salon)
+    return respuesta
 
 # ==============================================
 # FUNCIONES AUXILIARES
 # ==============================================
 
-def mostrar_tratamientos():
+def mostrar_tratamientos(salon=None):
     """Muestra lista de tratamientos disponibles."""
+    salon = salon or salon_defecto
+    # El texto se arma una vez por versión del catálogo
+    return salon.tratamientos.derivado("menu_whatsapp", _texto_tratamientos)
+
+def _texto_tratamientos(tratamientos):
     texto = "💆‍♀️ *TRATAMIENTOS DISPONIBLES*\n\n"
-    keys = list(TRATAMIENTOS.keys())
-    for i, key in enumerate(keys, 1):
-        t = TRATAMIENTOS[key]
+    for i, key in enumerate(tratamientos, 1):
+        t = tratamientos[key]
         texto += f"{i}️⃣ {t['nombre']}\n   Duración: {t['duracion_meses']} meses\n   {t['precio']}\n\n"
     texto += "_Escribe el número del tratamiento_"
     return texto
 
-def listar_clientas():
+def texto_pedir_filtros(salon=None):
+    """Instrucciones de filtros + progreso de las últimas campañas."""
+    import campanas
+    texto = ("📣 *NUEVA CAMPAÑA*\n\n¿A quién se la enviamos? Escribe los filtros, por ejemplo:\n"
+             "cabello=rizado tratamiento=keratina sin_visita=90\n\n"
+             "_O escribe TODAS para enviar a todas las clientas_")
+    recientes = campanas.listar_campanas(salon)[:3]
+    if recientes:
+        texto += "\n\n*Últimas campañas:*\n" + "\n".join(campanas.texto_progreso(c) for c in recientes)
+        texto += "\n\n_PAUSAR / REANUDAR / CANCELAR <ID> para controlarlas_"
+    return texto
+
+def texto_pedir_horario(sugerida):
+    """Pide fecha y hora para la cita, ofreciendo el primer espacio libre."""
+    texto = "¿Qué día y hora?\n\nFormato: *AAAA-MM-DD HH:MM*\nEjemplo: 2025-01-15 10:00"
+    if sugerida:
+        texto += f"\n\n🗓️ Primer espacio libre: *{sugerida[0]} {sugerida[1]}*\n_Escribe SUGERIDA para tomarlo_"
+    return texto
+
+def listar_clientas(salon=None):
     """Lista todas las clientas."""
-    if not clientas:
+    salon = salon or salon_defecto
+    if not salon.clientas:
         return "📋 No hay clientas registradas aún.\n\n" + mensaje_menu()
     
-    texto = "📋 *TUS CLIENTAS* (Total: {})\n\n".format(len(clientas))
-    for c in clientas[:15]:  # Máximo 15 para no saturar
+    texto = "📋 *TUS CLIENTAS* (Total: {})\n\n".format(len(salon.clientas))
+    for c in salon.clientas[:15]:  # Máximo 15 para no saturar
         texto += f"*{c.get('id')}* - {c.get('nombre')}\n"
         texto += f"   📱 {c.get('telefono')}\n"
         proximo = c.get('proximo_recordatorio') or '—'
         texto += f"   📅 Próximo: {proximo}\n\n"
     
-    if len(clientas) > 15:
-        texto += f"_...y {len(clientas) - 15} más_\n\n"
+    if len(salon.clientas) > 15:
+        texto += f"_...y {len(salon.clientas) - 15} más_\n\n"
     
     texto += "💡 _Escribe el ID para ver detalles_"
     return texto
 
-def ver_clienta(cid):
+def ver_clienta(cid, salon=None):
     """Muestra detalles de una clienta."""
-    clienta = next((c for c in clientas if c.get("id") == cid), None)
+    salon = salon or salon_defecto
+    clienta = next((c for c in salon.clientas if c.get("id") == cid), None)
     if not clienta:
         return f"⚠️ No existe clienta con ID {cid}\n\n" + mensaje_menu()
     
-    trat = TRATAMIENTOS.get(clienta.get('tipo_tratamiento'), {})
+    trat = salon.tratamientos.get(clienta.get('tipo_tratamiento'), {})
     
     texto = f"👤 *{clienta.get('nombre')}* (ID: {cid})\n\n"
     texto += f"📱 Teléfono: {clienta.get('telefono')}\n"
@@ -328,12 +583,23 @@ def ver_clienta(cid):
     if clienta.get('ultimo_recordatorio_enviado'):
         texto += f"✅ Último envío: {clienta.get('ultimo_recordatorio_enviado')}\n"
     
+    visitas = salon.historial.ultimas_visitas(cid, 3)
+    if len(visitas) > 1:
+        texto += "🗂️ Últimas visitas:\n"
+        for fecha, tipo in visitas:
+            texto += f"   • {fecha} - {salon.tratamientos.get(tipo, {}).get('nombre', tipo)}\n"
+    
+    proximas = salon.agenda.citas_de_clienta(cid)
+    if proximas:
+        texto += f"🗓️ Próxima cita: {proximas[0]['fecha']} {proximas[0]['inicio']}\n"
+    
     texto += f"\n💡 _Usa opción 4 del menú para actualizar_"
     return texto
 
-def guardar_clienta(data):
-    """Guarda una nueva clienta en la base de datos."""
-    nuevo_id = max((c.get("id", 0) for c in clientas), default=0) + 1
+def guardar_clienta(data, salon=None, actor=None):
+    """Guarda una nueva clienta en la base de datos. 'actor' es quien la agregó (para la auditoría)."""
+    salon = salon or salon_defecto
+    nuevo_id = max((c.get("id", 0) for c in salon.clientas), default=0) + 1
     
     nueva = {
         "id": nuevo_id,
@@ -347,9 +613,11 @@ def guardar_clienta(data):
         "ultimo_recordatorio_enviado": None
     }
     
-    clientas.append(nueva)
-    guardar_clientas()
+    salon.clientas.append(nueva)
+    salon.guardar_clientas()
+    salon.registrar_tratamiento(nueva)
+    auditar(salon, ORIGEN_WHATSAPP, actor, "crear_clienta", nuevo_id, despues=nueva)
     
-    trat = TRATAMIENTOS.get(nueva["tipo_tratamiento"], {})
+    trat = salon.tratamientos.get(nueva["tipo_tratamiento"], {})
     
     return f"✅ *Clienta agregada exitosamente*\n\n👤 {nueva['nombre']}\n📱 {nueva['telefono']}\n💆‍♀️ {trat.get('nombre')}\nID: {nuevo_id}"
\ No newline at end of file
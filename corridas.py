@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Corridas de recordatorios reanudables.
+
+Cada verificación diaria de un salón es un trabajo persistido en
+<directorio del salón>/corridas/AAAA-MM-DD.json:
+    {"fecha": ..., "estado": "en_curso" | "terminada", "cursor": último id procesado,
+     "enviados": N, "lotes": N, "inicio": ..., "actualizada": ...}
+
+Las clientas se recorren por id en lotes de RECORDATORIOS_LOTE. Al cerrar cada
+lote se guardan juntos los cambios de las clientas (un solo clientas.json) y el
+checkpoint. Si el proceso muere a mitad de un lote, la siguiente ejecución
+retoma desde el último lote confirmado; los envíos de ese lote que ya habían
+salido están en el ledger de envíos y no se repiten.
+
+Una corrida sólo cuenta si empezó después del último horario programado del
+salón (hora_recordatorio): la verificación al arrancar a las 08:00 no evita
+la de las 10:00, pero un reinicio a las 11:00 no repite la de las 10:00.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+RECORDATORIOS_LOTE = int(os.getenv("RECORDATORIOS_LOTE", "50"))
+CORRIDAS_A_CONSERVAR = int(os.getenv("CORRIDAS_A_CONSERVAR", "30"))
+
+CORRIDA_EN_CURSO = "en_curso"
+CORRIDA_TERMINADA = "terminada"
+
+
+def ultimo_horario(hora, ahora=None):
+    """Último momento programado 'HH:MM' que ya pasó (hoy o ayer), como 'AAAA-MM-DD HH:MM:SS'."""
+    ahora = ahora or datetime.now()
+    h, m = (int(p) for p in hora.split(":"))
+    programado = ahora.replace(hour=h, minute=m, second=0, microsecond=0)
+    if programado > ahora:
+        programado -= timedelta(days=1)
+    return programado.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CorridaRecordatorios:
+    """Estado persistido de la corrida de un día."""
+
+    def __init__(self, directorio, fecha):
+        self.directorio = os.path.join(directorio, "corridas")
+        self.fecha = fecha
+        self.ruta = os.path.join(self.directorio, f"{fecha}.json")
+        self.datos = None
+
+    def cargar(self):
+        """Carga la corrida del día (o crea una nueva). Retorna self."""
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                self.datos = json.load(f)
+        except FileNotFoundError:
+            self.datos = None
+        except Exception as e:
+            print(f"⚠️ Checkpoint de recordatorios ilegible ({e}); se empieza de cero.")
+            self.datos = None
+        if self.datos is None:
+            self.reiniciar()
+        return self
+
+    def reiniciar(self):
+        self.datos = {
+            "fecha": self.fecha,
+            "estado": CORRIDA_EN_CURSO,
+            "cursor": None,
+            "enviados": 0,
+            "lotes": 0,
+            "inicio": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def iniciada_antes(self, momento):
+        """True si la corrida empezó antes de 'momento' ('AAAA-MM-DD HH:MM:SS')."""
+        return self.datos["inicio"] < momento
+
+    @property
+    def terminada(self):
+        return self.datos["estado"] == CORRIDA_TERMINADA
+
+    @property
+    def cursor(self):
+        return self.datos["cursor"]
+
+    def confirmar_lote(self, cursor, enviados):
+        """Checkpoint atómico del lote: avanza el cursor y suma los envíos."""
+        self.datos["cursor"] = cursor
+        self.datos["enviados"] += enviados
+        self.datos["lotes"] += 1
+        self._guardar()
+
+    def terminar(self):
+        self.datos["estado"] = CORRIDA_TERMINADA
+        self._guardar()
+        self._podar()
+
+    def _guardar(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        self.datos["actualizada"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Temporal propio de cada hilo/proceso: dos workers guardando a la vez no se pisan el .tmp
+        tmp = f"{self.ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.datos, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ruta)
+
+    def _podar(self):
+        """Conserva sólo las últimas CORRIDAS_A_CONSERVAR corridas."""
+        try:
+            viejas = sorted(n for n in os.listdir(self.directorio) if n.endswith(".json"))
+            for nombre in viejas[:-CORRIDAS_A_CONSERVAR]:
+                os.remove(os.path.join(self.directorio, nombre))
+        except OSError as e:
+            print(f"⚠️ No se pudieron podar corridas antiguas: {e}")
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Estados de entrega de los mensajes enviados (status callbacks de Twilio).
+
+Twilio llama a POST /status con MessageSid y MessageStatus
+(queued, sent, delivered, read, failed, undelivered). Cada salón guarda sus
+estados en estados.jsonl, indexados por SID:
+    {"sid": "SM...", "e": "delivered", "ts": 1736950000,
+     "k": "7|2025-01-15|recordatorio_keratina", "pl": "recordatorio", "tr": "keratina",
+     "tel": "+57300...", "body": "...", "n": 0}
+El archivo es append-only y se compacta con podar(); en memoria se mantiene
+el último estado de cada SID.
+
+- El callback sólo actualiza memoria y deja la línea pendiente. Un hilo la
+  escribe en lote cada ESTADOS_FLUSH_SEG segundos, así el webhook no espera
+  al disco.
+- Los estados pueden llegar desordenados. Sólo se avanza:
+  queued < sent < failed/undelivered < delivered < read.
+- Un envío fallido queda disponible para reenviarse (ver
+  reintentar_entregas_fallidas en estilista.py) hasta MAX_REINTENTOS_ENTREGA veces.
+  Antes de reenviar se reclama con reclamar_reintento(), bajo el lock del
+  archivo: si varios workers ven el mismo fallo, sólo uno lo reenvía.
+- tasas() calcula la tasa de entrega y de lectura por plantilla o por tratamiento.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import weakref
+
+from bloqueos import bloqueo_archivo
+
+ESTADOS_FLUSH_SEG = float(os.getenv("ESTADOS_FLUSH_SEG", "1"))
+MAX_REINTENTOS_ENTREGA = int(os.getenv("MAX_REINTENTOS_ENTREGA", "1"))
+REINTENTO_ENTREGA_MIN = int(os.getenv("REINTENTO_ENTREGA_MIN", "15"))
+
+ORDEN_ESTADOS = {
+    "accepted": 0, "scheduled": 0, "queued": 0, "sending": 0,
+    "sent": 1,
+    "failed": 2, "undelivered": 2,
+    "delivered": 3,
+    "read": 4,
+}
+ESTADOS_FALLIDOS = {"failed", "undelivered"}
+ESTADOS_ENTREGADOS = {"delivered", "read"}
+
+_registros = weakref.WeakSet()
+_hilo = None
+_hilo_lock = threading.Lock()
+
+
+class RegistroEstados:
+    """Último estado de entrega por SID, con escritura en lotes y lectura incremental."""
+
+    def __init__(self, ruta, retencion_dias=90):
+        self.ruta = ruta
+        self.retencion_seg = retencion_dias * 86400
+        self._por_sid = {}
+        self._pendientes = []
+        self._offset = 0
+        self._inodo = None
+        self._lock = threading.RLock()
+
+    # ---------- Memoria ----------
+
+    def _aplicar(self, reg):
+        """Fusiona un registro con lo conocido del SID (idempotente)."""
+        sid = reg.get("sid")
+        if not sid:
+            return None
+        actual = self._por_sid.get(sid)
+        if actual is None:
+            actual = self._por_sid[sid] = {"sid": sid}
+        for campo, valor in reg.items():
+            if campo == "e":
+                if ORDEN_ESTADOS.get(valor, 0) >= ORDEN_ESTADOS.get(actual.get("e"), -1):
+                    actual["e"] = valor
+                    actual["ts"] = reg.get("ts", actual.get("ts"))
+            elif campo == "ts":
+                actual.setdefault("ts", valor)
+            elif valor is not None:
+                actual[campo] = valor
+        if actual.get("e") in ESTADOS_ENTREGADOS:
+            actual.pop("body", None)  # ya no hace falta para reenviar
+        return actual
+
+    def _anotar(self, reg):
+        with self._lock:
+            self._pendientes.append(json.dumps(reg, ensure_ascii=False, separators=(",", ":")))
+            actual = self._aplicar(reg)
+        _iniciar_escritor(self)
+        return actual
+
+    # ---------- Disco ----------
+
+    def _refrescar(self):
+        """Lee las líneas nuevas del archivo (las que escribieron otros procesos)."""
+        try:
+            st = os.stat(self.ruta)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._inodo or st.st_size < self._offset:
+            self._offset = 0
+            self._inodo = st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.ruta, "rb") as f:
+            f.seek(self._offset)
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break
+                self._offset += len(linea)
+                try:
+                    self._aplicar(json.loads(linea.decode("utf-8")))
+                except ValueError:
+                    continue
+
+    def vaciar(self):
+        """Escribe en un solo append las líneas pendientes."""
+        with self._lock:
+            lineas, self._pendientes = self._pendientes, []
+        if not lineas:
+            return 0
+        with bloqueo_archivo(self.ruta):
+            with open(self.ruta, "a", encoding="utf-8", newline="\n") as f:
+                f.write("\n".join(lineas) + "\n")
+        return len(lineas)
+
+    def cargar(self):
+        with self._lock:
+            self._por_sid = {}
+            self._offset = 0
+            self._inodo = None
+            self._refrescar()
+        return self
+
+    def podar(self):
+        """Reescribe el archivo con una línea por SID, descartando lo más viejo que la retención."""
+        self.vaciar()
+        with self._lock, bloqueo_archivo(self.ruta):
+            self._refrescar()
+            limite = int(time.time()) - self.retencion_seg
+            vivos = {s: r for s, r in self._por_sid.items() if r.get("ts", 0) >= limite}
+            eliminados = len(self._por_sid) - len(vivos)
+            if not eliminados:
+                return 0
+            tmp = self.ruta + ".tmp"
+            with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+                for r in sorted(vivos.values(), key=lambda r: r.get("ts", 0)):
+                    f.write(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n")
+            os.replace(tmp, self.ruta)
+            self._por_sid = vivos
+            st = os.stat(self.ruta)
+            self._inodo, self._offset = st.st_ino, st.st_size
+            return eliminados
+
+    # ---------- API pública ----------
+
+    def registrar_envio(self, sid, telefono, clave=None, plantilla=None, tratamiento=None,
+                        cuerpo=None, intento=0):
+        """Anota un mensaje recién aceptado por Twilio (estado 'queued')."""
+        return self._anotar({
+            "sid": sid, "e": "queued", "ts": int(time.time()), "k": clave, "pl": plantilla,
+            "tr": tratamiento, "tel": telefono, "body": cuerpo[:1600] if cuerpo else None, "n": intento,
+        })
+
+    def actualizar(self, sid, estado, error=None):
+        """Aplica un status callback. O(1): no lee ni escribe disco."""
+        return self._anotar({"sid": sid, "e": estado, "ts": int(time.time()), "err": error})
+
+    def reclamar_reintento(self, sid):
+        """
+        Marca el SID como reintentado, escribiéndolo ya (no en el próximo lote) y bajo
+        el lock del archivo. False si otro proceso o hilo lo reclamó antes.
+        """
+        reg = {"sid": sid, "rt": True}
+        with self._lock, bloqueo_archivo(self.ruta):
+            self._refrescar()
+            actual = self._por_sid.get(sid)
+            if actual is None or actual.get("rt"):
+                return False
+            lineas, self._pendientes = self._pendientes, []
+            lineas.append(json.dumps(reg, ensure_ascii=False, separators=(",", ":")))
+            with open(self.ruta, "a", encoding="utf-8", newline="\n") as f:
+                f.write("\n".join(lineas) + "\n")
+            self._aplicar(reg)
+            return True
+
+    def obtener(self, sid):
+        with self._lock:
+            self._refrescar()
+            reg = self._por_sid.get(sid)
+            return dict(reg) if reg else None
+
+    def fallidos_para_reintentar(self, max_intentos=MAX_REINTENTOS_ENTREGA, espera_min=REINTENTO_ENTREGA_MIN):
+        """Envíos fallidos que aún no se reintentaron y tienen el texto guardado."""
+        limite = int(time.time()) - espera_min * 60
+        with self._lock:
+            self._refrescar()
+            return [
+                dict(r) for r in self._por_sid.values()
+                if r.get("e") in ESTADOS_FALLIDOS and not r.get("rt") and r.get("body") and r.get("tel")
+                and r.get("n", 0) < max_intentos and r.get("ts", 0) <= limite
+            ]
+
+    def tasas(self, por="plantilla"):
+        """
+        {plantilla o tratamiento: {"enviados", "entregados", "leidos", "fallidos",
+                                   "tasa_entrega", "tasa_lectura"}}
+        La tasa de lectura es sobre los entregados (no todos tienen confirmación de lectura).
+        """
+        campo = "pl" if por == "plantilla" else "tr"
+        grupos = {}
+        with self._lock:
+            self._refrescar()
+            for r in self._por_sid.values():
+                if "tel" not in r:
+                    continue  # sólo callback, el envío es de otro salón/proceso ya podado
+                g = grupos.setdefault(r.get(campo) or "—", {"enviados": 0, "entregados": 0, "leidos": 0, "fallidos": 0})
+                g["enviados"] += 1
+                estado = r.get("e")
+                if estado in ESTADOS_ENTREGADOS:
+                    g["entregados"] += 1
+                if estado == "read":
+                    g["leidos"] += 1
+                if estado in ESTADOS_FALLIDOS:
+                    g["fallidos"] += 1
+        for g in grupos.values():
+            g["tasa_entrega"] = g["entregados"] / g["enviados"] if g["enviados"] else 0.0
+            g["tasa_lectura"] = g["leidos"] / g["entregados"] if g["entregados"] else 0.0
+        return grupos
+
+
+# ---------- Escritor en segundo plano ----------
+
+def _escribir_pendientes():
+    while True:
+        time.sleep(ESTADOS_FLUSH_SEG)
+        vaciar_todos()
+
+
+def vaciar_todos():
+    for registro in list(_registros):
+        try:
+            registro.vaciar()
+        except Exception as e:
+            print(f"⚠️ Error al guardar estados de entrega en {registro.ruta}: {e}")
+
+
+def _iniciar_escritor(registro):
+    global _hilo
+    _registros.add(registro)
+    if _hilo is not None and _hilo.is_alive():
+        return
+    with _hilo_lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_escribir_pendientes, daemon=True)
+            _hilo.start()
+
+
+atexit.register(vaciar_todos)
+
+
+def texto_tasas(registro):
+    """Resumen para WhatsApp: tasas por plantilla y por tratamiento."""
+    texto = "📬 *ENTREGA DE MENSAJES*\n"
+    for por, titulo in (("plantilla", "Por plantilla"), ("tratamiento", "Por tratamiento")):
+        grupos = registro.tasas(por)
+        if not grupos:
+            continue
+        texto += f"\n*{titulo}:*\n"
+        for nombre, g in sorted(grupos.items(), key=lambda x: -x[1]["enviados"]):
+            texto += (f"• {nombre}: {g['enviados']} enviados, ✅ {g['tasa_entrega']:.0%} entregados, "
+                      f"👀 {g['tasa_lectura']:.0%} leídos, ❌ {g['fallidos']} fallidos\n")
+    if texto.endswith("*\n"):
+        texto += "\nAún no hay mensajes registrados."
+    return texto.strip()
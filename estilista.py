@@ -8,13 +8,22 @@ Nota: Se añadió un alias verificar_recordatorios_diarios() para mantener
 compatibilidad con imports antiguos (por ejemplo desde auto_estilista.py).
 """
 
-import json
 import os
 import schedule
 import time
 from datetime import datetime, date, timedelta
 from twilio.rest import Client
 
+from auditoria import auditar, auditar_diferencias, ORIGEN_CONSOLA
+from catalogo import CatalogoTratamientos
+from citas import DURACION_CITA_DEFECTO, RUTA_CITAS
+from corridas import CorridaRecordatorios, RECORDATORIOS_LOTE, ultimo_horario
+from estados_entrega import REINTENTO_ENTREGA_MIN
+from cliente_http import ClienteHttpTwilio
+from historial import fecha_a_ordinal
+from registro_envios import RegistroEnvios, ESTADO_ENVIADO
+from salones import Salon, RegistroSalones, normalizar_telefono
+
 # ==============================================
 # CONFIGURACIÓN INICIAL (SEGURA)
 # ==============================================
@@ -26,6 +35,15 @@ TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 # Valor por defecto sólo como placeholder; en producción define la variable de entorno.
 TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886")
 
+# Capa HTTP para Twilio: tamaño del pool, timeout por solicitud (segundos) y
+# URL base opcional (p. ej. http://127.0.0.1:8099 para el stub de stub_twilio.py)
+TWILIO_HTTP_POOL = int(os.getenv("TWILIO_HTTP_POOL", "10"))
+TWILIO_HTTP_TIMEOUT = float(os.getenv("TWILIO_HTTP_TIMEOUT", "10"))
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL")
+# URL pública de POST /status (webhook.py). Si se define, Twilio informa ahí
+# el estado de entrega de cada mensaje (sent, delivered, read, failed...).
+STATUS_CALLBACK_URL = os.getenv("STATUS_CALLBACK_URL")
+
 # DummyClient correcto que imita client.messages.create(...) para pruebas locales
 class DummyMessages:
     def create(self, **kwargs):
@@ -41,13 +59,24 @@ class DummyClient:
     def __init__(self):
         self.messages = DummyMessages()
 
-# Inicializar client (Twilio real o Dummy)
-if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
+def crear_http_client():
+    """Cliente HTTP compartido (pool + keep-alive + timeouts + circuit breaker)."""
+    return ClienteHttpTwilio(
+        tamano_pool=TWILIO_HTTP_POOL,
+        timeout=TWILIO_HTTP_TIMEOUT,
+        base_url=TWILIO_API_BASE_URL,
+    )
+
+# Inicializar client (Twilio real, stub local o Dummy)
+if TWILIO_API_BASE_URL and (not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN):
+    client = Client("AC" + "0" * 32, "stub", http_client=crear_http_client())
+    print(f"🧪 MODO STUB: los envíos van a {TWILIO_API_BASE_URL}")
+elif not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
     print("⚠️ Advertencia: No se encontraron variables de entorno de Twilio.")
     print("   El sistema funcionará en MODO DEBUG (no enviará mensajes reales).")
     client = DummyClient()
 else:
-    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=crear_http_client())
     print("🔑 Credenciales Twilio cargadas correctamente.")
 
 # ==============================================
@@ -56,44 +85,118 @@ else:
 
 RUTA_DATOS = "clientas.json"
 
+# Ledger de idempotencia de envíos (clave: id|fecha|plantilla) con SID de Twilio
+RUTA_ENVIOS = os.getenv("RUTA_ENVIOS", "envios.jsonl")
+RUTA_INTENCIONES = os.getenv("RUTA_INTENCIONES", "intenciones.jsonl")
+RUTA_HISTORIAL = os.getenv("RUTA_HISTORIAL", "historial.bin")
+# Registro de cambios hechos por las operadoras (ver auditoria.py)
+RUTA_AUDITORIA = os.getenv("RUTA_AUDITORIA", "auditoria.jsonl")
+RUTA_ESTADOS = os.getenv("RUTA_ESTADOS", "estados.jsonl")
+
+# ==============================================
+# TIPOS DE TRATAMIENTOS Y DURACIÓN (configurable)
+# ==============================================
+
+# El catálogo se edita en tratamientos.json y se recarga solo al cambiar el
+# archivo (ver catalogo.py). Estos valores se usan únicamente si el archivo no existe.
+RUTA_TRATAMIENTOS = os.getenv("RUTA_TRATAMIENTOS", "tratamientos.json")
+
+TRATAMIENTOS_POR_DEFECTO = {
+    "keratina": {
+        "nombre": "Keratina / Alisado",
+        "duracion_meses": 3,
+        "duracion_cita_min": 180,
+        "precio": "$150.000 - $250.000",
+        "beneficios": [
+            "Cabello liso y manejable",
+            "Brillo intenso",
+            "Reduce el frizz",
+            "Elimina el volumen"
+        ]
+    },
+    "botox_capilar": {
+        "nombre": "Botox Capilar",
+        "duracion_meses": 2,
+        "duracion_cita_min": 120,
+        "precio": "$120.000 - $180.000",
+        "beneficios": [
+            "Hidratación profunda",
+            "Reparación del cabello",
+            "Brillo y suavidad",
+            "Fortalece la fibra capilar"
+        ]
+    },
+}
+
+TRATAMIENTOS = CatalogoTratamientos(RUTA_TRATAMIENTOS, respaldo=TRATAMIENTOS_POR_DEFECTO)
+
+# ==============================================
+# SALONES (multi-tenant)
+# ==============================================
+
+# Teléfonos de la estilista / operadoras (separados por coma). Reciben el
+# resumen de respuestas de clientas y siempre entran al menú de gestión.
+TELEFONOS_OPERADORAS = {
+    normalizar_telefono(t) for t in os.getenv("TELEFONOS_OPERADORAS", "").split(",") if t.strip()
+}
+
+# Salón por defecto: los archivos de siempre en el directorio de trabajo.
+# Los demás salones se configuran en salones.json (ver salones.py).
+salon_defecto = Salon(
+    TWILIO_WHATSAPP_NUMBER,
+    nombre="Salón principal",
+    directorio=".",
+    operadoras=TELEFONOS_OPERADORAS,
+    tratamientos=TRATAMIENTOS,
+    ruta_datos=RUTA_DATOS,
+    ruta_envios=RUTA_ENVIOS,
+    ruta_citas=RUTA_CITAS,
+    ruta_intenciones=RUTA_INTENCIONES,
+    ruta_historial=RUTA_HISTORIAL,
+    ruta_auditoria=RUTA_AUDITORIA,
+    ruta_estados=RUTA_ESTADOS,
+)
+salones = RegistroSalones(salon_defecto, TRATAMIENTOS)
+
+# Alias del salón por defecto (la consola y el código existente los usan directamente)
+clientas = salon_defecto.clientas
+indice_telefonos = salon_defecto.indice_telefonos
+registro_envios = salon_defecto.registro_envios
+agenda = salon_defecto.agenda
+historial = salon_defecto.historial
+
 # ==============================================
 # FUNCIONES DE GUARDADO Y CARGA
 # ==============================================
 
-def guardar_clientas():
-    """Guarda la lista global clientas en clientas.json"""
-    try:
-        with open(RUTA_DATOS, "w", encoding="utf-8") as f:
-            json.dump(clientas, f, ensure_ascii=False, indent=4)
-        print("💾 Datos guardados correctamente.")
-    except Exception as e:
-        print(f"❌ Error al guardar datos: {e}")
+def guardar_clientas(salon=None):
+    """Guarda las clientas del salón (por defecto, clientas.json)"""
+    (salon or salon_defecto).guardar_clientas()
 
-def cargar_clientas():
-    """Carga clientas desde clientas.json si existe"""
-    global clientas
-    if os.path.exists(RUTA_DATOS):
-        try:
-            with open(RUTA_DATOS, "r", encoding="utf-8") as f:
-                clientas = json.load(f)
-            print(f"📂 {len(clientas)} clientas cargadas desde {RUTA_DATOS}.")
-        except Exception as e:
-            print(f"⚠️ Error al cargar datos: {e}")
-            clientas = []
-    else:
-        clientas = []
-        print("📁 No existe archivo de datos. Se creará cuando agregues la primera clienta.")
+def cargar_clientas(salon=None):
+    """Carga las clientas del salón (por defecto, clientas.json) si existe"""
+    (salon or salon_defecto).cargar_clientas()
+
+def buscar_clienta_por_telefono(telefono, salon=None):
+    """Devuelve la clienta con ese teléfono (O(1)) o None."""
+    return (salon or salon_defecto).buscar_clienta_por_telefono(telefono)
+
+def es_operadora(telefono, salon=None):
+    """True si el número está configurado como operadora del salón."""
+    return (salon or salon_defecto).es_operadora(telefono)
 
 # ==============================================
 # DATOS INICIALES (se cargarán desde JSON)
 # ==============================================
 
 cargar_clientas()
+agenda.cargar()
+salon_defecto.estados.cargar()
 
 # Si no hay clientas, opcionalmente inicializar con ejemplos (comentado por defecto)
 if not clientas:
     # Si quieres ejemplos por primera vez, descomenta este bloque.
-    clientas = [
+    clientas[:] = [
         {
             "id": 1,
             "nombre": "Ana María López",
@@ -119,35 +222,36 @@ if not clientas:
     ]
     guardar_clientas()
 
+# Historial de visitas (se crea a partir de los datos actuales la primera vez)
+historial.cargar()
+historial.sembrar_desde_clientas(clientas)
+
+def clientas_atrasadas(ciclos=2, salon=None):
+    """
+    Genera (clienta, tratamiento, fecha_ultima, dias_sin_volver) para quienes
+    llevan más de 'ciclos' duraciones sin repetir un tratamiento.
+    """
+    salon = salon or salon_defecto
+    por_id = {c.get("id"): c for c in salon.clientas}
+    for cid, tipo, fecha, dias in salon.historial.clientas_atrasadas(salon.tratamientos.duracion_dias, ciclos):
+        if cid in por_id:
+            yield por_id[cid], tipo, fecha, dias
+
 # ==============================================
-# TIPOS DE TRATAMIENTOS Y DURACIÓN (configurable)
+# AGENDA DE CITAS
 # ==============================================
 
-TRATAMIENTOS = {
-    "keratina": {
-        "nombre": "Keratina / Alisado",
-        "duracion_meses": 3,
-        "precio": "$150.000 - $250.000",
-        "beneficios": [
-            "Cabello liso y manejable",
-            "Brillo intenso",
-            "Reduce el frizz",
-            "Elimina el volumen"
-        ]
-    },
-    "botox_capilar": {
-        "nombre": "Botox Capilar",
-        "duracion_meses": 2,
-        "precio": "$120.000 - $180.000",
-        "beneficios": [
-            "Hidratación profunda",
-            "Reparación del cabello",
-            "Brillo y suavidad",
-            "Fortalece la fibra capilar"
-        ]
-    },
-    # Agrega más tratamientos aquí si hace falta
-}
+def duracion_cita(tipo_tratamiento, salon=None):
+    """Minutos que ocupa la cita de un tratamiento."""
+    tratamientos = (salon or salon_defecto).tratamientos
+    return tratamientos.get(tipo_tratamiento, {}).get("duracion_cita_min", DURACION_CITA_DEFECTO)
+
+def sugerir_cita(clienta, salon=None, tipo=None):
+    """Primer espacio libre desde su próximo recordatorio (o hoy): (fecha, 'HH:MM') o None."""
+    salon = salon or salon_defecto
+    desde = clienta.get("proximo_recordatorio") or hoy_str()
+    tipo = tipo or clienta.get("tipo_tratamiento")
+    return salon.agenda.buscar_hueco(desde, duracion_cita(tipo, salon))
 
 # ==============================================
 # UTILIDADES DE FECHAS
@@ -168,28 +272,65 @@ def sumar_meses_aproximado(fecha_str, meses):
 # MENSAJERÍA (plantillas)
 # ==============================================
 
-def enviar_whatsapp(telefono, mensaje):
-    """Envía mensaje por WhatsApp usando Twilio (o simula en modo debug)."""
+def enviar_whatsapp(telefono, mensaje, clave=None, salon=None, plantilla=None, tratamiento=None,
+                    intento=0):
+    """
+    Envía mensaje por WhatsApp usando Twilio (o simula en modo debug).
+
+    Si se pasa 'clave' (ver RegistroEnvios.clave), antes de enviar se consulta
+    el ledger de envíos: si ya existe un envío confirmado con esa clave no se
+    reenvía y se retorna el SID registrado. Retorna el SID (truthy) o False.
+    El mensaje sale desde el número del salón (por defecto TWILIO_WHATSAPP_NUMBER).
+    'plantilla' y 'tratamiento' se guardan con el SID para las tasas de entrega
+    (ver estados_entrega.py); 'intento' > 0 indica un reenvío.
+    """
+    salon = salon or salon_defecto
+    registro_envios = salon.registro_envios
+    if clave:
+        ok, previo = registro_envios.reservar(clave, telefono)
+        if not ok:
+            if previo.get("e") == ESTADO_ENVIADO:
+                print(f"ℹ️ Ya existe envío para {clave} (sid: {previo.get('sid')}). No se reenvía.")
+                return previo.get("sid") or "SID_DESCONOCIDO"
+            print(f"ℹ️ Envío {clave} en curso por otro proceso. Se omite.")
+            return False
     try:
         # Formatear número 'to' como whatsapp:+...
         to_number = telefono if telefono.startswith("whatsapp:") else f"whatsapp:{telefono}"
+        extra = {"status_callback": STATUS_CALLBACK_URL} if STATUS_CALLBACK_URL else {}
         result = client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
+            from_=salon.numero,
             body=mensaje,
-            to=to_number
+            to=to_number,
+            **extra
         )
-        # Si DummyClient retorna un objeto simulado sin 'sid', igual reportamos éxito
-        sid = getattr(result, "sid", "SID_DESCONOCIDO")
-        print(f"✓ Mensaje enviado a {telefono} (sid: {sid})")
-        return True
     except Exception as e:
         print(f"✗ Error al enviar a {telefono}: {e}")
+        if clave:
+            registro_envios.liberar(clave, e)
         return False
 
-def crear_mensaje_recordatorio(clienta):
-    """Plantilla de recordatorio (personalizable)."""
-    t_key = clienta.get("tipo_tratamiento")
-    tratamiento = TRATAMIENTOS.get(t_key, {"nombre": "tu tratamiento", "precio": "Consultar"})
+    # Si DummyClient retorna un objeto simulado sin 'sid', igual reportamos éxito
+    sid = getattr(result, "sid", None) or "SID_DESCONOCIDO"
+    try:
+        registro_envios.confirmar(clave, sid, telefono)
+    except Exception as e:
+        print(f"⚠️ No se pudo registrar el envío {sid} en el ledger: {e}")
+    # Sin STATUS_CALLBACK_URL no llegará ningún estado; los envíos simulados comparten SID
+    if STATUS_CALLBACK_URL and sid not in ("SID_DESCONOCIDO", "SMDUMMY123"):
+        if plantilla is None and clave:
+            plantilla = clave.rsplit("|", 1)[-1]
+        salon.estados.registrar_envio(sid, telefono, clave, plantilla or "otro", tratamiento, mensaje, intento)
+    print(f"✓ Mensaje enviado a {telefono} (sid: {sid})")
+    return sid
+
+def crear_mensaje_recordatorio(clienta, salon=None, tipo=None):
+    """Plantilla de recordatorio (personalizable). 'tipo' elige el tratamiento (por defecto el de la clienta)."""
+    salon = salon or salon_defecto
+    t_key = tipo or clienta.get("tipo_tratamiento")
+    tratamiento = salon.tratamientos.get(t_key, {"nombre": "tu tratamiento", "precio": "Consultar"})
+    hueco = sugerir_cita(clienta, salon, t_key)
+    espacio = f"\n🗓️ Tenemos espacio el {hueco[0]} a las {hueco[1]}\n" if hueco else ""
     mensaje = f"""
 💆‍♀️ ¡Hola {clienta.get('nombre')}! ✨
 
@@ -198,7 +339,7 @@ Es momento de consentir tu cabello de nuevo 💕
 
 🔸 Servicio: {tratamiento.get('nombre')}
 💰 Inversión estimada: {tratamiento.get('precio')}
-
+{espacio}
 🎁 PROMO: Si agendas esta semana, trato hidratante GRATIS + 10% dto.
 
 📱 Agenda tu cita respondiendo este mensaje o llamando al: 350-231-7566
@@ -211,71 +352,156 @@ Es momento de consentir tu cabello de nuevo 💕
 # LÓGICA DE VERIFICACIÓN (basada en campo manual)
 # ==============================================
 
-def verificar_tratamientos():
+def _recordar_clienta(clienta, salon, hoy, vence_hoy):
+    """
+    Envía los recordatorios que le tocan hoy a una clienta.
+    Sólo modifica la clienta en memoria (el guardado lo hace el lote).
+    Retorna (enviados, modificada). Un envío que ya estaba en el ledger (p. ej. de
+    un lote que no llegó a confirmarse) no cuenta como nuevo, pero sí restaura
+    los campos de la clienta.
+    """
+    registro_envios = salon.registro_envios
+    nombre = clienta.get("nombre", "Desconocida")
+    telefono = clienta.get("telefono")
+    if not telefono:
+        print(f"⚠️ {nombre} no tiene teléfono registrado. Se omite.")
+        return 0, False
+
+    # Si existe campo manual y es hoy -> enviar
+    pr = clienta.get("proximo_recordatorio")
+    if pr:
+        if pr != hoy:
+            # fecha manual pero no es hoy; no hacemos nada
+            return 0, False
+        # Evitar reenvío si ya se envió hoy
+        if clienta.get("ultimo_recordatorio_enviado") == hoy:
+            print(f"ℹ️ Ya se envió recordatorio hoy a {nombre}. Se omite.")
+            return 0, False
+        clave = RegistroEnvios.clave(clienta.get("id"), pr, "recordatorio")
+        previo = registro_envios.obtener(clave)
+        if previo and previo.get("e") == ESTADO_ENVIADO:
+            print(f"ℹ️ El recordatorio de hoy a {nombre} ya había salido (ledger).")
+            enviado = 0
+        elif enviar_whatsapp(telefono, crear_mensaje_recordatorio(clienta, salon), clave=clave, salon=salon,
+                             plantilla="recordatorio", tratamiento=clienta.get("tipo_tratamiento")):
+            enviado = 1
+        else:
+            return 0, False
+        clienta["ultimo_recordatorio_enviado"] = hoy
+        # Limpiar proximo_recordatorio para que la estilista ponga uno nuevo si desea
+        clienta["proximo_recordatorio"] = None
+        return enviado, True
+
+    # Sin fecha manual: fallback automático por cada tratamiento del historial
+    # (última visita de ese tratamiento + su duración == hoy)
+    ultimas = salon.historial.ultima_por_tratamiento(clienta.get("id"))
+    if not ultimas:
+        ordinal = fecha_a_ordinal(clienta.get("ultimo_tratamiento"))
+        if ordinal and clienta.get("tipo_tratamiento"):
+            ultimas = {clienta["tipo_tratamiento"]: ordinal}
+    if not ultimas:
+        # No hay forma de calcular; se omite
+        print(f"ℹ️ No hay 'proximo_recordatorio' ni datos suficientes para {nombre}.")
+        return 0, False
+    enviados = 0
+    modificada = False
+    for tipo, ordinal in ultimas.items():
+        if vence_hoy.get(tipo) != ordinal:
+            continue
+        # Un recordatorio por tratamiento; el ledger evita duplicados del mismo día
+        clave = RegistroEnvios.clave(clienta.get("id"), hoy, f"recordatorio_{tipo}")
+        previo = registro_envios.obtener(clave)
+        if previo and previo.get("e") == ESTADO_ENVIADO:
+            print(f"ℹ️ (fallback) Ya se envió hoy a {nombre} ({tipo}).")
+        elif enviar_whatsapp(telefono, crear_mensaje_recordatorio(clienta, salon, tipo), clave=clave,
+                             salon=salon, plantilla="recordatorio", tratamiento=tipo):
+            enviados += 1
+        else:
+            continue
+        # Dejar proximo_recordatorio en None (estaba vacío)
+        if clienta.get("ultimo_recordatorio_enviado") != hoy:
+            clienta["ultimo_recordatorio_enviado"] = hoy
+            modificada = True
+    return enviados, modificada
+
+def verificar_tratamientos(salon=None, forzar=False):
     """
     Verifica clientas y envía recordatorio si 'proximo_recordatorio' == hoy.
     Si no existe 'proximo_recordatorio', se considera un fallback calculado
-    según 'duracion_meses' (pero solo si no existe campo manual).
+    según 'duracion_meses' de cada tratamiento del historial de la clienta
+    (pero solo si no existe campo manual).
     Evita reenvíos múltiples marcando 'ultimo_recordatorio_enviado'.
-    """
-    print(f"\n{'='*48}")
-    print(f"Verificación de recordatorios - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-    print(f"{'='*48}\n")
 
+    La corrida del día se persiste (ver corridas.py): las clientas se recorren
+    por id en lotes y al cerrar cada lote se guardan clientas + checkpoint.
+    Si el proceso se reinicia, se retoma desde el último lote confirmado.
+    Una corrida terminada después del último horario programado del salón
+    (hora_recordatorio) no se repite salvo con 'forzar' (p. ej. "Ejecutar
+    recordatorios ahora"); una anterior a ese horario se rehace desde el inicio
+    (el ledger evita repetir lo que ya salió).
+    """
+    salon = salon or salon_defecto
+    tratamientos = salon.tratamientos
+    registro_envios = salon.registro_envios
     hoy = hoy_str()
-    enviados = 0
 
-    for clienta in clientas:
-        # Validaciones básicas
-        nombre = clienta.get("nombre", "Desconocida")
-        telefono = clienta.get("telefono")
-        if not telefono:
-            print(f"⚠️ {nombre} no tiene teléfono registrado. Se omite.")
-            continue
+    corrida = CorridaRecordatorios(salon.directorio, hoy).cargar()
+    if corrida.iniciada_antes(ultimo_horario(salon.hora_recordatorio)):
+        # Corrida de antes del horario programado (p. ej. la del arranque): pudo
+        # cambiar algún proximo_recordatorio desde entonces, se recorre todo de nuevo
+        corrida.reiniciar()
+    elif corrida.terminada:
+        if not forzar:
+            print(f"ℹ️ Los recordatorios de hoy para {salon.nombre} ya se procesaron ({corrida.datos['enviados']} envíos).")
+            return
+        corrida.reiniciar()
 
-        # Si existe campo manual y es hoy -> enviar
-        pr = clienta.get("proximo_recordatorio")
-        if pr:
-            if pr == hoy:
-                # Evitar reenvío si ya se envió hoy
-                if clienta.get("ultimo_recordatorio_enviado") == hoy:
-                    print(f"ℹ️ Ya se envió recordatorio hoy a {nombre}. Se omite.")
-                    continue
-                mensaje = crear_mensaje_recordatorio(clienta)
-                if enviar_whatsapp(telefono, mensaje):
-                    clienta["ultimo_recordatorio_enviado"] = hoy
-                    # Limpiar proximo_recordatorio para que la estilista ponga uno nuevo si desea
-                    clienta["proximo_recordatorio"] = None
-                    guardar_clientas()
-                    enviados += 1
-            else:
-                # fecha manual pero no es hoy; no hacemos nada
-                pass
-        else:
-            # Sin fecha manual: fallback automático calculado a partir de 'ultimo_tratamiento' y duracion_meses
-            ultimo = clienta.get("ultimo_tratamiento")
-            tipo = clienta.get("tipo_tratamiento")
-            if ultimo and tipo and tipo in TRATAMIENTOS:
-                dur = TRATAMIENTOS[tipo].get("duracion_meses", 0)
-                if dur > 0:
-                    fecha_estim = sumar_meses_aproximado(ultimo, dur)
-                    # Si la fecha estimada coincide con hoy — tratamos esto como recordatorio (respaldo)
-                    if fecha_estim == hoy:
-                        if clienta.get("ultimo_recordatorio_enviado") == hoy:
-                            print(f"ℹ️ (fallback) Ya se envió hoy a {nombre}.")
-                            continue
-                        mensaje = crear_mensaje_recordatorio(clienta)
-                        if enviar_whatsapp(telefono, mensaje):
-                            clienta["ultimo_recordatorio_enviado"] = hoy
-                            # Dejar proximo_recordatorio en None (estaba vacío)
-                            guardar_clientas()
-                            enviados += 1
-            else:
-                # No hay forma de calcular; se omite
-                print(f"ℹ️ No hay 'proximo_recordatorio' ni datos suficientes para {nombre}.")
-                continue
-
-    print(f"\n✅ Verificación finalizada. Total mensajes enviados: {enviados}")
+    print(f"\n{'='*48}")
+    print(f"Verificación de recordatorios - {salon.nombre} - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    print(f"{'='*48}\n")
+    if corrida.cursor is not None:
+        print(f"🔁 Retomando corrida de hoy desde la clienta ID {corrida.cursor} "
+              f"({corrida.datos['enviados']} envíos ya confirmados).")
+
+    # Precálculo de vencimientos: para cada tratamiento, el ordinal de la
+    # última visita que vence hoy. Así cada clienta se compara sin parsear fechas.
+    hoy_ord = date.today().toordinal()
+    vence_hoy = {
+        tipo: hoy_ord - dias
+        for tipo, dias in tratamientos.duracion_dias.items() if dias > 0
+    }
+
+    try:
+        podados = registro_envios.podar()
+        if podados:
+            print(f"🧹 {podados} registros antiguos eliminados del ledger de envíos.")
+    except Exception as e:
+        print(f"⚠️ Error al podar ledger de envíos: {e}")
+    try:
+        salon.estados.podar()
+    except Exception as e:
+        print(f"⚠️ Error al podar estados de entrega: {e}")
+
+    # Orden estable por id para que el cursor sirva aunque se agreguen clientas
+    pendientes = sorted(
+        (c for c in salon.clientas if corrida.cursor is None or (c.get("id") or 0) > corrida.cursor),
+        key=lambda c: c.get("id") or 0,
+    )
+    for inicio in range(0, len(pendientes), RECORDATORIOS_LOTE):
+        lote = pendientes[inicio:inicio + RECORDATORIOS_LOTE]
+        enviados_lote = 0
+        modificadas = 0
+        for clienta in lote:
+            enviados, modificada = _recordar_clienta(clienta, salon, hoy, vence_hoy)
+            enviados_lote += enviados
+            modificadas += modificada
+        # Commit del lote: primero los datos de las clientas, luego el checkpoint
+        if modificadas:
+            salon.guardar_clientas()
+        corrida.confirmar_lote(lote[-1].get("id") or 0, enviados_lote)
+
+    corrida.terminar()
+    print(f"\n✅ Verificación finalizada. Total mensajes enviados: {corrida.datos['enviados']}")
 
 # --- Añadido: alias para compatibilidad con nombre antiguo usado por auto_estilista.py ---
 def verificar_recordatorios_diarios():
@@ -320,7 +546,7 @@ def agregar_clienta():
 
     # Selección de tratamiento
     print("\nTratamientos disponibles:")
-    keys = list(TRATAMIENTOS.keys())
+    keys = TRATAMIENTOS.claves
     for i, k in enumerate(keys, start=1):
         t = TRATAMIENTOS[k]
         print(f"  {i}. {t['nombre']} ({t['duracion_meses']} meses)")
@@ -361,6 +587,8 @@ def agregar_clienta():
 
     clientas.append(nueva)
     guardar_clientas()
+    salon_defecto.registrar_tratamiento(nueva)
+    auditar(salon_defecto, ORIGEN_CONSOLA, "consola", "crear_clienta", nuevo_id, despues=nueva)
     print(f"\n✅ Clienta '{nombre}' agregada (ID: {nuevo_id}).")
 
 def mostrar_clientas():
@@ -405,7 +633,7 @@ def actualizar_tratamiento():
     print(f"\nActualizando -> {clienta.get('nombre')} (ID {cid})")
     # Permitir cambiar tipo de tratamiento
     print("\nTratamientos:")
-    keys = list(TRATAMIENTOS.keys())
+    keys = TRATAMIENTOS.claves
     for i, k in enumerate(keys, start=1):
         t = TRATAMIENTOS[k]
         print(f"  {i}. {t['nombre']} ({t['duracion_meses']} meses)")
@@ -427,17 +655,25 @@ def actualizar_tratamiento():
     nuevo_ultimo = input_fecha_validada("Nueva fecha de último tratamiento (AAAA-MM-DD) o ENTER para hoy: ", allow_empty=True)
     if not nuevo_ultimo:
         nuevo_ultimo = hoy_str()
+    visita_nueva = False
+    if nuevo_ultimo != clienta.get("ultimo_tratamiento"):
+        # Sólo una visita nueva se agrega al historial; si no, se corrige la fecha anterior
+        resp = input("¿Es una visita nueva? (S = vino otra vez / N = corregir la fecha anterior) [S]: ").strip().upper()
+        visita_nueva = resp != "N"
 
     # Fecha manual del próximo recordatorio
     print("\nEstablece la fecha del próximo recordatorio (manual) o deja vacío para usar cálculo automático:")
     nuevo_pr = input_fecha_validada("Próximo recordatorio (AAAA-MM-DD) o ENTER: ", allow_empty=True)
 
     # Aplicar cambios
+    antes = dict(clienta)
     clienta["tipo_tratamiento"] = nuevo_tipo
     clienta["ultimo_tratamiento"] = nuevo_ultimo
     clienta["proximo_recordatorio"] = nuevo_pr
     # resetear ultimo_recordatorio_enviado si deseas (opcional) -- aquí no lo hacemos para mantener historial
     guardar_clientas()
+    auditar_diferencias(salon_defecto, ORIGEN_CONSOLA, "consola", cid, antes, clienta)
+    salon_defecto.registrar_tratamiento(clienta, antes=None if visita_nueva else antes)
 
     print(f"\n✅ Datos actualizados para {clienta.get('nombre')} (ID {cid}).")
 
@@ -445,11 +681,65 @@ def actualizar_tratamiento():
 # INICIO AUTOMÁTICO (schedule)
 # ==============================================
 
+def reintentar_entregas_fallidas(salon=None):
+    """
+    Reenvía los mensajes que Twilio reportó como failed/undelivered
+    (hasta MAX_REINTENTOS_ENTREGA veces, REINTENTO_ENTREGA_MIN minutos después del fallo).
+    """
+    salon = salon or salon_defecto
+    reenviados = 0
+    for reg in salon.estados.fallidos_para_reintentar():
+        # Cada worker corre esto en su hilo de fondo: sólo reenvía quien lo reclama primero
+        if not salon.estados.reclamar_reintento(reg["sid"]):
+            continue
+        clave = reg.get("k")
+        if clave:
+            # El ledger lo tenía como enviado; se libera para poder reservarlo de nuevo
+            salon.registro_envios.liberar(clave, f"entrega fallida ({reg.get('err')})")
+        print(f"🔁 Reenviando a {reg['tel']} (falló {reg['sid']}, error {reg.get('err')}).")
+        if enviar_whatsapp(reg["tel"], reg["body"], clave=clave, salon=salon, plantilla=reg.get("pl"),
+                           tratamiento=reg.get("tr"), intento=reg.get("n", 0) + 1):
+            reenviados += 1
+    return reenviados
+
+def reintentar_entregas_todos():
+    reintentar_entregas_fallidas()
+    # Sólo los salones en memoria: el status callback de un fallo carga su salón, y así
+    # este trabajo no carga los demás ni impide que se descarguen
+    for salon in salones.cargados():
+        if salon.estados.fallidos_para_reintentar():
+            with salon.en_uso():
+                reintentar_entregas_fallidas(salon)
+
+def verificar_salon(numero):
+    """Carga (si hace falta) el salón del número y verifica sus recordatorios."""
+    with salones.obtener(numero).en_uso() as salon:
+        return verificar_tratamientos(salon)
+
+def programar_salones():
+    """Programa la verificación diaria de cada salón de salones.json a su hora."""
+    for item in salones.configurados():
+        hora = item.get("hora_recordatorio", "10:00")
+        schedule.every().day.at(hora).do(verificar_salon, item["numero"])
+        print(f"✓ {item.get('nombre') or item['numero']}: verificación diaria a las {hora}.")
+    # Liberar la memoria de los salones que dejaron de usarse
+    schedule.every(5).minutes.do(salones.desalojar_inactivos)
+    # Reenvío de mensajes que Twilio no pudo entregar (sin callbacks no se sabe cuáles fallaron)
+    if STATUS_CALLBACK_URL:
+        schedule.every(REINTENTO_ENTREGA_MIN).minutes.do(reintentar_entregas_todos)
+
 def iniciar_sistema():
     """Inicia loop schedule para verificar recordatorios diariamente."""
     print("\n💇‍♀️ Sistema de Recordatorios - Iniciado")
-    schedule.every().day.at("10:00").do(verificar_tratamientos)
-    print("✓ Verificación programada diariamente a las 10:00 AM (hora del servidor).")
+    schedule.every().day.at(salon_defecto.hora_recordatorio).do(verificar_tratamientos)
+    print(f"✓ Verificación programada diariamente a las {salon_defecto.hora_recordatorio} (hora del servidor).")
+    programar_salones()
+    from campanas import hay_campanas_en_curso, reanudar_campanas
+    reanudar_campanas()
+    for item in salones.configurados():
+        # Sólo se cargan los salones que tienen algo que reanudar
+        if hay_campanas_en_curso(salones.directorio(item)):
+            reanudar_campanas(salones.obtener(item["numero"]))
     print("✓ Ejecutando verificación inicial ahora...\n")
     verificar_tratamientos()
     print("\nPresiona Ctrl+C para detener el sistema automático y volver al menú.\n")
@@ -487,7 +777,7 @@ def main_menu():
         if opcion == "1":
             iniciar_sistema()
         elif opcion == "2":
-            verificar_tratamientos()
+            verificar_tratamientos(forzar=True)
         elif opcion == "3":
             mostrar_clientas()
         elif opcion == "4":
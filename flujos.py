@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Motor de máquina de estados para las conversaciones del bot.
+
+- Cada estado tiene un manejador en un diccionario: despachar un mensaje es
+  una búsqueda O(1), sin importar cuántos flujos existan.
+- Los flujos paso a paso (agregar, actualizar) se declaran con Paso:
+  pregunta, validador, campo donde guardar la respuesta y siguiente estado.
+- Se mide la latencia de cada estado (conteo, promedio, p95, máximo) para
+  ver qué paso de la conversación es lento.
+
+Uso:
+    maquina = MaquinaEstados()
+
+    @maquina.estado("menu")
+    def menu(ctx): ...
+
+    maquina.paso("agregar_nombre", Paso(
+        pregunta="¿Cuál es el nombre?",
+        campo="nombre",
+        siguiente="agregar_telefono",
+    ))
+
+    respuesta = maquina.procesar(Contexto(telefono, mensaje, salon, sesion))
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class EntradaInvalida(Exception):
+    """El validador de un Paso la lanza con el texto que se le responde al usuario."""
+
+    def __init__(self, respuesta):
+        super().__init__(respuesta)
+        self.respuesta = respuesta
+
+
+class Contexto:
+    """Lo que recibe cada manejador: quién escribe, qué escribió, su salón y su sesión."""
+
+    def __init__(self, telefono, mensaje, salon, sesion):
+        self.telefono = telefono
+        self.mensaje = mensaje.strip()
+        self.mensaje_upper = self.mensaje.upper()
+        self.salon = salon
+        self.sesion = sesion
+
+    @property
+    def estado(self):
+        return self.sesion["estado"]
+
+    @property
+    def data(self):
+        return self.sesion["data"]
+
+    def ir_a(self, estado, data=None):
+        self.sesion["estado"] = estado
+        if data is not None:
+            self.sesion["data"] = data
+
+
+class Paso:
+    """
+    Un paso declarativo de un flujo.
+
+    pregunta      texto (o función ctx -> texto) que se envía al llegar a este paso
+    validar       función (ctx) -> valor; lanza EntradaInvalida si la respuesta no sirve.
+                  Por defecto el valor es el mensaje tal cual.
+    campo         clave de ctx.data donde se guarda el valor (opcional)
+    siguiente     estado siguiente (o función ctx -> estado)
+    al_completar  función ctx -> respuesta; cierra el flujo en lugar de pasar a 'siguiente'
+    """
+
+    def __init__(self, pregunta, validar=None, campo=None, siguiente=None, al_completar=None):
+        self.pregunta = pregunta
+        self.validar = validar
+        self.campo = campo
+        self.siguiente = siguiente
+        self.al_completar = al_completar
+
+    def texto_pregunta(self, ctx):
+        return self.pregunta(ctx) if callable(self.pregunta) else self.pregunta
+
+
+class MetricasEstados:
+    """Latencia por estado: conteo, total y las últimas N muestras para percentiles."""
+
+    def __init__(self, muestras=1024):
+        self.muestras = muestras
+        self._datos = {}  # estado -> [conteo, total_seg, max_seg, deque]
+        self._lock = threading.Lock()
+
+    def registrar(self, estado, segundos):
+        with self._lock:
+            d = self._datos.get(estado)
+            if d is None:
+                d = self._datos[estado] = [0, 0.0, 0.0, deque(maxlen=self.muestras)]
+            d[0] += 1
+            d[1] += segundos
+            if segundos > d[2]:
+                d[2] = segundos
+            d[3].append(segundos)
+
+    def resumen(self):
+        """{estado: {"n", "prom_ms", "p95_ms", "max_ms"}}"""
+        with self._lock:
+            copia = {e: (d[0], d[1], d[2], sorted(d[3])) for e, d in self._datos.items()}
+        resumen = {}
+        for estado, (n, total, maximo, recientes) in copia.items():
+            p95 = recientes[min(len(recientes) - 1, int(len(recientes) * 0.95))] if recientes else 0.0
+            resumen[estado] = {
+                "n": n,
+                "prom_ms": total / n * 1000,
+                "p95_ms": p95 * 1000,
+                "max_ms": maximo * 1000,
+            }
+        return resumen
+
+    def texto(self):
+        lineas = [f"{'estado':<22}{'n':>8}{'prom ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for estado, m in sorted(self.resumen().items(), key=lambda x: -x[1]["n"]):
+            lineas.append(f"{estado:<22}{m['n']:>8}{m['prom_ms']:>10.3f}{m['p95_ms']:>10.3f}{m['max_ms']:>10.3f}")
+        return "\n".join(lineas)
+
+    def reiniciar(self):
+        with self._lock:
+            self._datos = {}
+
+
+class MaquinaEstados:
+    """Despacho por tabla {estado: manejador} con medición de latencia por estado."""
+
+    def __init__(self, estado_inicial):
+        self.estado_inicial = estado_inicial
+        self.manejadores = {}
+        self.pasos = {}
+        self.metricas = MetricasEstados()
+
+    def estado(self, nombre):
+        """Decorador: registra una función ctx -> respuesta para el estado 'nombre'."""
+        def registrar(funcion):
+            self.manejadores[nombre] = funcion
+            return funcion
+        return registrar
+
+    def paso(self, nombre, paso):
+        """Registra un Paso declarativo para el estado 'nombre'."""
+        self.pasos[nombre] = paso
+        self.manejadores[nombre] = lambda ctx: self._ejecutar_paso(paso, ctx)
+        return paso
+
+    def entrar(self, ctx, estado, data=None):
+        """Lleva la sesión a 'estado' (con data nueva) y retorna la pregunta de ese paso."""
+        ctx.ir_a(estado, {} if data is None else data)
+        return self.pasos[estado].texto_pregunta(ctx)
+
+    def _ejecutar_paso(self, paso, ctx):
+        try:
+            valor = paso.validar(ctx) if paso.validar else ctx.mensaje
+        except EntradaInvalida as e:
+            return e.respuesta
+        if paso.campo:
+            ctx.data[paso.campo] = valor
+        if paso.al_completar:
+            return paso.al_completar(ctx)
+        siguiente = paso.siguiente(ctx) if callable(paso.siguiente) else paso.siguiente
+        ctx.ir_a(siguiente)
+        return self.pasos[siguiente].texto_pregunta(ctx)
+
+    def procesar(self, ctx):
+        estado = ctx.estado
+        manejador = self.manejadores.get(estado)
+        if manejador is None:
+            # Estado desconocido (p. ej. sesión de una versión anterior): volver al inicio
+            ctx.ir_a(self.estado_inicial, {})
+            estado = self.estado_inicial
+            manejador = self.manejadores[estado]
+        t0 = time.perf_counter()
+        try:
+            return manejador(ctx)
+        finally:
+            self.metricas.registrar(estado, time.perf_counter() - t0)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Historial de tratamientos por clienta (serie de tiempo compacta, append-only).
+
+Cada visita es un registro binario de 10 bytes en historial.bin:
+    clienta_id (uint32) | fecha como ordinal (uint32) | id de tratamiento (uint16)
+Los ids de tratamiento se guardan en historial.bin.ids (lista JSON: id = posición).
+Si el id trae el bit CORRECCION, el registro reemplaza las visitas de esa clienta
+en esa fecha (corregir el tipo sin inventar una visita nueva). CORRECCION | BORRADO
+sólo las quita: así se mueve una visita cargada con la fecha equivocada.
+
+En memoria se mantiene, por clienta, un array('Q') con (ordinal << 16 | id),
+así las consultas recorren enteros y no diccionarios:
+  - ultimas_visitas(cid, n)           -> últimas N visitas de una clienta
+  - ultima_por_tratamiento(cid)       -> {tratamiento: fecha} para recordatorios
+  - clientas_atrasadas(duraciones, 2) -> quienes pasaron más de 2 ciclos sin volver
+"""
+
+import json
+import os
+import struct
+import threading
+from array import array
+from datetime import date
+
+from bloqueos import bloqueo_archivo
+
+REGISTRO = struct.Struct("<IIH")
+CORRECCION = 0x8000  # bit alto del id de tratamiento: el registro corrige esa fecha
+BORRADO = 0x7FFF  # id reservado: con CORRECCION, la fecha queda sin visitas
+
+
+def fecha_a_ordinal(fecha):
+    """'2024-08-15' (o '2024-8-15') -> ordinal; None si es inválida."""
+    try:
+        anio, mes, dia = (int(p) for p in str(fecha).split("-"))
+        return date(anio, mes, dia).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def ordinal_a_fecha(ordinal):
+    return date.fromordinal(ordinal).strftime("%Y-%m-%d")
+
+
+class HistorialTratamientos:
+    """Historial append-only en disco con índice compacto por clienta."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.ruta_ids = ruta + ".ids"
+        self._por_clienta = {}  # cid -> array('Q') ordenado por fecha
+        self._ids = []  # id -> clave de tratamiento
+        self._id_de = {}  # clave -> id
+        self._offset = 0
+        self._lock = threading.RLock()
+
+    # ---------- Carga incremental ----------
+
+    def _cargar_ids(self):
+        if os.path.exists(self.ruta_ids):
+            try:
+                with open(self.ruta_ids, "r", encoding="utf-8") as f:
+                    self._ids = json.load(f)
+            except Exception as e:
+                print(f"⚠️ Error al cargar ids del historial: {e}")
+        self._id_de = {k: i for i, k in enumerate(self._ids)}
+
+    def _refrescar(self):
+        """Lee sólo los registros nuevos desde el último offset (otros procesos pueden anexar)."""
+        try:
+            tam = os.path.getsize(self.ruta)
+        except OSError:
+            return
+        tam -= tam % REGISTRO.size  # ignorar un registro a medio escribir
+        if tam <= self._offset:
+            return
+        with open(self.ruta, "rb") as f:
+            f.seek(self._offset)
+            bloque = f.read(tam - self._offset)
+        self._offset = tam
+        hay_id_nuevo = False
+        for cid, ordinal, tid in REGISTRO.iter_unpack(bloque):
+            if tid & CORRECCION:
+                tid &= ~CORRECCION
+                self._quitar_fecha(cid, ordinal)
+                if tid == BORRADO:
+                    continue
+            if tid >= len(self._ids):
+                hay_id_nuevo = True
+            self._insertar(cid, (ordinal << 16) | tid)
+        if hay_id_nuevo:
+            self._cargar_ids()
+
+    def _insertar(self, cid, valor):
+        serie = self._por_clienta.get(cid)
+        if serie is None:
+            self._por_clienta[cid] = array("Q", [valor])
+            return
+        if not serie or serie[-1] <= valor:
+            serie.append(valor)  # caso normal: llegan en orden
+            return
+        # Visita con fecha anterior (carga retroactiva): insertar en su lugar
+        i = len(serie)
+        while i > 0 and serie[i - 1] > valor:
+            i -= 1
+        serie.insert(i, valor)
+
+    def _quitar_fecha(self, cid, ordinal):
+        serie = self._por_clienta.get(cid)
+        if serie:
+            self._por_clienta[cid] = array("Q", (v for v in serie if v >> 16 != ordinal))
+
+    def cargar(self):
+        with self._lock:
+            self._por_clienta = {}
+            self._offset = 0
+            self._cargar_ids()
+            self._refrescar()
+        return self
+
+    # ---------- Escritura ----------
+
+    def _id_tratamiento(self, tipo):
+        """Id compacto del tratamiento (lo agrega a historial.bin.ids si es nuevo)."""
+        tid = self._id_de.get(tipo)
+        if tid is not None:
+            return tid
+        self._cargar_ids()  # otro proceso pudo haberlo agregado
+        tid = self._id_de.get(tipo)
+        if tid is None:
+            self._ids.append(tipo)
+            tid = len(self._ids) - 1
+            self._id_de[tipo] = tid
+            tmp = self.ruta_ids + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._ids, f, ensure_ascii=False)
+            os.replace(tmp, self.ruta_ids)
+        return tid
+
+    def _anexar(self, cid, fecha, tipo, correccion):
+        ordinal = fecha_a_ordinal(fecha)
+        if cid is None or ordinal is None or not tipo:
+            return False
+        with self._lock, bloqueo_archivo(self.ruta):
+            self._refrescar()
+            tid = self._id_tratamiento(tipo)
+            valor = (ordinal << 16) | tid
+            serie = self._por_clienta.get(cid, ())
+            if correccion:
+                if [v for v in serie if v >> 16 == ordinal] == [valor]:
+                    return False
+            elif valor in serie:
+                return False
+            with open(self.ruta, "ab") as f:
+                f.write(REGISTRO.pack(cid, ordinal, tid | (CORRECCION if correccion else 0)))
+            self._offset += REGISTRO.size
+            if correccion:
+                self._quitar_fecha(cid, ordinal)
+            self._insertar(cid, valor)
+            return True
+
+    def registrar(self, cid, fecha, tipo):
+        """
+        Agrega una visita (cid, fecha, tratamiento). No duplica una visita
+        idéntica ya registrada. Retorna True si se agregó.
+        """
+        return self._anexar(cid, fecha, tipo, correccion=False)
+
+    def corregir(self, cid, fecha, tipo):
+        """
+        Reemplaza la(s) visita(s) de la clienta en esa fecha por una de 'tipo'
+        (p. ej. se cargó mal el tratamiento). Retorna True si cambió algo.
+        """
+        return self._anexar(cid, fecha, tipo, correccion=True)
+
+    def mover(self, cid, fecha_antes, fecha, tipo):
+        """
+        Corrige la fecha de una visita: quita la(s) de 'fecha_antes' y deja una de
+        'tipo' en 'fecha' (no agrega una visita más). Retorna True si cambió algo.
+        """
+        viejo = fecha_a_ordinal(fecha_antes)
+        nuevo = fecha_a_ordinal(fecha)
+        if cid is None or viejo is None or nuevo is None or not tipo:
+            return False
+        if viejo == nuevo:
+            return self.corregir(cid, fecha, tipo)
+        with self._lock, bloqueo_archivo(self.ruta):
+            self._refrescar()
+            tid = self._id_tratamiento(tipo)
+            valor = (nuevo << 16) | tid
+            serie = self._por_clienta.get(cid, ())
+            registros = REGISTRO.pack(cid, viejo, CORRECCION | BORRADO)
+            if valor not in serie:
+                registros += REGISTRO.pack(cid, nuevo, tid)
+            # Los dos registros en un solo write: otro proceso no ve la visita borrada sin la nueva
+            with open(self.ruta, "ab") as f:
+                f.write(registros)
+            self._offset += len(registros)
+            self._quitar_fecha(cid, viejo)
+            if valor not in serie:
+                self._insertar(cid, valor)
+            return True
+
+    def sembrar_desde_clientas(self, clientas):
+        """Migra 'ultimo_tratamiento' / 'tipo_tratamiento' de clientas sin historial."""
+        with self._lock:
+            self._refrescar()
+            sembradas = 0
+            for c in clientas:
+                if c.get("id") not in self._por_clienta:
+                    if self.registrar(c.get("id"), c.get("ultimo_tratamiento"), c.get("tipo_tratamiento")):
+                        sembradas += 1
+            if sembradas:
+                print(f"🗂️ Historial inicial creado para {sembradas} clientas.")
+            return sembradas
+
+    # ---------- Consultas ----------
+
+    def ultimas_visitas(self, cid, n=5):
+        """Últimas N visitas de la clienta, de la más reciente a la más antigua: [(fecha, tipo)]."""
+        with self._lock:
+            self._refrescar()
+            serie = self._por_clienta.get(cid, ())
+            return [(ordinal_a_fecha(v >> 16), self._ids[v & 0xFFFF]) for v in reversed(serie[-n:])]
+
+    @property
+    def version(self):
+        """Cambia cada vez que se agregan registros (bytes leídos del archivo)."""
+        with self._lock:
+            self._refrescar()
+            return self._offset
+
+    def ultimas_visitas_todas(self):
+        """{cid: ordinal de la última visita (de cualquier tratamiento)} de todo el libro."""
+        with self._lock:
+            self._refrescar()
+            return {cid: serie[-1] >> 16 for cid, serie in self._por_clienta.items() if serie}
+
+    def tratamientos_por_clienta(self):
+        """{tratamiento: set(cid)} de quienes se han hecho ese tratamiento alguna vez."""
+        with self._lock:
+            self._refrescar()
+            por_tipo = {}
+            for cid, serie in self._por_clienta.items():
+                for v in serie:
+                    por_tipo.setdefault(self._ids[v & 0xFFFF], set()).add(cid)
+            return por_tipo
+
+    def ultima_por_tratamiento(self, cid):
+        """{tratamiento: ordinal de la última visita} de una clienta."""
+        with self._lock:
+            self._refrescar()
+            ultimas = {}
+            for v in self._por_clienta.get(cid, ()):
+                ultimas[self._ids[v & 0xFFFF]] = v >> 16
+            return ultimas
+
+    def clientas_atrasadas(self, duracion_dias, ciclos=2, hoy=None):
+        """
+        Recorre todo el libro y genera (cid, tratamiento, fecha_ultima, dias_sin_volver)
+        para cada tratamiento cuya última visita tiene más de 'ciclos' duraciones.
+        'duracion_dias' es {tratamiento: días} (p. ej. TRATAMIENTOS.duracion_dias).
+        """
+        hoy_ord = (hoy or date.today()).toordinal()
+        with self._lock:
+            self._refrescar()
+            limites = [None] * len(self._ids)
+            for tid, tipo in enumerate(self._ids):
+                dias = duracion_dias.get(tipo, 0)
+                if dias > 0:
+                    limites[tid] = hoy_ord - ciclos * dias
+            series = list(self._por_clienta.items())
+        for cid, serie in series:
+            vistos = set()
+            for v in reversed(serie):  # de la más reciente hacia atrás
+                tid = v & 0xFFFF
+                if tid in vistos:
+                    continue
+                vistos.add(tid)
+                limite = limites[tid] if tid < len(limites) else None
+                ordinal = v >> 16
+                if limite is not None and ordinal < limite:
+                    yield cid, self._ids[tid], ordinal_a_fecha(ordinal), hoy_ord - ordinal
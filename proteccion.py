@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Protección del endpoint /whatsapp contra tráfico abusivo.
+
+- Validación de la firma X-Twilio-Signature (sólo Twilio puede llamar al webhook).
+- Limitador por remitente (token bucket) guardado en un LRU acotado, para que
+  miles de 'From' falsos no hagan crecer la memoria sin límite.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from twilio.request_validator import RequestValidator
+
+TASA_MENSAJES_POR_MINUTO = float(os.getenv("TASA_MENSAJES_POR_MINUTO", "20"))
+RAFAGA_MENSAJES = int(os.getenv("RAFAGA_MENSAJES", "10"))
+MAX_REMITENTES = int(os.getenv("MAX_REMITENTES", "10000"))
+# URL pública del webhook tal como está configurada en Twilio (recomendado detrás de proxy)
+WEBHOOK_URL_PUBLICA = os.getenv("WEBHOOK_URL_PUBLICA")
+
+
+class LimitadorTasa:
+    """Token bucket por clave con LRU acotado (O(1) por consulta)."""
+
+    def __init__(self, tasa_por_minuto=TASA_MENSAJES_POR_MINUTO, rafaga=RAFAGA_MENSAJES,
+                 max_claves=MAX_REMITENTES):
+        self.tasa_seg = tasa_por_minuto / 60.0
+        self.rafaga = rafaga
+        self.max_claves = max_claves
+        self._cubetas = OrderedDict()  # clave -> [tokens, ultimo_ts]
+        self._lock = threading.Lock()
+
+    def permitir(self, clave):
+        """Consume un token de 'clave'. Retorna False si no le quedan."""
+        ahora = time.monotonic()
+        with self._lock:
+            cubeta = self._cubetas.get(clave)
+            if cubeta is None:
+                cubeta = [float(self.rafaga), ahora]
+                self._cubetas[clave] = cubeta
+                if len(self._cubetas) > self.max_claves:
+                    self._cubetas.popitem(last=False)
+            else:
+                self._cubetas.move_to_end(clave)
+                cubeta[0] = min(self.rafaga, cubeta[0] + (ahora - cubeta[1]) * self.tasa_seg)
+                cubeta[1] = ahora
+            if cubeta[0] < 1:
+                return False
+            cubeta[0] -= 1
+            return True
+
+    def __len__(self):
+        return len(self._cubetas)
+
+
+def url_publica(request):
+    """Reconstruye la URL que Twilio firmó (respetando X-Forwarded-Proto/Host)."""
+    if WEBHOOK_URL_PUBLICA:
+        return WEBHOOK_URL_PUBLICA
+    proto = request.headers.get("X-Forwarded-Proto", request.scheme).split(",")[0].strip()
+    host = request.headers.get("X-Forwarded-Host", request.host).split(",")[0].strip()
+    url = f"{proto}://{host}{request.path}"
+    if request.query_string:
+        url += "?" + request.query_string.decode("utf-8")
+    return url
+
+
+def firma_valida(request, auth_token, url=None):
+    """
+    True si X-Twilio-Signature corresponde al cuerpo y la URL de la petición.
+    'url' es la URL exacta que Twilio firmó, si se conoce (p. ej. STATUS_CALLBACK_URL).
+    """
+    firma = request.headers.get("X-Twilio-Signature", "")
+    if not firma:
+        return False
+    return RequestValidator(auth_token).validate(url or url_publica(request), request.form, firma)
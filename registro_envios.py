@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registro de envíos (ledger de idempotencia) para mensajes salientes.
+
+Cada envío queda como una línea JSON en un archivo append-only
+(por defecto envios.jsonl). En memoria se mantiene un índice
+{clave: registro} para consultar en O(1) si un mensaje ya salió.
+
+La clave se arma con (id de clienta, fecha objetivo, plantilla), de modo
+que si el proceso muere entre la llamada a Twilio y guardar_clientas(),
+o si dos schedulers corren a la vez, el segundo intento se detecta y no
+se reenvía. También se guarda el SID de Twilio de cada mensaje para auditoría.
+"""
+
+import json
+import os
+import threading
+import time
+
+from bloqueos import bloqueo_archivo
+
+# Estados de un registro
+ESTADO_RESERVADO = "reservado"
+ESTADO_ENVIADO = "enviado"
+ESTADO_FALLIDO = "fallido"
+
+
+class RegistroEnvios:
+    """Ledger en disco con índice en memoria y bloqueo entre hilos y procesos."""
+
+    def __init__(self, ruta, retencion_dias=90, ttl_reserva_seg=600):
+        self.ruta = ruta
+        self.retencion_seg = retencion_dias * 86400
+        self.ttl_reserva_seg = ttl_reserva_seg
+        self._indice = {}
+        self._offset = 0
+        self._inodo = None
+        self._lock = threading.RLock()
+
+    # ---------- Claves ----------
+
+    @staticmethod
+    def clave(cid, fecha, plantilla):
+        """Construye la clave de idempotencia 'id|fecha|plantilla'."""
+        return f"{cid}|{fecha}|{plantilla}"
+
+    # ---------- Lectura incremental ----------
+
+    def _refrescar(self):
+        """Lee sólo las líneas nuevas desde el último offset (o todo si el archivo fue reescrito)."""
+        try:
+            st = os.stat(self.ruta)
+        except FileNotFoundError:
+            self._indice = {}
+            self._offset = 0
+            self._inodo = None
+            return
+
+        if st.st_ino != self._inodo or st.st_size < self._offset:
+            self._indice = {}
+            self._offset = 0
+            self._inodo = st.st_ino
+
+        if st.st_size == self._offset:
+            return
+
+        with open(self.ruta, "rb") as f:
+            f.seek(self._offset)
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    # Línea incompleta (otro proceso escribiendo): se relee la próxima vez
+                    break
+                self._offset += len(linea)
+                try:
+                    reg = json.loads(linea.decode("utf-8"))
+                except ValueError:
+                    continue
+                k = reg.get("k")
+                if k:
+                    self._indice[k] = reg
+
+    def _anexar(self, reg):
+        with open(self.ruta, "a", encoding="utf-8", newline="\n") as f:
+            f.write(json.dumps(reg, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _con_bloqueo(self, fn):
+        with self._lock, bloqueo_archivo(self.ruta):
+            self._refrescar()
+            return fn()
+
+    # ---------- API pública ----------
+
+    def obtener(self, clave):
+        """Devuelve el último registro de una clave o None."""
+        return self._con_bloqueo(lambda: self._indice.get(clave))
+
+    def reservar(self, clave, telefono=None):
+        """
+        Intenta reservar una clave antes de enviar.
+        Retorna (True, None) si se puede enviar, o (False, registro) si ya se
+        envió o hay otra reserva vigente.
+        """
+        def _reservar():
+            reg = self._indice.get(clave)
+            ahora = int(time.time())
+            if reg:
+                if reg.get("e") == ESTADO_ENVIADO:
+                    return False, reg
+                if reg.get("e") == ESTADO_RESERVADO and ahora - reg.get("ts", 0) < self.ttl_reserva_seg:
+                    return False, reg
+            nuevo = {"k": clave, "e": ESTADO_RESERVADO, "tel": telefono, "ts": ahora}
+            self._anexar(nuevo)
+            self._indice[clave] = nuevo
+            return True, None
+        return self._con_bloqueo(_reservar)
+
+    def confirmar(self, clave, sid, telefono=None):
+        """Marca la clave como enviada guardando el SID de Twilio."""
+        def _confirmar():
+            reg = {"k": clave, "e": ESTADO_ENVIADO, "sid": sid, "tel": telefono, "ts": int(time.time())}
+            self._anexar(reg)
+            if clave:
+                self._indice[clave] = reg
+        self._con_bloqueo(_confirmar)
+
+    def liberar(self, clave, error=None):
+        """Marca la reserva como fallida para permitir un reintento."""
+        def _liberar():
+            reg = {"k": clave, "e": ESTADO_FALLIDO, "err": str(error)[:200] if error else None, "ts": int(time.time())}
+            self._anexar(reg)
+            self._indice[clave] = reg
+        self._con_bloqueo(_liberar)
+
+    def podar(self):
+        """Reescribe el archivo conservando sólo el último registro de cada clave dentro de la retención."""
+        def _podar():
+            if not os.path.exists(self.ruta):
+                return 0
+            limite = int(time.time()) - self.retencion_seg
+            vivos = [r for r in self._indice.values() if r.get("ts", 0) >= limite]
+            # Los envíos sin clave sólo existen en el archivo; se conservan los recientes
+            sin_clave = []
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        r = json.loads(linea)
+                    except ValueError:
+                        continue
+                    if not r.get("k") and r.get("ts", 0) >= limite:
+                        sin_clave.append(r)
+            registros = sorted(vivos + sin_clave, key=lambda r: r.get("ts", 0))
+            tmp = self.ruta + ".tmp"
+            with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+                for r in registros:
+                    f.write(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n")
+            os.replace(tmp, self.ruta)
+            eliminados = len(self._indice) - len(vivos)
+            self._inodo = None  # fuerza recarga completa
+            self._refrescar()
+            return eliminados
+        return self._con_bloqueo(_podar)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reproduce conversaciones grabadas contra la máquina de estados del bot.
+
+Cada línea del archivo JSONL es un mensaje:
+    {"telefono": "+573001112233", "mensaje": "1", "espera": "AGREGAR CLIENTA"}
+- "espera": texto que debe aparecer en la respuesta (prueba de regresión).
+- "respuesta": respuesta grabada (GRABAR_CONVERSACIONES=...); se compara su
+  primera línea, que no depende de fechas ni IDs.
+- "to": número del salón (opcional, por defecto el salón principal).
+- "operadora": false para escribir como un número que no es operadora
+  (por defecto cada remitente se registra como operadora de su salón).
+
+Uso:
+    # Verificar que las respuestas siguen siendo las esperadas
+    python reproducir.py conversaciones_ejemplo.jsonl
+
+    # Benchmark: repetir 200 veces (cada repetición con teléfonos distintos)
+    python reproducir.py conversaciones_ejemplo.jsonl --repeticiones 200
+
+Trabaja en un directorio temporal y sin Twilio (modo debug), así no toca
+clientas.json ni envía mensajes reales.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def cargar_conversaciones(ruta):
+    mensajes = []
+    with open(ruta, "r", encoding="utf-8") as f:
+        for n, linea in enumerate(f, 1):
+            linea = linea.strip()
+            if not linea or linea.startswith("#"):
+                continue
+            try:
+                mensajes.append(json.loads(linea))
+            except ValueError as e:
+                print(f"⚠️ Línea {n} inválida en {ruta}: {e}")
+    return mensajes
+
+
+def _coincide(esperado, respuesta):
+    if "espera" in esperado:
+        return esperado["espera"] in respuesta
+    if "respuesta" in esperado:
+        return respuesta.split("\n", 1)[0] == esperado["respuesta"].split("\n", 1)[0]
+    return True
+
+
+def reproducir(mensajes, repeticiones=1):
+    """Pasa los mensajes por procesar_mensaje. Retorna (latencias, diferencias, métricas, duración)."""
+    os.environ.pop("TWILIO_ACCOUNT_SID", None)
+    os.environ.pop("TWILIO_AUTH_TOKEN", None)
+    os.environ.pop("GRABAR_CONVERSACIONES", None)
+    # Directorio temporal para no tocar los datos reales
+    os.chdir(tempfile.mkdtemp(prefix="replay_estilista_"))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import conversational
+    from estilista import salon_defecto, salones
+    from salones import normalizar_telefono
+
+    latencias = []
+    diferencias = []
+    # Silenciar los print de guardado/envío
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    t0 = time.perf_counter()
+    try:
+        for rep in range(repeticiones):
+            for i, m in enumerate(mensajes):
+                # Cada repetición es otra "persona" para no mezclar sesiones
+                telefono = m["telefono"] if rep == 0 else f"{m['telefono']}#{rep}"
+                salon = salones.obtener(m["to"]) if m.get("to") else None
+                if m.get("operadora", True):
+                    (salon or salon_defecto).operadoras.add(normalizar_telefono(telefono))
+                t = time.perf_counter()
+                respuesta = conversational.procesar_mensaje(telefono, m["mensaje"], salon)
+                latencias.append(time.perf_counter() - t)
+                if not _coincide(m, respuesta):
+                    diferencias.append((rep, i, m, respuesta))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return latencias, diferencias, conversational.maquina.metricas, time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce conversaciones grabadas contra el bot")
+    parser.add_argument("archivo", help="JSONL con los mensajes")
+    parser.add_argument("--repeticiones", type=int, default=1)
+    args = parser.parse_args()
+
+    mensajes = cargar_conversaciones(args.archivo)
+    latencias, diferencias, metricas, duracion = reproducir(mensajes, args.repeticiones)
+
+    for rep, i, m, respuesta in diferencias[:10]:
+        print(f"❌ Mensaje {i + 1} (repetición {rep + 1}) '{m['mensaje']}' de {m['telefono']}:")
+        print(f"   esperado: {m.get('espera') or m.get('respuesta', '').split(chr(10), 1)[0]}")
+        print(f"   recibido: {respuesta.split(chr(10), 1)[0]}")
+
+    latencias.sort()
+    def pct(p):
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000 if latencias else 0.0
+
+    total = len(latencias)
+    print(f"📊 {total} mensajes en {duracion:.2f}s -> {total / duracion:.1f} msg/s")
+    print(f"   Latencia p50={pct(0.50):.2f}ms  p95={pct(0.95):.2f}ms  p99={pct(0.99):.2f}ms")
+    print(f"   Diferencias: {len(diferencias)}")
+    print("\n⏱️ Latencia por estado:")
+    print(metricas.texto())
+    sys.exit(1 if diferencias else 0)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Respuestas de clientas a los recordatorios.
+
+Cuando una clienta conocida contesta el "¿Te va bien este día para agendar?",
+el webhook sólo encola la intención (O(1)) y responde de inmediato.
+Un hilo en segundo plano:
+  - guarda cada intención en el intenciones.jsonl de su salón,
+  - acumula las respuestas y envía a las operadoras de cada salón un resumen
+    agrupado cada RESUMEN_INTERVALO_SEG (o al llegar a RESUMEN_MAX respuestas).
+    Si el salón aún no tiene operadoras, el resumen queda pendiente (hasta
+    RESUMEN_RETENER respuestas) y se envía cuando se configure alguna.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import date, datetime
+
+from estilista import enviar_whatsapp, salon_defecto
+from registro_envios import RegistroEnvios
+
+RESUMEN_INTERVALO_SEG = int(os.getenv("RESUMEN_INTERVALO_SEG", "900"))
+RESUMEN_MAX = int(os.getenv("RESUMEN_MAX", "20"))
+# Largo máximo del cuerpo de un mensaje de WhatsApp en Twilio (error 21617 si se pasa)
+LIMITE_MENSAJE = 1600
+# Respuestas que se guardan para el resumen mientras el salón no tenga operadora
+RESUMEN_RETENER = int(os.getenv("RESUMEN_RETENER", "500"))
+
+# Tipos de intención
+INTENCION_SI = "si"
+INTENCION_NO = "no"
+INTENCION_FECHA = "fecha"
+INTENCION_OTRO = "otro"
+
+PALABRAS_SI = {"SI", "SÍ", "S", "YES", "OK", "DALE", "CLARO", "CONFIRMO", "LISTO"}
+PALABRAS_NO = {"NO", "N", "NOP", "NEL", "CANCELAR"}
+
+_RE_ISO = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_RE_DMY = re.compile(r"\b(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2,4}))?\b")
+
+_cola = queue.Queue()
+_hilo = None
+_hilo_lock = threading.Lock()
+
+# ==============================================
+# INTERPRETACIÓN
+# ==============================================
+
+def _fecha_valida(anio, mes, dia):
+    try:
+        return date(anio, mes, dia).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def interpretar_respuesta(texto):
+    """
+    Clasifica el texto de la clienta.
+    Retorna (tipo, fecha) donde fecha es 'AAAA-MM-DD' sólo para INTENCION_FECHA.
+    """
+    limpio = (texto or "").strip()
+    m = _RE_ISO.search(limpio)
+    if m:
+        fecha = _fecha_valida(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        if fecha:
+            return INTENCION_FECHA, fecha
+    m = _RE_DMY.search(limpio)
+    if m:
+        anio = m.group(3)
+        if anio is None:
+            # Sin año: la próxima vez que ocurra ese día/mes
+            anio = date.today().year
+            fecha = _fecha_valida(anio, int(m.group(2)), int(m.group(1)))
+            if fecha and fecha < date.today().strftime("%Y-%m-%d"):
+                fecha = _fecha_valida(anio + 1, int(m.group(2)), int(m.group(1)))
+        else:
+            anio = int(anio) + (2000 if len(anio) == 2 else 0)
+            fecha = _fecha_valida(anio, int(m.group(2)), int(m.group(1)))
+        if fecha:
+            return INTENCION_FECHA, fecha
+
+    palabra = re.sub(r"[^\wÁÉÍÓÚÑ]", " ", limpio.upper()).split()
+    primera = palabra[0] if palabra else ""
+    if primera in PALABRAS_SI:
+        return INTENCION_SI, None
+    if primera in PALABRAS_NO:
+        return INTENCION_NO, None
+    return INTENCION_OTRO, None
+
+# ==============================================
+# ENCOLADO (camino del webhook)
+# ==============================================
+
+def encolar_respuesta(clienta, telefono, texto, salon=None):
+    """Registra la intención en la cola y devuelve el texto para contestarle a la clienta."""
+    salon = salon or salon_defecto
+    tipo, fecha = interpretar_respuesta(texto)
+    _cola.put((salon, {
+        "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "clienta_id": clienta.get("id"),
+        "nombre": clienta.get("nombre"),
+        "telefono": telefono,
+        "tipo": tipo,
+        "fecha": fecha,
+        "texto": texto[:300],
+    }))
+    iniciar_procesador()
+
+    nombre = (clienta.get("nombre") or "").split(" ")[0]
+    if tipo == INTENCION_SI:
+        return f"¡Genial, {nombre}! 💕 Ya le avisamos a tu estilista para confirmar tu cita."
+    if tipo == INTENCION_NO:
+        return f"Entendido, {nombre} 😊 Cuando quieras agendar, escríbenos por aquí."
+    if tipo == INTENCION_FECHA:
+        return f"¡Perfecto, {nombre}! 📅 Anotamos que prefieres el {fecha}. Tu estilista te confirmará la hora."
+    return f"¡Gracias, {nombre}! ✨ Tu estilista leerá tu mensaje y te responderá pronto."
+
+# ==============================================
+# PROCESAMIENTO EN SEGUNDO PLANO
+# ==============================================
+
+def _guardar_intenciones(salon, lote):
+    with open(salon.ruta_intenciones, "a", encoding="utf-8") as f:
+        for intencion in lote:
+            f.write(json.dumps(intencion, ensure_ascii=False) + "\n")
+
+def crear_resumen(pendientes, limite=LIMITE_MENSAJE):
+    """
+    Arma el resumen para las operadoras, partido en mensajes de hasta 'limite'
+    caracteres (cada parte con su encabezado). Retorna la lista de partes.
+    """
+    iconos = {INTENCION_SI: "✅", INTENCION_NO: "❌", INTENCION_FECHA: "📅", INTENCION_OTRO: "💬"}
+    lineas = []
+    for i in pendientes:
+        detalle = {
+            INTENCION_SI: "SÍ quiere agendar",
+            INTENCION_NO: "NO por ahora",
+            INTENCION_FECHA: f"propone {i['fecha']}",
+        }.get(i["tipo"], f"\"{i['texto'][:80]}\"")
+        lineas.append(f"{iconos.get(i['tipo'], '•')} {i['nombre']} (ID {i['clienta_id']}): {detalle}")
+
+    encabezado = f"📬 *RESPUESTAS DE CLIENTAS* ({len(pendientes)})"
+    espacio = limite - len(encabezado) - 20  # reserva para " (parte 10/12)" y saltos de línea
+    bloques, actual = [], []
+    for linea in lineas:
+        linea = linea[:espacio]
+        if actual and len("\n".join(actual + [linea])) > espacio:
+            bloques.append(actual)
+            actual = []
+        actual.append(linea)
+    if actual:
+        bloques.append(actual)
+    if len(bloques) <= 1:
+        return [f"{encabezado}\n\n" + "\n".join(actual)]
+    return [f"{encabezado} (parte {n}/{len(bloques)})\n\n" + "\n".join(b) for n, b in enumerate(bloques, 1)]
+
+def _enviar_resumen(salon, pendientes):
+    """
+    Envía el resumen a las operadoras del salón. True sólo si todas las partes
+    fueron aceptadas; si no (o no hay operadoras) las respuestas siguen pendientes.
+    Cada parte lleva clave en el ledger: al reintentar no se repiten las que ya salieron.
+    """
+    if not salon.operadoras:
+        return False
+    hoy = date.today().strftime("%Y-%m-%d")
+    completo = True
+    for parte in crear_resumen(pendientes):
+        huella = hashlib.sha1(parte.encode("utf-8")).hexdigest()[:12]
+        for operadora in salon.operadoras:
+            clave = RegistroEnvios.clave(operadora, hoy, f"resumen_respuestas_{huella}")
+            if not enviar_whatsapp(operadora, parte, clave=clave, salon=salon, plantilla="resumen_respuestas"):
+                completo = False
+    return completo
+
+def _procesar():
+    pendientes = {}  # salon -> [intenciones]
+    avisados = set()  # salones sin operadora ya avisados en consola
+    con_error = set()  # salones cuyo último resumen no salió completo: se reintenta al vencer el intervalo
+    ultimo_resumen = time.monotonic()
+    while True:
+        try:
+            intencion = _cola.get(timeout=5)
+        except queue.Empty:
+            intencion = None
+
+        if intencion is not None:
+            # Vaciar lo que ya esté en cola para escribir en un solo bloque por salón
+            lotes = {}
+            while intencion is not None:
+                salon, registro = intencion
+                lotes.setdefault(salon, []).append(registro)
+                try:
+                    intencion = _cola.get_nowait()
+                except queue.Empty:
+                    intencion = None
+            for salon, lote in lotes.items():
+                try:
+                    _guardar_intenciones(salon, lote)
+                except Exception as e:
+                    print(f"⚠️ Error al guardar intenciones: {e}")
+                pendientes.setdefault(salon, []).extend(lote)
+
+        vencido = time.monotonic() - ultimo_resumen >= RESUMEN_INTERVALO_SEG
+        lleno = any(len(lote) >= RESUMEN_MAX and salon.operadoras and salon not in con_error
+                    for salon, lote in pendientes.items())
+        if pendientes and (vencido or lleno):
+            retenidos = {}
+            for salon, lote in pendientes.items():
+                try:
+                    enviado = _enviar_resumen(salon, lote)
+                except Exception as e:
+                    print(f"⚠️ Error al enviar resumen de respuestas: {e}")
+                    enviado = False
+                if enviado:
+                    avisados.discard(salon)
+                    con_error.discard(salon)
+                    continue
+                # No salió completo: se conserva para el próximo resumen (ya está en intenciones.jsonl)
+                retenidos[salon] = lote[-RESUMEN_RETENER:]
+                if salon.operadoras:
+                    con_error.add(salon)
+                    print(f"⚠️ El resumen de respuestas de {salon.nombre} no se envió completo; "
+                          f"se reintenta en {RESUMEN_INTERVALO_SEG}s.")
+                elif salon not in avisados:
+                    avisados.add(salon)
+                    print(f"⚠️ {salon.nombre} no tiene operadoras configuradas: el resumen de respuestas "
+                          f"de clientas queda pendiente hasta que se configure TELEFONOS_OPERADORAS.")
+            pendientes = retenidos
+            ultimo_resumen = time.monotonic()
+        elif not pendientes:
+            ultimo_resumen = time.monotonic()
+
+def iniciar_procesador():
+    """Arranca (una sola vez por proceso) el hilo que procesa la cola."""
+    global _hilo
+    if _hilo is not None and _hilo.is_alive():
+        return
+    with _hilo_lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_procesar, daemon=True)
+            _hilo.start()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-salón: varias estilistas atendidas por un mismo proceso.
+
+Cada salón (tenant) se identifica por su número de WhatsApp de Twilio (el
+campo 'To' que llega al webhook) y tiene sus propios datos en su directorio:
+clientas.json, citas.json, envios.jsonl, intenciones.jsonl, historial.bin,
+auditoria.jsonl, estados.jsonl y, opcionalmente,
+tratamientos.json (si no existe, el salón usa el catálogo general). Los datos
+se cargan en memoria sólo cuando se usan y los salones inactivos se descargan
+(LRU) para que un proceso pueda atender cientos. La carga desde disco se hace
+fuera del lock global (un salón frío no frena a los demás), y no se descarga
+un salón en uso (Salon.en_uso) ni uno usado en los últimos SALON_GRACIA_SEG.
+
+Configuración en salones.json (RUTA_SALONES):
+[
+    {
+        "numero": "whatsapp:+14155238886",
+        "nombre": "Salón Centro",
+        "directorio": "salones/centro",
+        "telefonos_operadoras": ["+573001112233"],
+        "hora_recordatorio": "10:00"
+    }
+]
+Los números que no aparecen en el archivo usan el salón por defecto
+(los archivos de siempre en el directorio de trabajo).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from catalogo import CatalogoTratamientos
+from citas import AgendaCitas
+from estados_entrega import RegistroEstados
+from historial import HistorialTratamientos, fecha_a_ordinal
+from registro_envios import RegistroEnvios
+
+RUTA_SALONES = os.getenv("RUTA_SALONES", "salones.json")
+MAX_SALONES_EN_MEMORIA = int(os.getenv("MAX_SALONES_EN_MEMORIA", "50"))
+SALON_INACTIVO_SEG = int(os.getenv("SALON_INACTIVO_SEG", "1800"))
+SALON_GRACIA_SEG = int(os.getenv("SALON_GRACIA_SEG", "60"))
+MAX_SESIONES = int(os.getenv("MAX_SESIONES", "5000"))
+DIAS_RETENCION_ENVIOS = int(os.getenv("DIAS_RETENCION_ENVIOS", "90"))
+
+
+def normalizar_telefono(telefono):
+    """Quita el prefijo whatsapp: y espacios para comparar números."""
+    return (telefono or "").replace("whatsapp:", "").replace(" ", "").strip()
+
+
+class Salon:
+    """Datos en memoria de un salón: clientas, índice de teléfonos, catálogo, agenda y sesiones."""
+
+    def __init__(self, numero, nombre=None, directorio=".", operadoras=(),
+                 hora_recordatorio="10:00", tratamientos=None,
+                 ruta_datos=None, ruta_envios=None, ruta_citas=None, ruta_intenciones=None,
+                 ruta_historial=None, ruta_auditoria=None, ruta_estados=None):
+        self.numero = numero
+        self.clave = normalizar_telefono(numero)
+        self.nombre = nombre or self.clave
+        self.directorio = directorio
+        self.operadoras = {normalizar_telefono(t) for t in operadoras if t and t.strip()}
+        self.hora_recordatorio = hora_recordatorio
+        self.ruta_datos = ruta_datos or os.path.join(directorio, "clientas.json")
+        self.ruta_intenciones = ruta_intenciones or os.path.join(directorio, "intenciones.jsonl")
+        self.ruta_auditoria = ruta_auditoria or os.path.join(directorio, "auditoria.jsonl")
+        self.tratamientos = tratamientos if tratamientos is not None else {}
+
+        # Lista de clientas: se modifica siempre en el mismo objeto (clientas[:] = ...)
+        self.clientas = []
+        # Índice {telefono: clienta} para ubicar en O(1) a quien escribe al webhook
+        self.indice_telefonos = {}
+        # Se incrementa cada vez que cambian las clientas (para invalidar índices derivados)
+        self.version_datos = 0
+        self.agenda = AgendaCitas(ruta_citas or os.path.join(directorio, "citas.json"))
+        self.registro_envios = RegistroEnvios(
+            ruta_envios or os.path.join(directorio, "envios.jsonl"),
+            retencion_dias=DIAS_RETENCION_ENVIOS,
+        )
+        # Estado de entrega de cada mensaje (status callbacks de Twilio), por SID
+        self.estados = RegistroEstados(
+            ruta_estados or os.path.join(directorio, "estados.jsonl"),
+            retencion_dias=DIAS_RETENCION_ENVIOS,
+        )
+        # Historial de visitas (append-only, compacto)
+        self.historial = HistorialTratamientos(ruta_historial or os.path.join(directorio, "historial.bin"))
+        # Sesiones conversacionales (LRU acotado)
+        self.sesiones = OrderedDict()
+        self.sesiones_lock = threading.Lock()
+        self.max_sesiones = MAX_SESIONES
+        self.ultimo_uso = time.monotonic()
+        # Tareas que lo están usando (peticiones, corridas, campañas): no se descarga
+        self.usos = 0
+        self._usos_lock = threading.Lock()
+
+    # ---------- Clientas ----------
+
+    def reconstruir_indice_telefonos(self):
+        nuevo = {}
+        for c in self.clientas:
+            tel = normalizar_telefono(c.get("telefono"))
+            if tel:
+                nuevo[tel] = c
+        self.indice_telefonos.clear()
+        self.indice_telefonos.update(nuevo)
+        self.version_datos += 1
+
+    def guardar_clientas(self):
+        """Guarda las clientas del salón en su clientas.json"""
+        self.reconstruir_indice_telefonos()
+        try:
+            # Escritura atómica: un corte a mitad de guardado no deja el archivo truncado.
+            # Temporal propio de cada hilo/proceso: dos guardados a la vez no se pisan el .tmp
+            tmp = f"{self.ruta_datos}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.clientas, f, ensure_ascii=False, indent=4)
+            os.replace(tmp, self.ruta_datos)
+            print("💾 Datos guardados correctamente.")
+        except Exception as e:
+            print(f"❌ Error al guardar datos: {e}")
+
+    def cargar_clientas(self):
+        """Carga las clientas del salón desde su clientas.json si existe"""
+        if os.path.exists(self.ruta_datos):
+            try:
+                with open(self.ruta_datos, "r", encoding="utf-8") as f:
+                    self.clientas[:] = json.load(f)
+                print(f"📂 {len(self.clientas)} clientas cargadas desde {self.ruta_datos}.")
+            except Exception as e:
+                print(f"⚠️ Error al cargar datos: {e}")
+                self.clientas[:] = []
+        else:
+            self.clientas[:] = []
+            print("📁 No existe archivo de datos. Se creará cuando agregues la primera clienta.")
+        self.reconstruir_indice_telefonos()
+
+    def cargar(self):
+        """Carga todo lo que el salón necesita en memoria."""
+        os.makedirs(self.directorio, exist_ok=True)
+        self.cargar_clientas()
+        self.agenda.cargar()
+        self.estados.cargar()
+        self.historial.cargar()
+        self.historial.sembrar_desde_clientas(self.clientas)
+        # Catálogo propio del salón (recarga en caliente); sin archivo, hereda el general
+        self.tratamientos = CatalogoTratamientos(
+            os.path.join(self.directorio, "tratamientos.json"), respaldo=self.tratamientos
+        )
+        return self
+
+    def registrar_tratamiento(self, clienta, antes=None):
+        """
+        Lleva al historial la visita actual de la clienta (ultimo_tratamiento + tipo).
+        Sin 'antes' es una visita nueva y se agrega. Con 'antes' (copia de la clienta
+        previa a la edición) es una corrección: se reemplaza la visita de la fecha
+        anterior, así un error de tipeo en la fecha no deja dos visitas.
+        """
+        cid = clienta.get("id")
+        fecha = clienta.get("ultimo_tratamiento")
+        tipo = clienta.get("tipo_tratamiento")
+        if antes is None or fecha_a_ordinal(antes.get("ultimo_tratamiento")) is None:
+            return self.historial.registrar(cid, fecha, tipo)
+        if antes.get("ultimo_tratamiento") == fecha and antes.get("tipo_tratamiento") == tipo:
+            return False
+        return self.historial.mover(cid, antes.get("ultimo_tratamiento"), fecha, tipo)
+
+    def buscar_clienta_por_telefono(self, telefono):
+        return self.indice_telefonos.get(normalizar_telefono(telefono))
+
+    def es_operadora(self, telefono):
+        return normalizar_telefono(telefono) in self.operadoras
+
+    def tocar(self):
+        self.ultimo_uso = time.monotonic()
+
+    @contextmanager
+    def en_uso(self):
+        """Marca el salón como en uso mientras dura el bloque (RegistroSalones no lo descarga)."""
+        with self._usos_lock:
+            self.usos += 1
+        self.tocar()
+        try:
+            yield self
+        finally:
+            with self._usos_lock:
+                self.usos -= 1
+            self.tocar()
+
+
+class RegistroSalones:
+    """
+    Enruta por número 'To' al salón correspondiente.
+    Carga perezosa + LRU de salones en memoria; el salón por defecto nunca se descarga.
+    """
+
+    def __init__(self, salon_defecto, tratamientos_defecto, ruta=RUTA_SALONES,
+                 max_en_memoria=MAX_SALONES_EN_MEMORIA, inactivo_seg=SALON_INACTIVO_SEG,
+                 gracia_seg=SALON_GRACIA_SEG):
+        self.defecto = salon_defecto
+        self.tratamientos_defecto = tratamientos_defecto
+        self.ruta = ruta
+        self.max_en_memoria = max_en_memoria
+        self.inactivo_seg = inactivo_seg
+        self.gracia_seg = gracia_seg
+        self._config = {}  # clave -> dict de configuración
+        self._cargados = OrderedDict()  # clave -> Salon
+        self._cargando = {}  # clave -> Event (un solo hilo carga cada salón)
+        self._lock = threading.RLock()
+        self.cargar_configuracion()
+
+    def cargar_configuracion(self):
+        """Lee salones.json (si existe)."""
+        config = {}
+        if os.path.exists(self.ruta):
+            try:
+                with open(self.ruta, "r", encoding="utf-8") as f:
+                    for item in json.load(f):
+                        config[normalizar_telefono(item["numero"])] = item
+                print(f"🏢 {len(config)} salones configurados en {self.ruta}.")
+                for item in config.values():
+                    if not item.get("telefonos_operadoras"):
+                        print(f"⚠️ {item.get('nombre') or item['numero']} no tiene telefonos_operadoras: "
+                              f"sus opciones de gestión quedan desactivadas.")
+            except Exception as e:
+                print(f"⚠️ Error al cargar {self.ruta}: {e}")
+        with self._lock:
+            self._config = config
+
+    def configurados(self):
+        """Lista de configuraciones de salones (sin cargarlos)."""
+        with self._lock:
+            return list(self._config.values())
+
+    @staticmethod
+    def directorio(item):
+        """Directorio de datos de un salón configurado (sin cargarlo)."""
+        return item.get("directorio") or os.path.join("salones", normalizar_telefono(item["numero"]).lstrip("+"))
+
+    def _crear(self, item):
+        clave = normalizar_telefono(item["numero"])
+        numero = item["numero"] if item["numero"].startswith("whatsapp:") else f"whatsapp:{clave}"
+        return Salon(
+            numero,
+            nombre=item.get("nombre"),
+            directorio=self.directorio(item),
+            operadoras=item.get("telefonos_operadoras", []),
+            hora_recordatorio=item.get("hora_recordatorio", "10:00"),
+            tratamientos=self.tratamientos_defecto,
+        ).cargar()
+
+    def obtener(self, numero):
+        """Salón para el número 'To' (o el salón por defecto si no está configurado)."""
+        clave = normalizar_telefono(numero)
+        while True:
+            with self._lock:
+                salon = self._cargados.get(clave)
+                if salon is not None:
+                    self._cargados.move_to_end(clave)
+                    salon.tocar()
+                    return salon
+                item = self._config.get(clave)
+                if item is None:
+                    self.defecto.tocar()
+                    return self.defecto
+                evento = self._cargando.get(clave)
+                if evento is None:
+                    evento = self._cargando[clave] = threading.Event()
+                    break
+            # Otro hilo lo está cargando: esperar y volver a mirar
+            evento.wait()
+
+        # Lectura de disco sin el lock global: los demás salones siguen atendiendo
+        try:
+            salon = self._crear(item)
+        except Exception:
+            with self._lock:
+                self._cargando.pop(clave, None)
+            evento.set()
+            raise
+        with self._lock:
+            self._cargados[clave] = salon
+            self._cargando.pop(clave, None)
+            salon.tocar()
+            self._recortar_lru()
+        evento.set()
+        return salon
+
+    def _ocupado(self, salon, ahora):
+        return salon.usos > 0 or ahora - salon.ultimo_uso < self.gracia_seg
+
+    def _recortar_lru(self):
+        """Descarga los menos usados si hay más de 'max_en_memoria' (nunca uno ocupado)."""
+        ahora = time.monotonic()
+        sobran = len(self._cargados) - self.max_en_memoria
+        for clave in list(self._cargados):
+            if sobran <= 0:
+                break
+            viejo = self._cargados[clave]
+            if self._ocupado(viejo, ahora):
+                continue
+            del self._cargados[clave]
+            sobran -= 1
+            print(f"🧹 Salón {viejo.nombre} descargado de memoria (LRU).")
+
+    def desalojar_inactivos(self):
+        """Descarga los salones sin uso en los últimos 'inactivo_seg' segundos (salvo los ocupados)."""
+        ahora = time.monotonic()
+        limite = ahora - self.inactivo_seg
+        with self._lock:
+            viejos = [k for k, s in self._cargados.items()
+                      if s.ultimo_uso < limite and not self._ocupado(s, ahora)]
+            for k in viejos:
+                del self._cargados[k]
+        return len(viejos)
+
+    def cargados(self):
+        """Salones configurados que ya están en memoria (no los carga ni los marca como usados)."""
+        with self._lock:
+            return list(self._cargados.values())
+
+    def en_memoria(self):
+        with self._lock:
+            return len(self._cargados)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidor stub local que imita POST /2010-04-01/Accounts/<SID>/Messages.json
+de Twilio, para medir el camino de envío sin tráfico real.
+
+Uso:
+    # Sólo el servidor (apunta estilista con TWILIO_API_BASE_URL=http://127.0.0.1:8099)
+    python stub_twilio.py --puerto 8099 --latencia-ms 80 --tasa-error 0.0
+
+    # Benchmark: levanta el stub y envía N mensajes con enviar_whatsapp desde H hilos
+    python stub_twilio.py --bench 500 --hilos 8
+
+Si el envío trae StatusCallback, el stub llama a esa URL como lo hace Twilio
+(sent -> delivered -> read, o failed con probabilidad --tasa-fallo-entrega),
+firmando con --auth-token si se indica.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+from twilio.request_validator import RequestValidator
+
+RUTA_MENSAJES = re.compile(r"^/2010-04-01/Accounts/([^/]+)/Messages\.json$")
+
+_contador_sid = itertools.count(1)
+
+
+class ManejadorStub(BaseHTTPRequestHandler):
+    """Responde como la API de mensajes de Twilio (latencia y errores configurables)."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Cabeceras y cuerpo salen en writes separados: con Nagle + ACK retardado cada
+    # petición sobre una conexión reutilizada esperaría ~40 ms
+    disable_nagle_algorithm = True
+    latencia_ms = 0
+    tasa_error = 0.0
+    tasa_fallo_entrega = 0.0
+    tasa_lectura = 0.5
+    auth_token = None
+    aceptados = 0  # mensajes aceptados (201) desde que arrancó
+    # Status callbacks enviados: latencia (s) y código HTTP recibido (o "sin respuesta")
+    callbacks_latencias = []
+    callbacks_codigos = {}
+    callbacks_lock = threading.Lock()
+
+    def _responder(self, codigo, payload):
+        cuerpo = json.dumps(payload).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_POST(self):
+        largo = int(self.headers.get("Content-Length", 0) or 0)
+        form = parse_qs(self.rfile.read(largo).decode("utf-8")) if largo else {}
+        m = RUTA_MENSAJES.match(self.path.split("?")[0])
+        if not m:
+            self._responder(404, {"code": 20404, "message": "Not found", "status": 404})
+            return
+
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000.0)
+        if self.tasa_error and random.random() < self.tasa_error:
+            self._responder(500, {"code": 20500, "message": "Stub: error simulado", "status": 500})
+            return
+
+        numero = next(_contador_sid)
+        ManejadorStub.aceptados = numero
+        sid = f"SMSTUB{numero:026d}"
+        callback = form.get("StatusCallback", [""])[0]
+        if callback:
+            threading.Thread(
+                target=_notificar_estados,
+                args=(callback, sid, m.group(1), form.get("To", [""])[0], form.get("From", [""])[0]),
+                daemon=True,
+            ).start()
+        self._responder(201, {
+            "sid": sid,
+            "account_sid": m.group(1),
+            "to": form.get("To", [""])[0],
+            "from": form.get("From", [""])[0],
+            "body": form.get("Body", [""])[0],
+            "status": "queued",
+            "num_segments": "1",
+            "direction": "outbound-api",
+            "api_version": "2010-04-01",
+            "uri": f"/2010-04-01/Accounts/{m.group(1)}/Messages/{sid}.json",
+        })
+
+    def log_message(self, format, *args):
+        pass  # Silencioso para no distorsionar el benchmark
+
+
+_sesion_callbacks = requests.Session()
+
+
+def _notificar_estados(url, sid, account_sid, to, from_):
+    """Simula los status callbacks de Twilio para un mensaje."""
+    if random.random() < ManejadorStub.tasa_fallo_entrega:
+        estados = [("sent", None), ("failed", "63016")]
+    else:
+        estados = [("sent", None), ("delivered", None)]
+        if random.random() < ManejadorStub.tasa_lectura:
+            estados.append(("read", None))
+    for estado, error in estados:
+        time.sleep(0.05)
+        params = {"MessageSid": sid, "MessageStatus": estado, "AccountSid": account_sid,
+                  "To": to, "From": from_}
+        if error:
+            params["ErrorCode"] = error
+        headers = {}
+        if ManejadorStub.auth_token:
+            headers["X-Twilio-Signature"] = RequestValidator(ManejadorStub.auth_token).compute_signature(url, params)
+        t0 = time.perf_counter()
+        try:
+            codigo = _sesion_callbacks.post(url, data=params, headers=headers, timeout=5).status_code
+        except requests.RequestException:
+            codigo = "sin respuesta"  # Twilio tampoco reintenta indefinidamente
+        with ManejadorStub.callbacks_lock:
+            ManejadorStub.callbacks_latencias.append(time.perf_counter() - t0)
+            ManejadorStub.callbacks_codigos[codigo] = ManejadorStub.callbacks_codigos.get(codigo, 0) + 1
+
+
+def iniciar_stub(puerto=8099, latencia_ms=0, tasa_error=0.0, tasa_fallo_entrega=0.0, auth_token=None):
+    """Arranca el stub en un hilo demonio y devuelve el servidor."""
+    ManejadorStub.latencia_ms = latencia_ms
+    ManejadorStub.tasa_error = tasa_error
+    ManejadorStub.tasa_fallo_entrega = tasa_fallo_entrega
+    ManejadorStub.auth_token = auth_token
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), ManejadorStub)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def benchmark(total, hilos, puerto):
+    """Envía 'total' mensajes con enviar_whatsapp y reporta throughput y latencias."""
+    os.environ["TWILIO_API_BASE_URL"] = f"http://127.0.0.1:{puerto}"
+    os.environ.pop("TWILIO_ACCOUNT_SID", None)
+    os.environ.pop("TWILIO_AUTH_TOKEN", None)
+    # Trabajar en un directorio temporal para no tocar clientas.json ni envios.jsonl reales
+    os.chdir(tempfile.mkdtemp(prefix="bench_estilista_"))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import estilista
+
+    latencias = []
+    lock = threading.Lock()
+
+    def enviar(i):
+        t0 = time.perf_counter()
+        ok = estilista.enviar_whatsapp(f"+57300{i:07d}", f"Mensaje de prueba {i}")
+        dt = time.perf_counter() - t0
+        with lock:
+            latencias.append(dt)
+        return bool(ok)
+
+    # Silenciar los print de cada envío
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=hilos) as ex:
+            resultados = list(ex.map(enviar, range(total)))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    duracion = time.perf_counter() - t0
+
+    latencias.sort()
+    def pct(p):
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000
+
+    ok = sum(resultados)
+    print(f"📊 {total} envíos con {hilos} hilos en {duracion:.2f}s -> {total / duracion:.1f} msg/s")
+    print(f"   OK: {ok}  Fallos: {total - ok}")
+    print(f"   Latencia p50={pct(0.50):.1f}ms  p95={pct(0.95):.1f}ms  p99={pct(0.99):.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub local de la API de mensajes de Twilio")
+    parser.add_argument("--puerto", type=int, default=8099)
+    parser.add_argument("--latencia-ms", type=int, default=0)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--tasa-fallo-entrega", type=float, default=0.0,
+                        help="Probabilidad de que el status callback reporte 'failed'")
+    parser.add_argument("--auth-token", default=None, help="Token para firmar los status callbacks")
+    parser.add_argument("--bench", type=int, default=0, help="Número de envíos para el benchmark")
+    parser.add_argument("--hilos", type=int, default=8)
+    args = parser.parse_args()
+
+    servidor = iniciar_stub(args.puerto, args.latencia_ms, args.tasa_error,
+                            args.tasa_fallo_entrega, args.auth_token)
+    if args.bench:
+        benchmark(args.bench, args.hilos, args.puerto)
+        servidor.shutdown()
+    else:
+        print(f"🧪 Stub Twilio escuchando en http://127.0.0.1:{args.puerto} (Ctrl+C para salir)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            servidor.shutdown()
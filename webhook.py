@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 """
 Webhook para WhatsApp (Twilio Sandbox) + loop de recordatorios en background.
-Endpoint principal: POST /whatsapp  (recibe From y Body de Twilio)
+Endpoint principal: POST /whatsapp  (recibe From, To y Body de Twilio; To identifica el salón)
+Estados de entrega: POST /status  (status callback de Twilio; From identifica el salón)
 Health: GET / (o /health)
 Start command recomendado en Render: gunicorn webhook:app -b 0.0.0.0:$PORT -w 1
 """
@@ -14,11 +15,22 @@ import sys
 import traceback
 
 # Importar las funciones desde estilista.py
-from estilista import cargar_clientas, iniciar_sistema
+from estilista import (cargar_clientas, iniciar_sistema, buscar_clienta_por_telefono, es_operadora,
+                       salones, TWILIO_AUTH_TOKEN, STATUS_CALLBACK_URL)
 
 # Importar el sistema conversacional
 from conversational import procesar_mensaje, mensaje_menu
 
+# Respuestas de clientas a los recordatorios (se procesan en segundo plano)
+from respuestas import encolar_respuesta
+
+# Protección contra abuso: firma de Twilio + límite de mensajes por remitente
+from proteccion import LimitadorTasa, firma_valida
+
+# Validar firma sólo si hay token (en modo debug no hay con qué validar)
+VALIDAR_FIRMA = bool(TWILIO_AUTH_TOKEN) and os.getenv("VALIDAR_FIRMA_TWILIO", "1") == "1"
+limitador = LimitadorTasa()
+
 app = Flask(__name__)
 
 # Cargar clientas al iniciar
@@ -40,22 +52,36 @@ def health():
 @app.route("/whatsapp", methods=["POST"])
 def whatsapp_webhook():
     """Webhook principal que maneja mensajes de WhatsApp usando sistema conversacional."""
+    if VALIDAR_FIRMA and not firma_valida(request, TWILIO_AUTH_TOKEN):
+        return Response("Firma inválida\n", status=403)
+
     try:
         from_num = request.form.get("From", "")
+        to_num = request.form.get("To", "")
         body = request.form.get("Body", "").strip()
     except Exception as e:
         return safe_reply_xml("Error leyendo el mensaje."), 400
 
     # Extraer número limpio (quitar whatsapp: prefix si existe)
     telefono = from_num.replace("whatsapp:", "").strip()
+
+    if not limitador.permitir(telefono):
+        # Respuesta vacía: no se gasta un mensaje saliente en quien satura el webhook
+        return Response("<?xml version='1.0' encoding='UTF-8'?><Response/>", status=429, mimetype='application/xml')
     
     try:
-        # Si es el primer mensaje, mostrar menú
-        if not body:
-            reply = mensaje_menu()
-        else:
-            # Procesar mensaje según estado de sesión
-            reply = procesar_mensaje(telefono, body)
+        # Cada salón se identifica por su número de Twilio (campo To)
+        with salones.obtener(to_num).en_uso() as salon:
+            clienta = None if es_operadora(telefono, salon) else buscar_clienta_por_telefono(telefono, salon)
+            # Si es el primer mensaje, mostrar menú
+            if not body:
+                reply = mensaje_menu()
+            elif clienta:
+                # Una clienta contesta un recordatorio: encolar y responder sin bloquear
+                reply = encolar_respuesta(clienta, telefono, body, salon)
+            else:
+                # Procesar mensaje según estado de sesión
+                reply = procesar_mensaje(telefono, body, salon)
     except Exception as e:
         tb = traceback.format_exc()
         print("Error al procesar webhook:", tb, file=sys.stderr)
@@ -63,6 +89,26 @@ def whatsapp_webhook():
 
     return safe_reply_xml(reply)
 
+@app.route("/status", methods=["POST"])
+def status_callback():
+    """Status callback de Twilio: actualiza el estado de entrega del mensaje (sin tocar disco)."""
+    if VALIDAR_FIRMA and not firma_valida(request, TWILIO_AUTH_TOKEN, STATUS_CALLBACK_URL):
+        return Response("Firma inválida\n", status=403)
+
+    sid = request.form.get("MessageSid") or request.form.get("SmsSid")
+    estado = (request.form.get("MessageStatus") or request.form.get("SmsStatus") or "").lower()
+    if not sid or not estado:
+        return Response("Faltan MessageSid o MessageStatus\n", status=400)
+
+    try:
+        # Los mensajes salen desde el número del salón: From identifica el salón
+        with salones.obtener(request.form.get("From", "")).en_uso() as salon:
+            salon.estados.actualizar(sid, estado, request.form.get("ErrorCode") or None)
+    except Exception:
+        print("Error al procesar status callback:", traceback.format_exc(), file=sys.stderr)
+        return Response(status=500)
+    return Response(status=204)
+
 # ---------- Background logic: iniciar schedule en hilo ----------
 def start_background_logic():
     try: